@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+"""
+Fidelity and throughput benchmark for the col2block colour matchers.
+
+Compares the per-voxel col2block call, the exact batched KDTree path and the
+quantized LUT fast path on random opaque colours.
+
+Run from the server directory:
+    python benchmarks/bench_col2block.py [--n 32768] [--repeat 5] [--lut-bits 8]
+"""
+
+import argparse
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+
+_SCHEMGEN_DIR = Path(__file__).parent.parent / "schemgen"
+if str(_SCHEMGEN_DIR) not in sys.path:
+    sys.path.insert(0, str(_SCHEMGEN_DIR))
+
+import col2block  # noqa: E402 (needs sys.path patch above)
+
+
+def _best_of(fn, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - t0)
+    return best
+
+
+def fidelity(rgba: np.ndarray) -> None:
+    exact = col2block.col2index(rgba, exact=True)
+    fast = col2block.col2index(rgba, exact=False)
+
+    # Oklab distance between the block each path picked, ignoring alpha
+    palette = col2block.colors[:, :3]
+    err = np.linalg.norm(palette[exact] - palette[fast], axis=1)
+
+    print(f"LUT {col2block.lut.shape[0]}^3 fidelity over {len(rgba)} colours")
+    print(f"  exact match rate  : {np.mean(exact == fast):.2%}")
+    print(f"  mean Oklab error  : {err.mean():.5f}")
+    print(f"  p99 Oklab error   : {np.percentile(err, 99):.5f}")
+    print(f"  max Oklab error   : {err.max():.5f}")
+
+
+def throughput(rgba: np.ndarray, repeat: int) -> None:
+    n = len(rgba)
+    # The scalar path is slow, so time it on a slice and extrapolate
+    n_scalar = min(n, 2000)
+    t_scalar = _best_of(lambda: [col2block.col2block(c) for c in rgba[:n_scalar]], 1)
+    t_scalar *= n / n_scalar
+    t_exact = _best_of(lambda: col2block.col2index(rgba, exact=True), repeat)
+    t_lut = _best_of(lambda: col2block.col2index(rgba, exact=False), repeat)
+
+    print(f"\nThroughput over {n} colours (best of {repeat})")
+    for name, t in (("col2block per voxel", t_scalar),
+                    ("col2index exact", t_exact),
+                    ("col2index LUT", t_lut)):
+        print(f"  {name:<20}: {t * 1e3:9.2f} ms  {n / t / 1e6:8.2f} M colours/s  "
+              f"x{t_scalar / t:.0f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--n", type=int, default=32 ** 3, help="number of colours")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--lut-bits", type=int, default=None,
+                        help="benchmark an in-memory LUT of this resolution "
+                             "instead of the one on disk")
+    args = parser.parse_args()
+
+    if args.lut_bits is not None:
+        import preprocess
+        col2block.load()
+        col2block.lut = preprocess.build_lut(col2block.get_tree(), args.lut_bits)
+
+    rng = np.random.default_rng(args.seed)
+    rgba = np.ones((args.n, 4), dtype=np.float32)
+    rgba[:, :3] = rng.random((args.n, 3), dtype=np.float32)
+
+    fidelity(rgba)
+    throughput(rgba, args.repeat)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+"""
+Benchmark of the conversion stage, sample -> block list.
+
+Times each step voxel_to_build() runs after loading a sample - gathering
+and centring the occupied voxels, colour matching plus layout
+(voxels_to_build) - and the block list the response is encoded from
+(response_format.block_columns). For comparison it also times the previous
+centring, which np.roll-ed the float colour and occupancy volumes before
+gathering, and counts the samples where that roll wrapped voxels around the
+grid edge.
+
+Then, for hollow spheres in growing grids (--grids), compares the sparse
+build (VoxelBuild.voxels) with the dense [height, length, width] volume the
+build used to carry: bytes held and conversion time per sample.
+
+Run from the server directory:
+    python benchmarks/bench_convert.py [--samples 200] [--repeat 3] [--grids 32 64 128]
+
+Uses the local voxel store when it has been built, else random blobs.
+"""
+
+import argparse
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+import response_format  # noqa: E402 (needs sys.path patch above)
+from retrieval import voxel_store  # noqa: E402
+from retrieval import voxel_to_schem as V  # noqa: E402
+
+GRID = 32
+
+
+def _blob(rng) -> tuple[np.ndarray, np.ndarray]:
+    """Random ellipsoid with noisy colours, often close to an edge."""
+    centre = rng.uniform(4, GRID - 4, 3)
+    radii = rng.uniform(3, 12, 3)
+    x, y, z = np.ogrid[:GRID, :GRID, :GRID]
+    occupied = (((x - centre[0]) / radii[0]) ** 2 + ((y - centre[1]) / radii[1]) ** 2
+                + ((z - centre[2]) / radii[2]) ** 2) <= 1
+    colors = np.clip(rng.uniform(0, 1, (3, 1, 1, 1))
+                     + rng.normal(0, 0.05, (3, GRID, GRID, GRID)), 0, 1)
+    return (colors * 255).astype(np.uint8), occupied
+
+
+def _samples(n: int) -> list:
+    """Dense (colors, occupied) samples."""
+    if voxel_store.is_available():
+        voxel_store.open_store()
+        n = min(n, voxel_store.store_size())
+        print(f"{n} samples from the voxel store")
+        samples = (voxel_store.get_sample(i) for i in range(n))
+        return [(colors, voxel_store.unpack_occupancy(packed)) for colors, packed in samples]
+    print(f"{n} random blob samples (voxel store not built)")
+    rng = np.random.default_rng(0)
+    return [_blob(rng) for _ in range(n)]
+
+
+def _roll_centered(colors_u8: np.ndarray, occupied: np.ndarray):
+    """The previous centring: float volumes, three np.roll calls each."""
+    colors = colors_u8.astype(np.float32) / 255.0
+    occ = occupied[None].astype(np.float32)
+    coords = np.argwhere(occ[0] > 0.5)
+    shift = np.array([16, 16, 16]) - coords.mean(axis=0).astype(int)
+    for ax, s in enumerate(shift):
+        colors = np.roll(colors, int(s), axis=ax + 1)
+        occ = np.roll(occ, int(s), axis=ax + 1)
+    mask = occ[0] > 0.5
+    return np.argwhere(mask), colors[:, mask].T
+
+
+def _shape(coords: np.ndarray) -> np.ndarray:
+    """Voxel positions relative to their bounding box, in a canonical order."""
+    rel = coords - coords.min(axis=0)
+    return rel[np.lexsort(rel.T)]
+
+
+def _time_each(fn, items, repeat: int) -> tuple[float, list]:
+    """Best-of-repeat mean seconds per item, and the results."""
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        results = [fn(*item) for item in items]
+        best = min(best, (time.perf_counter() - t0) / len(items))
+    return best, results
+
+
+def _gather_centred(colors: np.ndarray, occupied: np.ndarray):
+    return V._centered_voxels(*V._gather(colors, occupied), occupied.shape[0])
+
+
+def _to_block_list(colors: np.ndarray, occupied: np.ndarray) -> tuple:
+    build = V.voxels_to_build(*_gather_centred(colors, occupied))
+    return response_format.block_columns(build.voxels, build.palette)
+
+
+def _shell(grid: int, rng) -> tuple[np.ndarray, np.ndarray]:
+    """Hollow sphere filling the grid, noisy colours: (coords, rgb)."""
+    x, y, z = np.ogrid[:grid, :grid, :grid]
+    r = np.sqrt((x - grid / 2) ** 2 + (y - grid / 2) ** 2 + (z - grid / 2) ** 2)
+    coords = np.argwhere(np.abs(r - grid * 0.45) < 1.0)
+    rgb = np.clip(0.5 + rng.normal(0, 0.2, (len(coords), 3)), 0, 1).astype(np.float32)
+    return coords, rgb
+
+
+def _sparse_vs_dense(grids: list, repeat: int) -> None:
+    rng = np.random.default_rng(1)
+    print(f"\nHollow sphere builds (best of {repeat})")
+    print(f"  {'grid':>5} {'blocks':>8} {'sparse KiB':>11} {'dense KiB':>10} {'build ms':>9}")
+    for grid in grids:
+        coords, rgb = _shell(grid, rng)
+        t, (build,) = _time_each(V.voxels_to_build, [(coords, rgb)], repeat)
+        sparse = sum(a.nbytes for a in build.voxels[3:])
+        dense = build.width * build.height * build.length * np.dtype(np.uint16).itemsize
+        print(f"  {grid:>4}^3 {build.voxels.count:8d} {sparse / 1024:11.1f} "
+              f"{dense / 1024:10.1f} {t * 1e3:9.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--samples", type=int, default=200)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--grids", type=int, nargs="+", default=[32, 64, 128])
+    args = parser.parse_args()
+
+    samples = _samples(args.samples)
+    print(f"  {np.mean([occ.sum() for _, occ in samples]):.0f} occupied voxels "
+          f"per sample on average\n")
+    V.voxels_to_build(*_gather_centred(*samples[0]))  # warm-up
+
+    t_roll, rolled = _time_each(_roll_centered, samples, args.repeat)
+    t_centre, centred = _time_each(_gather_centred, samples, args.repeat)
+    t_build, builds = _time_each(V.voxels_to_build, centred, args.repeat)
+    t_columns, _ = _time_each(response_format.block_columns,
+                              [(b.voxels, b.palette) for b in builds], args.repeat)
+    t_total, _ = _time_each(_to_block_list, samples, args.repeat)
+
+    wrapped = sum(not np.array_equal(_shape(c), _shape(r))
+                  for (c, _), (r, _) in zip(centred, rolled))
+
+    print(f"Per sample (best of {args.repeat})")
+    for name, t in (
+        ("np.roll centring + gather", t_roll),
+        ("vectorized centring + gather", t_centre),
+        ("matching + layout", t_build),
+        ("block list", t_columns),
+        ("sample -> block list", t_total),
+    ):
+        print(f"  {name:<30} {t * 1e3:8.3f} ms")
+    print(f"\nCentring x{t_roll / t_centre:.1f} faster; np.roll wrapped voxels around "
+          f"the grid edge in {wrapped}/{len(samples)} samples")
+
+    _sparse_vs_dense(args.grids, args.repeat)
+
+
+if __name__ == "__main__":
+    main()
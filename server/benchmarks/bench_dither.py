@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+"""
+Benchmark of the dithering modes against plain nearest-colour matching.
+
+Times voxels_to_build() with dither="none" / "ordered" / "diffusion" on a
+fully occupied 32^3 and 64^3 grid filled with a smooth colour gradient, and
+checks each mode against the latency budget stated in schemgen/dither.py.
+"none" is the default exact (KDTree) match; the dithering modes always
+use the colour lookup table, so their extra time is measured over
+"none lut", plain matching through the same table (COL2BLOCK_LUT=1). Quality is the mean sRGB error of the matched
+colours after a 4^3 box blur, roughly what a build looks like from a few
+blocks away: dithering raises the per-voxel error but should lower this one.
+
+Run from the server directory:
+    python benchmarks/bench_dither.py [--sizes 32 64] [--repeat 5]
+"""
+
+import argparse
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from retrieval import voxel_to_schem as V  # noqa: E402 (needs sys.path patch above)
+import dither  # noqa: E402 (on sys.path via voxel_to_schem)
+
+# Extra milliseconds over nearest-colour matching, per fully occupied grid
+BUDGET_MS = {
+    32: {"ordered": 5, "diffusion": 50},
+    64: {"ordered": 40, "diffusion": 400},
+}
+
+
+def _gradient(size: int, rng) -> tuple[np.ndarray, np.ndarray]:
+    """Every cell of a size^3 grid, coloured by a gradient plus a little noise."""
+    coords = np.argwhere(np.ones((size, size, size), dtype=bool))
+    rgb = coords / (size - 1) * [0.8, 0.5, 0.9] + [0.1, 0.3, 0.05]
+    rgb = np.clip(rgb + rng.normal(0, 0.01, rgb.shape), 0, 1).astype(np.float32)
+    return coords, rgb
+
+
+def _best_of(fn, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - t0)
+    return best
+
+
+def _blurred_error(coords, rgb, ids, size: int, box: int = 4) -> float:
+    """Mean abs error between box-averaged matched and target colours."""
+    grid = np.zeros((2, size, size, size, 3), dtype=np.float32)
+    grid[0][tuple(coords.T)] = dither.palette_rgb()[ids]
+    grid[1][tuple(coords.T)] = rgb
+    n = size // box
+    blurred = grid.reshape(2, n, box, n, box, n, box, 3).mean(axis=(2, 4, 6))
+    return float(np.abs(blurred[0] - blurred[1]).mean())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[32, 64])
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    V.load_converter()
+    rng = np.random.default_rng(0)
+    over_budget = 0
+    for size in args.sizes:
+        coords, rgb = _gradient(size, rng)
+        print(f"\n{size}^3 grid, {len(coords)} voxels (best of {args.repeat})")
+        print(f"  {'mode':<10} {'build ms':>9} {'extra ms':>9} {'budget':>7} "
+              f"{'voxel err':>10} {'blurred err':>12} {'blocks':>7}")
+        base = None
+        for label, mode, lut in [("none", "none", False), ("none lut", "none", True),
+                                 *[(m, m, False) for m in dither.DITHER_MODES if m != "none"]]:
+            dither.col2block.USE_LUT = lut
+            V.voxels_to_build(coords, rgb, mode)  # warm-up
+            t = _best_of(lambda: V.voxels_to_build(coords, rgb, mode), args.repeat)
+            ids = dither.dither_index(coords, rgb, mode)
+            dither.col2block.USE_LUT = False
+            base = t if lut else base
+            voxel_err = float(np.abs(dither.palette_rgb()[ids] - rgb).mean())
+            extra_ms = (t - base) * 1e3 if base is not None else 0.0
+            budget = BUDGET_MS.get(size, {}).get(mode)
+            if budget is None:
+                verdict = "-"
+            elif extra_ms <= budget:
+                verdict = "ok"
+            else:
+                verdict = "OVER"
+                over_budget += 1
+            print(f"  {label:<10} {t * 1e3:9.2f} {extra_ms:9.2f} {verdict:>7} "
+                  f"{voxel_err:10.4f} {_blurred_error(coords, rgb, ids, size):12.4f} "
+                  f"{len(np.unique(ids)):7d}")
+
+    if over_budget:
+        sys.exit(f"\n{over_budget} mode(s) over budget")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+"""
+Import-time and steady-state benchmark for the col2block matcher.
+
+Each cold measurement runs in a fresh interpreter:
+  import      `import col2block` (the .npy artifacts load lazily)
+  first call  first col2index() call, which loads the artifacts
+  pickle      unpickling the old kdtree/colors/col2tex_map files and
+              rebuilding the name array from the float-tuple map, if those
+              files are still on disk
+Steady state times col2index() + name lookup on a sample-sized batch
+against the old per-colour col2tex_map[tuple(...)] lookup.
+
+Run from the server directory:
+    python benchmarks/bench_matcher_load.py [--runs 5] [--n 2000]
+"""
+
+import argparse
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+
+_SCHEMGEN_DIR = Path(__file__).parent.parent / "schemgen"
+
+_PRELUDE = f"""
+import resource, sys, time
+sys.path.insert(0, {str(_SCHEMGEN_DIR)!r})
+import numpy as np
+rgba = np.ones((64, 4), dtype=np.float32)
+"""
+
+_COLD = {
+    "import": "t0 = time.perf_counter(); import col2block; dt = time.perf_counter() - t0",
+    "first call": "import col2block; t0 = time.perf_counter(); "
+                  "col2block.col2blocks(rgba); dt = time.perf_counter() - t0",
+    "pickle": """
+import pickle
+t0 = time.perf_counter()
+root = __import__("pathlib").Path(sys.path[0])
+tree = pickle.load(open(root / "kdtree.pkl", "rb"))
+colors = pickle.load(open(root / "colors.pkl", "rb"))
+col2tex_map = pickle.load(open(root / "col2tex_map.pkl", "rb"))
+names = np.array([col2tex_map[tuple(c)] for c in colors])
+dt = time.perf_counter() - t0
+""",
+}
+_REPORT = "print(dt, resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)"
+
+
+def _cold(snippet: str, runs: int) -> tuple[float, float]:
+    """Best-of-runs seconds and max RSS (MiB) of snippet in a fresh process."""
+    best, rss = float("inf"), 0.0
+    for _ in range(runs):
+        out = subprocess.run([sys.executable, "-c", _PRELUDE + snippet + "\n" + _REPORT],
+                             capture_output=True, text=True, check=True).stdout.split()
+        best = min(best, float(out[-2]))
+        rss = float(out[-1]) / 1024
+    return best, rss
+
+
+def _best_of(fn, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - t0)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--runs", type=int, default=5, help="fresh processes per cold timing")
+    parser.add_argument("--n", type=int, default=2000, help="colours per steady-state call")
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    print(f"Cold start (best of {args.runs} processes)")
+    have_pickles = all((_SCHEMGEN_DIR / f).exists()
+                       for f in ("kdtree.pkl", "colors.pkl", "col2tex_map.pkl"))
+    for name, snippet in _COLD.items():
+        if name == "pickle" and not have_pickles:
+            print(f"  {name:<12} skipped, no pickle files")
+            continue
+        secs, rss = _cold(snippet, args.runs)
+        print(f"  {name:<12} {secs * 1e3:9.2f} ms   max RSS {rss:7.1f} MiB")
+
+    sys.path.insert(0, str(_SCHEMGEN_DIR))
+    import col2block
+
+    col2block.load()
+    rng = np.random.default_rng(0)
+    rgba = np.ones((args.n, 4), dtype=np.float32)
+    rgba[:, :3] = rng.random((args.n, 3), dtype=np.float32)
+
+    ids = col2block.col2index(rgba)
+    col2tex_map = {tuple(c): name for c, name in zip(col2block.colors, col2block.block_names)}
+    t_names = _best_of(lambda: col2block.block_names[col2block.col2index(rgba)], args.repeat)
+    t_tuple = _best_of(lambda: [col2tex_map[tuple(col2block.colors[i])] for i in
+                                col2block.col2index(rgba)], args.repeat)
+    t_ids = _best_of(lambda: col2block.col2index(rgba), args.repeat)
+
+    print(f"\nSteady state, {args.n} colours per call (best of {args.repeat})")
+    for name, t in (("col2index", t_ids),
+                    ("+ block_names[ids]", t_names),
+                    ("+ col2tex_map[tuple]", t_tuple)):
+        print(f"  {name:<22} {t * 1e3:8.3f} ms")
+    assert (col2block.block_names[ids] == np.array(
+        [col2tex_map[tuple(col2block.colors[i])] for i in ids])).all()
+
+
+if __name__ == "__main__":
+    main()
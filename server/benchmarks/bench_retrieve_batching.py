@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+"""
+Load test for micro-batched CLIP retrieval (retrieval/batcher.py).
+
+Runs the same closed-loop load - `--clients` threads each issuing prompts
+back to back - once calling retrieve() directly (unbatched, as the thread
+pool would) and once through RetrievalBatcher, and reports p50/p99 latency
+and requests per second.
+
+Run from the server directory:
+    python benchmarks/bench_retrieve_batching.py [--clients 16] [--requests 512]
+
+Uses the real faiss.index when it exists, else --synthetic N random vectors.
+--random-weights builds ViT-B/32 without downloading its weights; the
+timings are the same, only the retrieved indices are meaningless.
+"""
+
+import argparse
+import sys
+import threading
+import time
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from retrieval import retrieve as R  # noqa: E402 (needs sys.path patch above)
+from retrieval.batcher import RetrievalBatcher  # noqa: E402
+
+PROMPTS = [
+    "a medieval castle", "small wooden cabin", "stone tower with a red roof",
+    "a pirate ship", "modern glass house", "desert temple", "tree house",
+    "japanese pagoda", "lighthouse on a cliff", "giant mushroom",
+]
+
+
+def _load(args) -> None:
+    import clip
+    import faiss
+    import torch
+
+    if R._INDEX_PATH.exists() and not args.synthetic:
+        if args.random_weights:
+            raise SystemExit("--random-weights needs --synthetic")
+        R.load_index()
+        return
+
+    R._clip_device = "cuda" if torch.cuda.is_available() else "cpu"
+    if args.random_weights:
+        R._clip_model = clip.model.CLIP(
+            embed_dim=512, image_resolution=224, vision_layers=12, vision_width=768,
+            vision_patch_size=32, context_length=77, vocab_size=49408,
+            transformer_width=512, transformer_heads=8, transformer_layers=12,
+        ).to(R._clip_device).eval()
+    else:
+        R._clip_model, _ = clip.load("ViT-B/32", device=R._clip_device)
+        R._clip_model.eval()
+
+    n = args.synthetic or 100_000
+    vecs = np.random.default_rng(0).standard_normal((n, 512)).astype("float32")
+    vecs /= np.linalg.norm(vecs, axis=1, keepdims=True)
+    R._index = faiss.IndexFlatIP(512)
+    R._index.add(vecs)
+    R._index_map = list(range(n))
+
+
+def load_test(call, clients: int, requests: int) -> tuple[np.ndarray, float]:
+    latencies = []
+    lock = threading.Lock()
+    counter = iter(range(requests))
+
+    def client():
+        while True:
+            with lock:
+                i = next(counter, None)
+            if i is None:
+                return
+            t0 = time.perf_counter()
+            call(f"{PROMPTS[i % len(PROMPTS)]} #{i}")
+            dt = time.perf_counter() - t0
+            with lock:
+                latencies.append(dt)
+
+    threads = [threading.Thread(target=client) for _ in range(clients)]
+    t0 = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return np.array(latencies), time.perf_counter() - t0
+
+
+def report(name: str, latencies: np.ndarray, elapsed: float) -> None:
+    p50, p99 = np.percentile(latencies, [50, 99]) * 1e3
+    print(f"  {name:<32} p50 {p50:8.1f} ms   p99 {p99:8.1f} ms   "
+          f"{len(latencies) / elapsed:7.1f} req/s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--clients", type=int, default=16)
+    parser.add_argument("--requests", type=int, default=512)
+    parser.add_argument("--max-batch", type=int, default=32)
+    parser.add_argument("--window-ms", type=float, nargs="+", default=[2, 5, 10])
+    parser.add_argument("--synthetic", type=int, default=0,
+                        help="search N random vectors instead of faiss.index")
+    parser.add_argument("--random-weights", action="store_true")
+    args = parser.parse_args()
+
+    _load(args)
+    R.retrieve(PROMPTS[0])  # warm-up
+
+    print(f"{args.clients} clients, {args.requests} requests, "
+          f"index of {R.index_size()} vectors")
+    report("unbatched", *load_test(R.retrieve, args.clients, args.requests))
+    for window_ms in args.window_ms:
+        batcher = RetrievalBatcher(max_batch=args.max_batch, window_s=window_ms / 1e3)
+        latencies, elapsed = load_test(batcher.retrieve, args.clients, args.requests)
+        batcher.close()
+        report(f"batched {window_ms:g} ms "
+               f"(avg batch {batcher.stats()['avg_batch']:.1f})", latencies, elapsed)
+
+
+if __name__ == "__main__":
+    main()
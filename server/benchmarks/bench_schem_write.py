@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+"""
+Benchmark of .schem writing: sponge.write_schem against mcschematic.
+
+For a random build of each size, times writing a .schem to disk the
+previous way (one mcschematic setBlock call per block, then schem.save)
+and with sponge.write_schem (vectorized BlockData from the palette id
+volume, gzipped once), at each --levels gzip level. Both files are read
+back and checked to hold the same blocks at the same WorldEdit offset.
+
+Run from the server directory:
+    python benchmarks/bench_schem_write.py [--sizes 32 128] [--fill 0.3]
+
+The mcschematic columns are skipped when it is not installed
+(pip install mcschematic).
+"""
+
+import argparse
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).parent.parent / "schemgen"))
+
+from sponge import read_schem, write_schem  # noqa: E402 (needs sys.path patch above)
+
+try:
+    import mcschematic
+except ImportError:
+    mcschematic = None
+
+OFFSET = (3, 1, 5)
+
+
+def _volume(size: int, fill: float, rng) -> tuple[list, np.ndarray]:
+    palette = ["minecraft:air"] + [f"minecraft:block_{i}" for i in range(200)]
+    volume = rng.integers(1, len(palette), (size, size, size)).astype(np.uint16)
+    volume[rng.random(volume.shape) >= fill] = 0
+    # Keep the corners solid so both writers use the full extent
+    volume[0, 0, 0] = volume[-1, -1, -1] = 1
+    return palette, volume
+
+
+def _mcschematic(path: Path, palette: list, volume: np.ndarray) -> None:
+    schem = mcschematic.MCSchematic()
+    ys, zs, xs = np.nonzero(volume)
+    ox, oy, oz = OFFSET
+    for x, y, z, i in zip(xs.tolist(), ys.tolist(), zs.tolist(), volume[ys, zs, xs].tolist()):
+        schem.setBlock((x + ox, y + oy, z + oz), palette[i])
+    schem.save(str(path.parent), path.stem, mcschematic.Version.JE_1_21_5)
+
+
+def _blocks(path: Path) -> tuple[np.ndarray, tuple]:
+    """Block state per cell, and the offset, of a .schem file."""
+    palette, volume, offset = read_schem(path)
+    return np.array(palette, dtype=object)[volume], offset
+
+
+def _best_of(fn, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - t0)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[32, 128])
+    parser.add_argument("--fill", type=float, default=0.3, help="fraction of solid voxels")
+    parser.add_argument("--levels", type=int, nargs="+", default=[1, 6, 9],
+                        help="gzip levels for write_schem")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    tmp = Path(tempfile.mkdtemp())
+    for size in args.sizes:
+        palette, volume = _volume(size, args.fill, rng)
+        print(f"\n{size}^3 volume, {np.count_nonzero(volume)} blocks (best of {args.repeat})")
+        print(f"  {'writer':<22} {'ms':>10} {'KiB':>9}")
+
+        reference = None
+        if mcschematic is not None:
+            path = tmp / "mcschematic.schem"
+            t = _best_of(lambda: _mcschematic(path, palette, volume), args.repeat)
+            reference = _blocks(path)
+            print(f"  {'mcschematic':<22} {t * 1e3:10.1f} {path.stat().st_size / 1024:9.1f}")
+
+        for level in args.levels:
+            path = tmp / f"native_{level}.schem"
+            t = _best_of(lambda: write_schem(path, palette, volume, OFFSET, gzip_level=level),
+                         args.repeat)
+            print(f"  {f'write_schem gzip {level}':<22} {t * 1e3:10.1f} "
+                  f"{path.stat().st_size / 1024:9.1f}")
+            if reference is not None:
+                blocks, offset = _blocks(path)
+                if offset != reference[1] or not np.array_equal(blocks, reference[0]):
+                    sys.exit(f"write_schem gzip {level} differs from mcschematic at {size}^3")
+
+
+if __name__ == "__main__":
+    main()
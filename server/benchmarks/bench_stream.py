@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+"""
+Benchmark of streamed (/generate/stream) against whole-body /generate encoding.
+
+For a random solid build of each size, times the default JSON body
+(main.encode_response) and the NDJSON stream (response_format.iter_layers):
+time until the first block can be sent, total time, and peak Python heap
+allocation during encoding (tracemalloc). Retrieval and conversion are the
+same for both and are not included.
+
+Run from the server directory:
+    python benchmarks/bench_stream.py [--sizes 32 64 128] [--fill 0.3]
+"""
+
+import argparse
+import sys
+import time
+import tracemalloc
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+import response_format  # noqa: E402 (needs sys.path patch above)
+from main import encode_response, response_meta  # noqa: E402
+from retrieval.voxel_to_schem import VoxelBuild  # noqa: E402
+from sparse import SparseVolume  # noqa: E402 (on sys.path via response_format)
+
+
+def _build(size: int, fill: float, rng) -> VoxelBuild:
+    palette = ["minecraft:air"] + [f"minecraft:block_{i}" for i in range(200)]
+    blocks = rng.integers(1, len(palette), (size, size, size)).astype(np.uint16)
+    blocks[rng.random(blocks.shape) >= fill] = 0
+    return VoxelBuild(size, size, size, palette, SparseVolume.from_dense(blocks), (0, 0, 0))
+
+
+def _whole(build: VoxelBuild) -> tuple[float, int]:
+    body = encode_response(build, "json", "generated")
+    return time.perf_counter(), len(body)
+
+
+def _streamed(build: VoxelBuild) -> tuple[float, int]:
+    chunks = response_format.iter_layers(response_meta(build, "generated"),
+                                         build.voxels, build.palette)
+    first = None
+    size = 0
+    for chunk in chunks:
+        size += len(chunk)
+        # The meta message carries no blocks; the first layer does
+        if first is None and size > len(chunk):
+            first = time.perf_counter()
+    return first, size
+
+
+def _measure(fn, build: VoxelBuild, repeat: int) -> tuple[float, float, float, int]:
+    """Best-of-repeat first-block and total seconds, peak MiB, bytes."""
+    first_best = total_best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        first, nbytes = fn(build)
+        total_best = min(total_best, time.perf_counter() - t0)
+        first_best = min(first_best, first - t0)
+    tracemalloc.start()
+    fn(build)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return first_best, total_best, peak / 2 ** 20, nbytes
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[32, 64, 128])
+    parser.add_argument("--fill", type=float, default=0.3, help="fraction of solid voxels")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    for size in args.sizes:
+        build = _build(size, args.fill, rng)
+        print(f"\n{size}^3 build, {build.voxels.count} blocks "
+              f"(best of {args.repeat})")
+        print(f"  {'encoding':<10} {'first block ms':>15} {'total ms':>10} "
+              f"{'peak MiB':>9} {'bytes':>12}")
+        for name, fn in (("json body", _whole), ("ndjson", _streamed)):
+            first, total, peak, nbytes = _measure(fn, build, args.repeat)
+            print(f"  {name:<10} {first * 1e3:15.2f} {total * 1e3:10.2f} "
+                  f"{peak:9.1f} {nbytes:12d}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+"""
+Microbenchmark for the Sponge BlockData varint codec (schemgen/sponge.py).
+
+Compares the byte-at-a-time Python loops previously used in main.py and
+generate_test_schem.py with the vectorized codec, for a small (single-byte)
+and a large (multi-byte) palette.
+
+Run from the server directory:
+    python benchmarks/bench_varint.py [--sizes 32 64 256] [--repeat 3]
+"""
+
+import argparse
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+
+_SCHEMGEN_DIR = Path(__file__).parent.parent / "schemgen"
+if str(_SCHEMGEN_DIR) not in sys.path:
+    sys.path.insert(0, str(_SCHEMGEN_DIR))
+
+import sponge  # noqa: E402 (needs sys.path patch above)
+
+# The Python loops take seconds per million blocks, so they are timed on
+# at most this many blocks and extrapolated
+PY_SAMPLE = 1 << 18
+
+
+def py_encode(values) -> bytes:
+    out = []
+    for value in values:
+        while True:
+            b = value & 0x7F
+            value >>= 7
+            if value:
+                out.append(b | 0x80)
+            else:
+                out.append(b)
+                break
+    return bytes(out)
+
+
+def py_decode(raw: bytes) -> list:
+    values = []
+    i = 0
+    while i < len(raw):
+        value = 0
+        bits = 0
+        while True:
+            b = raw[i]; i += 1
+            value |= (b & 0x7F) << bits
+            bits += 7
+            if not (b & 0x80):
+                break
+        values.append(value)
+    return values
+
+
+def _best_of(fn, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - t0)
+    return best
+
+
+def bench(size: int, palette_max: int, repeat: int, rng) -> None:
+    n = size ** 3
+    volume = rng.integers(0, palette_max, (size, size, size), dtype=np.int32)
+    data = sponge.encode_block_data(volume, palette_max)
+    assert (sponge.decode_block_data(data, size, size, size, palette_max) == volume).all()
+
+    sample = volume.reshape(-1)[:PY_SAMPLE].tolist()
+    sample_data = py_encode(sample)
+    scale = n / len(sample)
+    t_py_enc = _best_of(lambda: py_encode(sample), 1) * scale
+    t_py_dec = _best_of(lambda: py_decode(sample_data), 1) * scale
+
+    t_enc = _best_of(lambda: sponge.encode_block_data(volume, palette_max), repeat)
+    t_dec = _best_of(lambda: sponge.decode_block_data(data, size, size, size, palette_max), repeat)
+    # Without the palette hint the codec has to scan for multi-byte varints
+    t_dec_scan = _best_of(lambda: sponge.decode_block_data(data, size, size, size), repeat)
+
+    print(f"{size:>4}^3  palette={palette_max:<5} {len(data) / 1e6:8.2f} MB  "
+          f"encode py {t_py_enc * 1e3:9.1f} ms  np {t_enc * 1e3:8.2f} ms (x{t_py_enc / t_enc:5.0f})  "
+          f"decode py {t_py_dec * 1e3:9.1f} ms  np {t_dec * 1e3:8.2f} ms (x{t_py_dec / t_dec:5.0f})  "
+          f"np unhinted {t_dec_scan * 1e3:8.2f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[32, 64, 256])
+    parser.add_argument("--palettes", type=int, nargs="+", default=[64, 4096])
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    for size in args.sizes:
+        for palette_max in args.palettes:
+            bench(size, palette_max, args.repeat, rng)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,193 @@
+#!/usr/bin/env python3
+"""
+Benchmark of multi-worker serving: memory per worker and throughput scaling.
+
+For each launcher and worker count, starts the server as a subprocess,
+waits for /health, sends --requests POST /generate requests with distinct
+prompts from --concurrency client threads, then reads every server
+process's memory from /proc/<pid>/smaps_rollup:
+
+  rss  resident pages, counting pages shared with other processes in full
+  pss  proportional share: each shared page divided by its sharers; the
+       sum over processes is the real footprint
+
+Launchers:
+  prefork  python main.py with WEB_WORKERS=N: state loaded once in the
+           master and shared, CLIP in one inference process (CLIP_PROCESS)
+  uvicorn  uvicorn main:app --workers N: each worker loads its own state
+
+Run from the server directory (Linux, needs the index built):
+    python benchmarks/bench_workers.py [--workers 1 2 4] [--launchers prefork uvicorn]
+"""
+
+import argparse
+import json
+import os
+import signal
+import subprocess
+import sys
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+SERVER_DIR = Path(__file__).parent.parent
+
+ADJECTIVES = ["small", "tall", "ruined", "floating", "red", "stone", "wooden", "snowy",
+              "ancient", "tiny", "giant", "glass", "haunted", "desert", "jungle", "modern"]
+NOUNS = ["house", "tower", "castle", "bridge", "ship", "tree", "statue", "temple",
+         "windmill", "lighthouse", "cabin", "fountain", "pyramid", "barn", "dragon", "car"]
+
+
+def _prompts(n: int) -> list[str]:
+    # Distinct prompts, so the prompt cache cannot answer them
+    return [f"a {ADJECTIVES[i % 16]} {NOUNS[i // 16 % 16]} number {i}" for i in range(n)]
+
+
+def _command(launcher: str, workers: int, port: int) -> tuple[list, dict]:
+    env = dict(os.environ, PORT=str(port), SEMANTIC_CACHE_SIZE="0")
+    if launcher == "prefork":
+        return [sys.executable, "main.py"], dict(env, WEB_WORKERS=str(workers))
+    return ([sys.executable, "-m", "uvicorn", "main:app", "--port", str(port),
+             "--workers", str(workers)], dict(env, WEB_WORKERS="1"))
+
+
+def _get(url: str, timeout: float = 5.0) -> dict:
+    with urllib.request.urlopen(url, timeout=timeout) as r:
+        return json.load(r)
+
+
+def _wait_healthy(url: str, proc: subprocess.Popen, timeout: float) -> float:
+    t0 = time.perf_counter()
+    while time.perf_counter() - t0 < timeout:
+        if proc.poll() is not None:
+            sys.exit(f"server exited with {proc.returncode} during startup")
+        try:
+            _get(url + "/health")
+            return time.perf_counter() - t0
+        except OSError:
+            time.sleep(0.5)
+    sys.exit(f"server not healthy after {timeout:.0f} s")
+
+
+def _generate(url: str, prompt: str) -> float:
+    request = urllib.request.Request(
+        url + "/generate", data=json.dumps({"prompt": prompt}).encode(),
+        headers={"Content-Type": "application/json"})
+    t0 = time.perf_counter()
+    with urllib.request.urlopen(request, timeout=300) as r:
+        r.read()
+    return time.perf_counter() - t0
+
+
+def _descendants(root: int) -> list[int]:
+    """root and every process below it, from /proc/<pid>/stat parent ids."""
+    children: dict = {}
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as f:
+                # The command name may contain spaces; ppid follows its ")"
+                ppid = int(f.read().rsplit(")", 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        children.setdefault(ppid, []).append(int(entry))
+    pids, stack = [], [root]
+    while stack:
+        pid = stack.pop()
+        pids.append(pid)
+        stack.extend(children.get(pid, []))
+    return pids
+
+
+def _memory(pid: int) -> tuple[str, float, float]:
+    """(command, rss MiB, pss MiB) of one process."""
+    with open(f"/proc/{pid}/cmdline", "rb") as f:
+        cmd = f.read().replace(b"\0", b" ").decode().strip()
+    fields = {}
+    with open(f"/proc/{pid}/smaps_rollup") as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) == 3 and parts[2] == "kB":
+                fields[parts[0].rstrip(":")] = int(parts[1]) / 1024
+    return cmd, fields.get("Rss", 0.0), fields.get("Pss", 0.0)
+
+
+def _stop(proc: subprocess.Popen) -> None:
+    os.killpg(proc.pid, signal.SIGTERM)
+    try:
+        proc.wait(timeout=60)
+    except subprocess.TimeoutExpired:
+        os.killpg(proc.pid, signal.SIGKILL)
+        proc.wait()
+
+
+def _run(launcher: str, workers: int, args) -> dict:
+    command, env = _command(launcher, workers, args.port)
+    url = f"http://127.0.0.1:{args.port}"
+    proc = subprocess.Popen(command, cwd=SERVER_DIR, env=env, start_new_session=True,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        startup_s = _wait_healthy(url, proc, args.startup_timeout)
+        prompts = _prompts(args.requests + args.warmup)
+        with ThreadPoolExecutor(args.concurrency) as pool:
+            list(pool.map(lambda p: _generate(url, p), prompts[:args.warmup]))
+            t0 = time.perf_counter()
+            latencies = sorted(pool.map(lambda p: _generate(url, p), prompts[args.warmup:]))
+            elapsed = time.perf_counter() - t0
+
+        processes = []
+        for pid in _descendants(proc.pid):
+            try:
+                processes.append((pid, *_memory(pid)))
+            except OSError:
+                pass
+    finally:
+        _stop(proc)
+
+    return {
+        "startup_s": startup_s,
+        "rps": len(latencies) / elapsed,
+        "p50_ms": 1e3 * latencies[len(latencies) // 2],
+        "p95_ms": 1e3 * latencies[int(len(latencies) * 0.95)],
+        "processes": processes,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--launchers", nargs="+", choices=["prefork", "uvicorn"],
+                        default=["prefork", "uvicorn"])
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--warmup", type=int, default=20)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--startup-timeout", type=float, default=600.0)
+    args = parser.parse_args()
+
+    summary = []
+    for launcher in args.launchers:
+        for workers in args.workers:
+            print(f"\n{launcher}, {workers} workers")
+            result = _run(launcher, workers, args)
+            print(f"  {'pid':>7} {'rss MiB':>9} {'pss MiB':>9}  command")
+            for pid, cmd, rss, pss in result["processes"]:
+                print(f"  {pid:7d} {rss:9.1f} {pss:9.1f}  {cmd[:60]}")
+            total_pss = sum(p[3] for p in result["processes"])
+            print(f"  startup {result['startup_s']:.1f} s, {result['rps']:.1f} req/s, "
+                  f"p50 {result['p50_ms']:.0f} ms, p95 {result['p95_ms']:.0f} ms, "
+                  f"total pss {total_pss:.0f} MiB")
+            summary.append((launcher, workers, result["rps"], total_pss))
+
+    print(f"\n  {'launcher':<9} {'workers':>7} {'req/s':>8} {'scaling':>8} "
+          f"{'total pss MiB':>14} {'MiB per worker':>15}")
+    for launcher, workers, rps, pss in summary:
+        base = next(r for l, w, r, _ in summary if l == launcher and w == min(args.workers))
+        print(f"  {launcher:<9} {workers:7d} {rps:8.1f} {rps / base:7.2f}x "
+              f"{pss:14.0f} {pss / workers:15.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,278 @@
+"""
+Bounded LRU cache with TTL expiry and an optional on-disk tier, and an
+LRU cache keyed by embedding similarity.
+
+Used by main.py to memoise prompt -> dataset_idx and
+dataset_idx -> generated schematic payload; SemanticCache lets
+near-duplicate prompts reuse a retrieval (see retrieve.retrieve_batch).
+"""
+
+import hashlib
+import os
+import re
+import threading
+import time
+import zipfile
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Callable, Hashable, Optional
+
+import numpy as np
+
+# Array in each disk entry holding repr(key), to tell hash collisions apart
+_KEY_FIELD = "__key__"
+
+
+def normalize_prompt(prompt: str) -> str:
+    """Case- and whitespace-insensitive cache key for a prompt."""
+    return re.sub(r"\s+", " ", prompt).strip().lower()
+
+
+class LRUCache:
+    """
+    Thread-safe LRU cache.
+
+    max_entries  in-memory capacity; least recently used entries are evicted
+    ttl          seconds an entry stays valid (None = forever)
+    disk_dir     optional directory for a second, larger tier; entries evicted
+                 from memory are still found there until disk_entries is hit
+    to_arrays    value -> dict of numpy arrays, and
+    from_arrays  back; required with disk_dir. Disk entries are .npz files
+                 loaded without pickle, so the directory holds data only
+
+    With a disk tier, get() and put() do file I/O; call them off the event
+    loop.
+    """
+
+    def __init__(
+        self,
+        max_entries: int,
+        ttl: Optional[float] = None,
+        disk_dir: Optional[str] = None,
+        disk_entries: int = 1024,
+        to_arrays: Optional[Callable[[Any], dict]] = None,
+        from_arrays: Optional[Callable[[Any], Any]] = None,
+    ):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.disk_dir = Path(disk_dir) if disk_dir else None
+        self.disk_entries = disk_entries
+        if self.disk_dir is not None and (to_arrays is None or from_arrays is None):
+            raise ValueError("a disk tier needs to_arrays and from_arrays")
+        self.to_arrays = to_arrays
+        self.from_arrays = from_arrays
+
+        self._data: "OrderedDict[Hashable, tuple[float, Any]]" = OrderedDict()
+        self._disk_keys: "OrderedDict[str, None]" = OrderedDict()
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        if self.disk_dir is not None:
+            self.disk_dir.mkdir(parents=True, exist_ok=True)
+            # .pkl files from older versions are never read
+            for path in sorted(self.disk_dir.glob("*.npz"), key=os.path.getmtime):
+                self._disk_keys[path.stem] = None
+
+    # -- public -------------------------------------------------------------
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        now = time.monotonic()
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None:
+                stored_at, value = entry
+                if self.ttl is None or now - stored_at < self.ttl:
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._data[key]
+
+        value = self._disk_get(key)
+        with self._lock:
+            if value is None:
+                self.misses += 1
+                return None
+            self.disk_hits += 1
+            self._put_memory(key, value, now)
+        return value
+
+    def put(self, key: Hashable, value: Any) -> None:
+        with self._lock:
+            self._put_memory(key, value, time.monotonic())
+        self._disk_put(key, value)
+
+    def clear(self) -> None:
+        """Drop every entry, memory and disk; counters are kept."""
+        with self._lock:
+            self._data.clear()
+            names = list(self._disk_keys)
+            self._disk_keys.clear()
+        for name in names:
+            (self.disk_dir / f"{name}.npz").unlink(missing_ok=True)
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.disk_hits + self.misses
+            return {
+                "entries": len(self._data),
+                "disk_entries": len(self._disk_keys),
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": (self.hits + self.disk_hits) / lookups if lookups else 0.0,
+            }
+
+    # -- memory tier --------------------------------------------------------
+
+    def _put_memory(self, key: Hashable, value: Any, now: float) -> None:
+        self._data[key] = (now, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.max_entries:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    # -- disk tier ----------------------------------------------------------
+
+    @staticmethod
+    def _disk_name(key: Hashable) -> str:
+        return hashlib.sha1(repr(key).encode()).hexdigest()
+
+    def _disk_get(self, key: Hashable) -> Optional[Any]:
+        if self.disk_dir is None:
+            return None
+        name = self._disk_name(key)
+        path = self.disk_dir / f"{name}.npz"
+        try:
+            if self.ttl is not None and time.time() - path.stat().st_mtime >= self.ttl:
+                self._disk_remove(name)
+                return None
+            with np.load(path, allow_pickle=False) as data:
+                if str(data[_KEY_FIELD]) != repr(key):
+                    return None
+                return self.from_arrays({k: data[k] for k in data.files if k != _KEY_FIELD})
+        except (OSError, ValueError, KeyError, EOFError, zipfile.BadZipFile):
+            # Missing, truncated or not an array file
+            return None
+
+    def _disk_put(self, key: Hashable, value: Any) -> None:
+        if self.disk_dir is None or self.disk_entries <= 0:
+            return
+        name = self._disk_name(key)
+        path = self.disk_dir / f"{name}.npz"
+        tmp = path.with_suffix(f".{threading.get_ident()}.tmp")
+        with open(tmp, "wb") as f:
+            np.savez(f, **self.to_arrays(value), **{_KEY_FIELD: np.array(repr(key))})
+        os.replace(tmp, path)
+
+        with self._lock:
+            self._disk_keys[name] = None
+            self._disk_keys.move_to_end(name)
+            stale = []
+            while len(self._disk_keys) > self.disk_entries:
+                stale.append(self._disk_keys.popitem(last=False)[0])
+        for old in stale:
+            (self.disk_dir / f"{old}.npz").unlink(missing_ok=True)
+
+    def _disk_remove(self, name: str) -> None:
+        with self._lock:
+            self._disk_keys.pop(name, None)
+        (self.disk_dir / f"{name}.npz").unlink(missing_ok=True)
+
+
+class SemanticCache:
+    """
+    Thread-safe LRU cache keyed by L2-normalised embeddings: a lookup hits
+    the most similar stored embedding if its cosine similarity is at least
+    `threshold`.
+
+    The stored embeddings are one [max_entries, D] array searched by a
+    single matrix product, exact and well under a millisecond for a few
+    thousand entries, so no approximate index is needed at this size.
+    """
+
+    def __init__(self, max_entries: int, threshold: float = 0.95):
+        self.max_entries = max_entries
+        self.threshold = threshold
+
+        # Allocated on the first put(), once the embedding size is known
+        self._vecs: Optional[np.ndarray] = None
+        self._values: list = [None] * max_entries
+        self._used = np.zeros(max_entries, dtype=bool)
+        # slot -> None, least recently used first
+        self._lru: "OrderedDict[int, None]" = OrderedDict()
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get_batch(self, vecs: np.ndarray) -> list[Optional[Any]]:
+        """Cached value per embedding row of vecs [N, D], None on a miss."""
+        with self._lock:
+            if self._vecs is None or not self._lru:
+                self.misses += len(vecs)
+                return [None] * len(vecs)
+            sims = vecs @ self._vecs.T
+            sims[:, ~self._used] = -np.inf
+            best = sims.argmax(axis=1)
+            found = sims[np.arange(len(vecs)), best] >= self.threshold
+
+            results = []
+            for slot, hit in zip(best.tolist(), found.tolist()):
+                if hit:
+                    self._lru.move_to_end(slot)
+                    results.append(self._values[slot])
+                else:
+                    results.append(None)
+            hits = int(found.sum())
+            self.hits += hits
+            self.misses += len(vecs) - hits
+            return results
+
+    def put(self, vec: np.ndarray, value: Any) -> None:
+        """Store value for vec; an entry it would already hit is updated instead."""
+        with self._lock:
+            if self._vecs is None:
+                self._vecs = np.zeros((self.max_entries, len(vec)), dtype=np.float32)
+            elif self._lru:
+                # e.g. two near-duplicate prompts that missed in the same batch
+                sims = self._vecs @ vec
+                sims[~self._used] = -np.inf
+                slot = int(sims.argmax())
+                if sims[slot] >= self.threshold:
+                    self._values[slot] = value
+                    self._lru.move_to_end(slot)
+                    return
+            if len(self._lru) < self.max_entries:
+                slot = len(self._lru)
+            else:
+                slot, _ = self._lru.popitem(last=False)
+                self.evictions += 1
+            self._vecs[slot] = vec
+            self._values[slot] = value
+            self._used[slot] = True
+            self._lru[slot] = None
+
+    def clear(self) -> None:
+        """Drop every entry; counters are kept."""
+        with self._lock:
+            self._values = [None] * self.max_entries
+            self._used[:] = False
+            self._lru.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._lru),
+                "threshold": self.threshold,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+            }
@@ -3,10 +3,18 @@ Generates a test.schem (Sponge Schematic v2) — a small 7x5x7 stone house
 with oak plank floor, glass windows, and oak log corners.
 
 Run: python generate_test_schem.py
-Requires: pip install nbtlib
+Requires: pip install nbtlib numpy
+(the NBT layout is written by schemgen/sponge.py)
 """
 
-import nbtlib
+import sys
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).parent / "schemgen"))
+
+from sponge import write_schem  # noqa: E402 (needs sys.path patch above)
 
 W, H, L = 7, 5, 7  # width, height, length
 
@@ -35,18 +43,6 @@ def block(x, y, z):
         return "minecraft:stone_bricks"
     return "minecraft:air"  # interior
 
-def encode_varint(value):
-    out = []
-    while True:
-        b = value & 0x7F
-        value >>= 7
-        if value:
-            out.append(b | 0x80)
-        else:
-            out.append(b)
-            break
-    return out
-
 def main():
     # Build the palette from all unique block states used
     palette_set = set()
@@ -61,24 +57,9 @@ def main():
     palette_list = sorted(palette_set)
     palette_map  = {b: i for i, b in enumerate(palette_list)}
 
-    block_data = []
-    for b in grid:
-        block_data.extend(encode_varint(palette_map[b]))
-
-    schem = nbtlib.Compound({
-        "Version":     nbtlib.Int(2),
-        "DataVersion": nbtlib.Int(3953),
-        "Width":       nbtlib.Short(W),
-        "Height":      nbtlib.Short(H),
-        "Length":      nbtlib.Short(L),
-        "PaletteMax":  nbtlib.Int(len(palette_list)),
-        "Palette":     nbtlib.Compound({b: nbtlib.Int(i) for b, i in palette_map.items()}),
-        "BlockData":   nbtlib.ByteArray([b if b < 128 else b - 256 for b in block_data]),
-        "Offset":      nbtlib.IntArray([0, 0, 0]),
-    })
-
-    nbt_file = nbtlib.File(schem, gzipped=True)
-    nbt_file.save("test.schem")
+    # grid is already in BlockData (YZX) order
+    block_ids = np.array([palette_map[b] for b in grid]).reshape(H, L, W)
+    write_schem("test.schem", palette_list, block_ids, data_version=3953)
     print(f"Saved test.schem  ({W}x{H}x{L}, {sum(1 for b in grid if b != 'minecraft:air')} non-air blocks)")
 
 if __name__ == "__main__":
@@ -0,0 +1,199 @@
+"""
+CLIP text encoding in a dedicated inference process, reached over a local socket.
+
+In the multi-worker launch (prefork.py) every web worker would otherwise
+load its own copy of CLIP and its own torch runtime. Instead one process
+owns the model and the workers send it prompts through an EncoderClient:
+
+  request   list of prompts
+  reply     (float32 [N, D] L2-normalised embeddings, None)
+            or (None, error message)
+
+Requests from all workers go through one RetrievalBatcher, so prompts
+arriving together from different workers share an encode_text call. The
+socket is a Unix domain socket guarded by a random authkey, which the
+launcher hands to the process through CLIP_AUTHKEY.
+
+Run standalone (the launcher normally does this):
+    CLIP_AUTHKEY=<hex> python inference.py --socket /tmp/mcbuild-clip.sock
+"""
+
+import argparse
+import os
+import secrets
+import subprocess
+import sys
+import threading
+import time
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Client, Connection, Listener
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+
+AUTHKEY_ENV = "CLIP_AUTHKEY"
+# How long clients wait for the socket, e.g. while CLIP is still loading
+CONNECT_TIMEOUT_S = 120.0
+# Minimum seconds between restarts of a crashing inference process
+RESTART_DELAY_S = 5.0
+
+
+class EncoderClient:
+    """
+    Connection to an inference process. Safe to share between threads and
+    across fork(): each thread of each process opens its own connection.
+    """
+
+    def __init__(self, address: str, authkey: bytes, timeout: float = CONNECT_TIMEOUT_S):
+        self.address = address
+        self.authkey = authkey
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def encode(self, prompts: list[str]) -> np.ndarray:
+        """CLIP-encode prompts; returns L2-normalised float32 [N, D]."""
+        try:
+            reply = self._request(prompts)
+        except (EOFError, OSError):
+            # The inference process may have been restarted; reconnect once
+            self._close()
+            reply = self._request(prompts)
+        embeddings, error = reply
+        if error is not None:
+            raise RuntimeError(f"CLIP inference process: {error}")
+        return embeddings
+
+    def wait_ready(self) -> None:
+        """Block until the inference process answers (CLIP loaded)."""
+        self._request([])
+
+    def _request(self, prompts: list[str]) -> tuple:
+        conn = self._connection()
+        conn.send(prompts)
+        return conn.recv()
+
+    def _connection(self) -> Connection:
+        # A connection inherited through fork() belongs to the parent
+        if getattr(self._local, "pid", None) != os.getpid():
+            self._local.conn, self._local.pid = self._connect(), os.getpid()
+        return self._local.conn
+
+    def _connect(self) -> Connection:
+        deadline = time.monotonic() + self.timeout
+        while True:
+            try:
+                return Client(self.address, family="AF_UNIX", authkey=self.authkey)
+            except (FileNotFoundError, ConnectionRefusedError):
+                if time.monotonic() > deadline:
+                    raise
+                time.sleep(0.2)
+
+    def _close(self) -> None:
+        conn = getattr(self._local, "conn", None)
+        if conn is not None and self._local.pid == os.getpid():
+            conn.close()
+        self._local.pid = None
+
+
+class EncoderProcess:
+    """
+    Runs `python inference.py` as a child process and restarts it if it
+    exits; start() / check() / stop() are called by prefork.run().
+    """
+
+    def __init__(self, address: str):
+        self.address = address
+        self.authkey = secrets.token_bytes(16)
+        self._proc: Optional[subprocess.Popen] = None
+        self._started = 0.0
+
+    def client(self) -> EncoderClient:
+        return EncoderClient(self.address, self.authkey)
+
+    def start(self) -> None:
+        env = dict(os.environ, **{AUTHKEY_ENV: self.authkey.hex()})
+        self._proc = subprocess.Popen(
+            [sys.executable, str(Path(__file__).resolve()), "--socket", self.address],
+            env=env)
+        self._started = time.monotonic()
+        print(f"[inference] Started CLIP process {self._proc.pid} on {self.address}")
+
+    def check(self) -> None:
+        if self._proc is None or self._proc.poll() is None:
+            return
+        if time.monotonic() - self._started >= RESTART_DELAY_S:
+            print(f"[inference] CLIP process exited with {self._proc.returncode}, restarting")
+            self.start()
+
+    def stop(self) -> None:
+        if self._proc is None:
+            return
+        self._proc.terminate()
+        try:
+            self._proc.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            self._proc.kill()
+        self._proc = None
+
+
+def _handle(conn: Connection, batcher) -> None:
+    with conn:
+        while True:
+            try:
+                prompts = conn.recv()
+            except (EOFError, OSError):
+                return
+            try:
+                futures = [batcher.submit(p) for p in prompts]
+                embeddings = (np.stack([f.result() for f in futures]) if futures
+                              else np.zeros((0, 0), dtype=np.float32))
+                reply = (embeddings, None)
+            except Exception as e:
+                reply = (None, f"{type(e).__name__}: {e}")
+            try:
+                conn.send(reply)
+            except OSError:
+                return
+
+
+def serve(address: str, authkey: bytes, max_batch: int = 32, window_s: float = 0.005) -> None:
+    """Load CLIP and answer encode requests on address until killed."""
+    from retrieval import retrieve
+    from retrieval.batcher import RetrievalBatcher
+
+    retrieve.load_clip()
+    batcher = RetrievalBatcher(batch_fn=retrieve.encode_prompts,
+                               max_batch=max_batch, window_s=window_s)
+
+    # A socket file left behind by a previous run would make bind() fail
+    if os.path.exists(address):
+        os.unlink(address)
+    with Listener(address, family="AF_UNIX", authkey=authkey) as listener:
+        print(f"[inference] CLIP ready on {address}")
+        while True:
+            try:
+                conn = listener.accept()
+            except (OSError, AuthenticationError) as e:
+                # e.g. a client with the wrong authkey
+                print(f"[inference] Refused connection: {e}")
+                continue
+            threading.Thread(target=_handle, args=(conn, batcher), daemon=True).start()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--socket", required=True, help="Unix socket path to listen on")
+    parser.add_argument("--max-batch", type=int, default=int(os.environ.get("MAX_BATCH", 32)))
+    parser.add_argument("--window-ms", type=float,
+                        default=float(os.environ.get("BATCH_WINDOW_MS", 5)))
+    args = parser.parse_args()
+
+    authkey = os.environ.get(AUTHKEY_ENV)
+    if not authkey:
+        sys.exit(f"{AUTHKEY_ENV} must be set")
+    serve(args.socket, bytes.fromhex(authkey), args.max_batch, args.window_ms / 1e3)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,104 +1,507 @@
+import asyncio
+import functools
+import json
 import os
-import shutil
-import tempfile
+import secrets
+import signal
+import sys
+import time
+from pathlib import Path
+from typing import Literal, Optional
 
-import nbtlib
 import uvicorn
-from fastapi import FastAPI
+from fastapi import BackgroundTasks, FastAPI, Header, HTTPException, Request, Response
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
 
-from retrieval.retrieve import index_size, load_index, retrieve
-from retrieval.voxel_to_schem import voxel_to_schem
+import metrics
+import prefork
+from cache import LRUCache, SemanticCache, normalize_prompt
+from inference import EncoderClient, EncoderProcess
+from retrieval.batcher import RetrievalBatcher
+from retrieval.retrieve import (
+    NoMatch,
+    index_changed,
+    index_size,
+    load_index,
+    load_timings,
+    reload_index,
+    retrieve,
+    retrieve_batch,
+    retrieve_topk_batch,
+)
+from retrieval.voxel_to_schem import VoxelBuild, load_converter, save_schem, voxel_to_build
+from workers import Saturated, WorkerPool
+
+# schemgen modules are imported top-level, as in retrieval/voxel_to_schem.py
+_SCHEMGEN_DIR = Path(__file__).parent / "schemgen"
+if str(_SCHEMGEN_DIR) not in sys.path:
+    sys.path.insert(0, str(_SCHEMGEN_DIR))
+
+import response_format  # noqa: E402 (needs sys.path patch above)
+from sparse import SparseVolume  # noqa: E402
 
 app = FastAPI()
 
 WORLDEDIT_SCHEMATICS_DIR = os.path.expandvars(r"%APPDATA%\.minecraft\config\worldedit\schematics")
 
+# normalised prompt -> dataset_idx
+PROMPT_CACHE_SIZE = 4096
+# (dataset_idx, dither) -> {"build": VoxelBuild, "bodies": {format: encoded response}}
+RESULT_CACHE_SIZE = 256
+CACHE_TTL_S = 24 * 3600
+# Set to a directory to keep evicted results on disk as well (builds only,
+# as .npz; the encoded bodies are rebuilt on demand)
+RESULT_CACHE_DIR = os.environ.get("RESULT_CACHE_DIR")
+# Opt-in (SEMANTIC_CACHE_SIZE > 0): prompts missing the prompt cache are still
+# CLIP-encoded, but skip the FAISS search if their embedding is within this
+# cosine similarity of one of the last SEMANTIC_CACHE_SIZE retrieved prompts
+# ("a castle" / "A Castle!"). Off by default: CLIP ViT-B/32 text embeddings
+# of different prompts ("red house" / "blue house") can score above 0.95 too,
+# which would hand out another prompt's build.
+SEMANTIC_CACHE_SIZE = int(os.environ.get("SEMANTIC_CACHE_SIZE", 0))
+SEMANTIC_CACHE_THRESHOLD = float(os.environ.get("SEMANTIC_CACHE_THRESHOLD", 0.95))
+
+prompt_cache = LRUCache(PROMPT_CACHE_SIZE, ttl=CACHE_TTL_S)
+result_cache = LRUCache(
+    RESULT_CACHE_SIZE, ttl=CACHE_TTL_S, disk_dir=RESULT_CACHE_DIR,
+    to_arrays=lambda result: result["build"].to_arrays(),
+    from_arrays=lambda arrays: {"build": VoxelBuild.from_arrays(arrays), "bodies": {}})
+semantic_cache = (SemanticCache(SEMANTIC_CACHE_SIZE, SEMANTIC_CACHE_THRESHOLD)
+                  if SEMANTIC_CACHE_SIZE > 0 else None)
+
+# WEB_WORKERS > 1 serves from that many forked processes (see prefork.py)
+# sharing the state loaded once by preload(). They all reach one CLIP
+# inference process (inference.py) on CLIP_SOCKET: torch must not be loaded
+# in the master before it forks, so CLIP_PROCESS=0 needs WEB_WORKERS=1.
+# THREAD_WORKERS, PROCESS_WORKERS and MAX_PENDING apply per worker.
+WEB_WORKERS = int(os.environ.get("WEB_WORKERS", 1))
+CLIP_PROCESS = os.environ.get("CLIP_PROCESS", "1") == "1"
+CLIP_SOCKET = os.environ.get("CLIP_SOCKET", f"/tmp/mcbuild-clip-{os.getpid()}.sock")
+PREFORK = __name__ == "__main__" and WEB_WORKERS > 1 and hasattr(os, "fork")
+
+# Threads run CLIP / FAISS (both release the GIL) and response encoding,
+# processes run the Python-heavy voxel conversion (0 = use threads instead).
+# Conversion processes load their own matcher and voxel store, so prefork
+# workers default to threads, which use the state shared from the master.
+# Requests beyond MAX_PENDING get a 503 rather than an unbounded queue.
+THREAD_WORKERS = int(os.environ.get("THREAD_WORKERS", 4))
+PROCESS_WORKERS = int(os.environ.get("PROCESS_WORKERS", 0 if PREFORK else 2))
+MAX_PENDING = int(os.environ.get("MAX_PENDING", 32))
+
+# Concurrent prompts are CLIP-encoded together: wait up to BATCH_WINDOW_MS
+# for up to MAX_BATCH prompts (0 ms = encode each prompt on its own)
+BATCH_WINDOW_MS = float(os.environ.get("BATCH_WINDOW_MS", 5))
+MAX_BATCH = int(os.environ.get("MAX_BATCH", 32))
+
+# /admin endpoints require a matching X-Admin-Token header; unset, they are off
+ADMIN_TOKEN = os.environ.get("ADMIN_TOKEN")
+
+# Per-stage timings go to /metrics unless METRICS=0 (see metrics.py);
+# SERVER_TIMING=1 also returns them to the client in a Server-Timing header
+SERVER_TIMING = os.environ.get("SERVER_TIMING", "0") == "1"
+
+HOST = os.environ.get("HOST", "0.0.0.0")
+PORT = int(os.environ.get("PORT", 8000))
+
+worker_pool: Optional[WorkerPool] = None
+retrieval_batcher: Optional[RetrievalBatcher] = None
+
 
 class GenerateRequest(BaseModel):
     prompt: str
+    # Colour matching mode, see schemgen/dither.py
+    dither: Literal["none", "ordered", "diffusion"] = "none"
 
 
-def parse_schematic_blocks(path: str):
-    try:
-        schem = nbtlib.load(path)
-        width  = int(schem["Width"])
-        height = int(schem["Height"])
-        length = int(schem["Length"])
-
-        # Reverse palette: palette_id -> block state string
-        palette = {int(v): k for k, v in schem["Palette"].items()}
-
-        # Decode varint-encoded BlockData
-        raw = bytes(schem["BlockData"])
-        blocks = []
-        i = 0
-        idx = 0
-        while i < len(raw):
-            value = 0
-            bits = 0
-            while True:
-                b = raw[i]; i += 1
-                value |= (b & 0x7F) << bits
-                bits += 7
-                if not (b & 0x80):
-                    break
-            bx = idx % width
-            bz = (idx // width) % length
-            by = idx // (width * length)
-            state = palette.get(value, "minecraft:air")
-            if "air" not in state:
-                blocks.append({"x": bx, "y": by, "z": bz, "b": state})
-            idx += 1
-
-        # Sort bottom to top for build-up animation
-        blocks.sort(key=lambda b: b["y"])
-        return blocks, width, height, length
-    except Exception as e:
-        print(f"Error parsing schematic: {e}")
-        return [], 0, 0, 0
+# Caps for one /retrieve call
+MAX_RETRIEVE_PROMPTS = 10_000
+MAX_RETRIEVE_K = 100
+
+
+class RetrieveRequest(BaseModel):
+    prompts: list[str]
+    k: int = 1
+    # 0 = plain nearest neighbours, towards 1 = more varied results (MMR)
+    diversity: float = 0.0
+    min_score: Optional[float] = None
+
+
+def volume_blocks(voxels: SparseVolume, palette: list) -> list[dict]:
+    """
+    Block list for the JSON response from a sparse palette id volume,
+    skipping air, sorted bottom to top for the build-up animation.
+    """
+    voxels = response_format.solid_voxels(voxels, palette)
+    states = [palette[i] for i in voxels.ids.tolist()]
+    return [
+        {"x": x, "y": y, "z": z, "b": b}
+        for x, y, z, b in zip(voxels.xs.tolist(), voxels.ys.tolist(), voxels.zs.tolist(), states)
+    ]
+
+
+def build_blocks(build: VoxelBuild) -> list[dict]:
+    """Block list for the JSON response, straight from the in-memory build."""
+    return volume_blocks(build.voxels, build.palette)
+
+
+def write_worldedit_schem(build: VoxelBuild, schem_name: str) -> None:
+    """Save build into the WorldEdit schematics dir for in-game use."""
+    os.makedirs(WORLDEDIT_SCHEMATICS_DIR, exist_ok=True)
+    dest_path = os.path.join(WORLDEDIT_SCHEMATICS_DIR, f"{schem_name}.schem")
+    # Write under a unique name and swap it in, so concurrent requests never
+    # leave a half-written file behind
+    tmp_path = os.path.join(WORLDEDIT_SCHEMATICS_DIR, f".{schem_name}.{os.getpid()}.{id(build)}.schem")
+    save_schem(build, tmp_path)
+    os.replace(tmp_path, dest_path)
+
+
+if metrics.ENABLED:
+    @app.middleware("http")
+    async def record_request_metrics(request: Request, call_next):
+        timings: list = []
+        token = metrics.request_timings.set(timings)
+        t0 = time.perf_counter()
+        status = 500
+        try:
+            response = await call_next(request)
+            status = response.status_code
+        finally:
+            metrics.request_timings.reset(token)
+            elapsed = time.perf_counter() - t0
+            # Route template rather than raw path, so unknown URLs share one label
+            route = request.scope.get("route")
+            path = route.path if route is not None else "other"
+            metrics.request_seconds.observe(elapsed, path)
+            metrics.requests_total.inc(path, status)
+        if SERVER_TIMING:
+            response.headers["Server-Timing"] = metrics.server_timing(timings, elapsed)
+        return response
+
+
+# True in prefork workers, which inherit the state preload() loaded in the master
+_preloaded = False
+
+
+def preload(encoder: Optional[EncoderClient] = None) -> None:
+    """Load the index, CLIP (or wait for its inference process) and the converter."""
+    global _preloaded
+    load_index(encoder)
+    load_converter()
+    if encoder is not None:
+        encoder.wait_ready()
+    _preloaded = True
 
 
 @app.on_event("startup")
 async def startup():
-    load_index()
+    global worker_pool, retrieval_batcher
+    if not _preloaded:
+        load_index()
+        load_converter()
+    else:
+        # The prefork master forwards SIGHUP after an index rebuild or reload
+        asyncio.get_running_loop().add_signal_handler(signal.SIGHUP, _reload_on_signal)
+    worker_pool = WorkerPool(THREAD_WORKERS, PROCESS_WORKERS, MAX_PENDING,
+                             process_initializer=load_converter)
+    if BATCH_WINDOW_MS > 0:
+        retrieval_batcher = RetrievalBatcher(
+            batch_fn=functools.partial(retrieve_batch, cache=semantic_cache),
+            max_batch=MAX_BATCH, window_s=BATCH_WINDOW_MS / 1e3)
+
+
+@app.on_event("shutdown")
+async def shutdown():
+    worker_pool.shutdown()
+    if retrieval_batcher is not None:
+        retrieval_batcher.close()
+
+
+def _cache_stats() -> dict:
+    stats = {"prompt": prompt_cache.stats(), "result": result_cache.stats()}
+    if semantic_cache is not None:
+        stats["semantic"] = semantic_cache.stats()
+    return stats
 
 
 @app.get("/health")
 async def health():
-    return {"status": "ok", "index_size": index_size()}
+    return {
+        "status": "ok",
+        "pid": os.getpid(),
+        "index_size": index_size(),
+        "startup_s": load_timings(),
+        "cache": _cache_stats(),
+        "workers": worker_pool.stats() if worker_pool is not None else None,
+        "retrieval_batcher": retrieval_batcher.stats() if retrieval_batcher is not None else None,
+    }
+
+
+@app.get("/metrics")
+async def prometheus_metrics():
+    """Stage latency histograms plus cache, queue and index state, in Prometheus text format."""
+    extra = [
+        metrics.gauge("index_size", "Vectors in the FAISS index", index_size()),
+    ]
+    caches = _cache_stats()
+    for field, kind, help in (
+        ("hits", "counter", "Cache lookups served from memory"),
+        ("disk_hits", "counter", "Cache lookups served from the disk tier"),
+        ("misses", "counter", "Cache lookups that missed"),
+        ("evictions", "counter", "Entries evicted from the memory tier"),
+        ("entries", "gauge", "Entries held in memory"),
+        ("hit_rate", "gauge", "Fraction of cache lookups that hit"),
+    ):
+        # Not every cache has every field (only the result cache has a disk tier)
+        values = {c: st[field] for c, st in caches.items() if field in st}
+        name = f"cache_{field}_total" if kind == "counter" else f"cache_{field}"
+        extra.append(metrics.gauge(name, help, values, "cache", kind))
+    if worker_pool is not None:
+        extra.append(metrics.gauge("requests_in_flight", "Requests holding an admission slot",
+                                   worker_pool.pending))
+        extra.append(metrics.gauge("requests_rejected_total", "Requests refused with 503",
+                                   worker_pool.rejected, kind="counter"))
+    if retrieval_batcher is not None:
+        extra.append(metrics.gauge("retrieval_queue_depth", "Prompts waiting for a CLIP batch",
+                                   retrieval_batcher.stats()["queued"]))
+    return Response(content=metrics.render(extra), media_type="text/plain; version=0.0.4")
+
+
+def _reload_and_clear() -> dict:
+    result = reload_index()
+    # Cached prompts may have a nearer neighbour now; cached builds are still valid
+    prompt_cache.clear()
+    if semantic_cache is not None:
+        semantic_cache.clear()
+    return result
+
+
+def _reload_on_signal() -> None:
+    # The worker that served /admin/reload-index already has the new files
+    if not index_changed():
+        return
+
+    async def reload():
+        try:
+            await asyncio.to_thread(_reload_and_clear)
+        except (RuntimeError, OSError, ValueError) as e:
+            print(f"[main] Reload on SIGHUP failed, old index kept: {e}")
+
+    asyncio.get_running_loop().create_task(reload())
+
+
+@app.post("/admin/reload-index")
+async def admin_reload_index(x_admin_token: Optional[str] = Header(None)):
+    """
+    Swap in faiss.index / index_map.npy from disk (e.g. after
+    build_index.py --append) without a restart. Requests already searching
+    finish on the old index. With WEB_WORKERS > 1 the other workers reload
+    too, through the prefork master (SIGHUP).
+
+    Only served when ADMIN_TOKEN is set, to requests that send it.
+    """
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=404, detail="Not Found")
+    if not secrets.compare_digest((x_admin_token or "").encode(), ADMIN_TOKEN.encode()):
+        raise HTTPException(status_code=403, detail="bad admin token")
+    try:
+        # Off the event loop, outside admission control: it must not be
+        # refused with 503 while the server is busy
+        result = await asyncio.to_thread(_reload_and_clear)
+    except (RuntimeError, OSError, ValueError) as e:
+        raise HTTPException(status_code=500, detail=f"Reload failed, old index kept: {e}")
+    if _preloaded:
+        prefork.signal_master()
+    return result
+
+
+def response_meta(build: VoxelBuild, schem_name: str) -> dict:
+    return {
+        "schematic_path": f"{schem_name}.schem",
+        "width": build.width,
+        "height": build.height,
+        "length": build.length,
+    }
+
+
+def encode_response(build: VoxelBuild, fmt: str, schem_name: str) -> bytes:
+    meta = response_meta(build, schem_name)
+    if fmt == "json":
+        return json.dumps(dict(meta, blocks=build_blocks(build))).encode()
+    return response_format.encode(fmt, meta, build.voxels, build.palette)
 
 
 @app.post("/generate")
-async def generate(data: GenerateRequest):
+async def generate(
+    data: GenerateRequest,
+    background_tasks: BackgroundTasks,
+    format: Optional[str] = None,
+    accept: Optional[str] = Header(None),
+    accept_encoding: Optional[str] = Header(None),
+):
     print("Prompt:", data.prompt)
 
-    dataset_idx = retrieve(data.prompt)
-    print(f"Retrieved dataset index: {dataset_idx}")
+    try:
+        fmt = response_format.negotiate_format(format, accept)
+    except ValueError as e:
+        raise HTTPException(status_code=406, detail=str(e))
+
+    try:
+        async with worker_pool.admit():
+            return await _generate(data.prompt, data.dither, fmt, accept_encoding,
+                                   background_tasks)
+    except Saturated as e:
+        raise HTTPException(status_code=503, detail=f"Server busy: {e}",
+                            headers={"Retry-After": "1"})
 
-    with tempfile.TemporaryDirectory() as tmpdir:
-        schem_name = "generated"
-        schem_path = os.path.join(tmpdir, f"{schem_name}.schem")
 
-        voxel_to_schem(dataset_idx, schem_path)
+@app.post("/generate/stream")
+async def generate_stream(
+    data: GenerateRequest,
+    background_tasks: BackgroundTasks,
+    accept: Optional[str] = Header(None),
+):
+    """
+    /generate as a stream: metadata and palette first, then the blocks one
+    y-layer at a time, bottom-up, as NDJSON (or SSE if the client accepts
+    text/event-stream). See response_format.iter_layers.
+    """
+    print("Prompt (stream):", data.prompt)
+    framing = response_format.negotiate_stream_framing(accept)
+
+    # Only retrieval and conversion hold an admission slot; a slow reader
+    # must not keep other requests out while its layers trickle through
+    try:
+        async with worker_pool.admit():
+            result = await _get_result(data.prompt, data.dither)
+    except Saturated as e:
+        raise HTTPException(status_code=503, detail=f"Server busy: {e}",
+                            headers={"Retry-After": "1"})
+
+    build = result["build"]
+    schem_name = "generated"
+    background_tasks.add_task(write_worldedit_schem, build, schem_name)
+    return StreamingResponse(
+        response_format.iter_layers(response_meta(build, schem_name), build.voxels,
+                                    build.palette, framing),
+        media_type=response_format.STREAM_MEDIA_TYPES[framing],
+        # Keep proxies from buffering the stream into one response
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no", "Vary": "Accept"},
+    )
 
-        # Read schematic while the temp dir is still alive
-        blocks, width, height, length = parse_schematic_blocks(schem_path)
-        print(f"Schematic: {width}x{height}x{length}, {len(blocks)} non-air blocks")
 
-        # Copy to WorldEdit schematics dir for in-game use
-        dest_path = os.path.join(WORLDEDIT_SCHEMATICS_DIR, f"{schem_name}.schem")
-        os.makedirs(WORLDEDIT_SCHEMATICS_DIR, exist_ok=True)
-        shutil.copy2(schem_path, dest_path)
+@app.post("/retrieve")
+async def retrieve_prompts(data: RetrieveRequest):
+    """
+    Top-k dataset indices and cosine scores for many prompts, from one CLIP
+    pass and one FAISS search. Top-1 results also warm the /generate
+    prompt cache.
+    """
+    if not 0 < len(data.prompts) <= MAX_RETRIEVE_PROMPTS:
+        raise HTTPException(status_code=422, detail=f"send 1 to {MAX_RETRIEVE_PROMPTS} prompts")
+    if not 1 <= data.k <= MAX_RETRIEVE_K:
+        raise HTTPException(status_code=422, detail=f"k must be 1 to {MAX_RETRIEVE_K}")
+    if not 0.0 <= data.diversity <= 1.0:
+        raise HTTPException(status_code=422, detail="diversity must be 0 to 1")
+
+    try:
+        async with worker_pool.admit():
+            results = await worker_pool.run_thread(
+                "retrieve", retrieve_topk_batch,
+                data.prompts, data.k, data.diversity, data.min_score)
+    except Saturated as e:
+        raise HTTPException(status_code=503, detail=f"Server busy: {e}",
+                            headers={"Retry-After": "1"})
+
+    for prompt, hits in zip(data.prompts, results):
+        # MMR always keeps the nearest neighbour first, so hits[0] is what
+        # /generate would have retrieved
+        if hits:
+            prompt_cache.put(normalize_prompt(prompt), hits[0][0])
 
     return {
-        "schematic_path": f"{schem_name}.schem",
-        "width": width,
-        "height": height,
-        "length": length,
-        "blocks": blocks,
+        "results": [
+            [{"dataset_idx": idx, "score": score} for idx, score in hits]
+            for hits in results
+        ]
     }
 
 
+async def _result_cache_call(fn, *args):
+    # The disk tier reads and writes whole builds; keep that off the event loop
+    if result_cache.disk_dir is None:
+        return fn(*args)
+    return await worker_pool.run_thread("result_cache", fn, *args)
+
+
+async def _get_result(prompt: str, dither: str) -> dict:
+    """Retrieve and convert prompt, through the prompt and result caches."""
+    prompt_key = normalize_prompt(prompt)
+    dataset_idx = prompt_cache.get(prompt_key)
+    if dataset_idx is None:
+        if retrieval_batcher is not None:
+            with metrics.span("retrieve"):
+                dataset_idx = await asyncio.wrap_future(retrieval_batcher.submit(prompt))
+        else:
+            try:
+                dataset_idx = await worker_pool.run_thread("retrieve", retrieve, prompt, 1,
+                                                           semantic_cache)
+            except NoMatch:
+                dataset_idx = None
+        if dataset_idx is None:
+            # An empty IVF probe, not a build: nothing to convert or cache
+            raise HTTPException(status_code=404, detail="No matching build found for this prompt")
+        prompt_cache.put(prompt_key, dataset_idx)
+    print(f"Retrieved dataset index: {dataset_idx}")
+
+    result_key = (dataset_idx, dither)
+    result = await _result_cache_call(result_cache.get, result_key)
+    if result is None:
+        build = await worker_pool.run_process("convert", voxel_to_build, dataset_idx, dither)
+        result = {"build": build, "bodies": {}}
+        await _result_cache_call(result_cache.put, result_key, result)
+    build = result["build"]
+    print(f"Schematic: {build.width}x{build.height}x{build.length}")
+    return result
+
+
+async def _generate(prompt: str, dither: str, fmt: str, accept_encoding: Optional[str],
+                    background_tasks: BackgroundTasks) -> Response:
+    result = await _get_result(prompt, dither)
+    build = result["build"]
+
+    # The .schem file is only for WorldEdit, so write it after responding
+    schem_name = "generated"
+    background_tasks.add_task(write_worldedit_schem, build, schem_name)
+
+    body = result["bodies"].get(fmt)
+    if body is None:
+        body = await worker_pool.run_thread("encode", encode_response, build, fmt, schem_name)
+        result["bodies"][fmt] = body
+
+    # The body depends on both headers, so shared caches must key on them
+    headers = {"Vary": response_format.VARY}
+    if fmt != "json":
+        # Compact formats are opt-in, so their clients can opt into compression too
+        body, encoding = await worker_pool.run_thread(
+            "compress", response_format.compress, body, accept_encoding)
+        if encoding is not None:
+            headers["Content-Encoding"] = encoding
+    return Response(content=body, media_type=response_format.media_type(fmt), headers=headers)
+
+
 if __name__ == "__main__":
-    uvicorn.run(app, host="0.0.0.0", port=8000)
+    if PREFORK:
+        if not CLIP_PROCESS:
+            # torch's thread pools do not survive fork(); workers could deadlock
+            sys.exit("CLIP_PROCESS=0 would load CLIP in the prefork master before "
+                     "forking; use CLIP_PROCESS=1 or WEB_WORKERS=1")
+        helper = EncoderProcess(CLIP_SOCKET)
+        prefork.run(app, functools.partial(preload, helper.client()), WEB_WORKERS, HOST, PORT,
+                    [helper], reload=reload_index)
+    elif WEB_WORKERS > 1:
+        # No fork() (Windows): independent workers, each loading its own state
+        print("[main] os.fork unavailable, starting uvicorn workers without shared state")
+        uvicorn.run("main:app", host=HOST, port=PORT, workers=WEB_WORKERS)
+    else:
+        uvicorn.run(app, host=HOST, port=PORT)
@@ -0,0 +1,209 @@
+"""
+Lightweight per-stage timing, counters and a Prometheus text exposition.
+
+Pipeline code wraps a stage in `with span("clip_encode"):`. Where the
+duration ends up depends on where the span runs:
+
+  inside a WorkerPool call   collected and returned with the call's result,
+                             so spans from worker processes are not lost;
+                             the pool then records them on the event loop
+  anywhere else              recorded straight into the stage histogram
+
+Recorded spans also go to the current request's timing list (set by the
+HTTP middleware in main.py), which becomes its Server-Timing header.
+
+METRICS=0 in the environment turns span() into a shared no-op and skips the
+middleware, so the disabled cost is one function call per stage.
+"""
+
+import bisect
+import contextvars
+import os
+import threading
+import time
+from typing import Callable, Optional
+
+ENABLED = os.environ.get("METRICS", "1") != "0"
+
+PREFIX = "mcbuild"
+
+# Seconds; covers a cache hit (~1 ms) up to a cold dataset stream
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# (stage, seconds) list of the request being served, if any
+request_timings: contextvars.ContextVar[Optional[list]] = contextvars.ContextVar(
+    "request_timings", default=None)
+
+# Spans of the WorkerPool call running on this thread, if any
+_local = threading.local()
+
+
+def _labels(names: tuple, values: tuple) -> str:
+    if not names:
+        return ""
+    pairs = ",".join(f'{n}="{str(v)}"' for n, v in zip(names, values))
+    return "{" + pairs + "}"
+
+
+class Counter:
+    """Monotonic counter per label set."""
+
+    def __init__(self, name: str, help: str, labelnames: tuple = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self._values: dict[tuple, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labelvalues, amount: float = 1.0) -> None:
+        with self._lock:
+            self._values[labelvalues] = self._values.get(labelvalues, 0.0) + amount
+
+    def render(self) -> list[str]:
+        with self._lock:
+            values = sorted(self._values.items())
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        lines += [f"{self.name}{_labels(self.labelnames, k)} {v:g}" for k, v in values]
+        return lines
+
+
+class Histogram:
+    """Cumulative-bucket histogram per label set."""
+
+    def __init__(self, name: str, help: str, labelnames: tuple = (),
+                 buckets: tuple = LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = labelnames
+        self.buckets = buckets
+        # label values -> [per-bucket counts (+Inf last), sum, count]
+        self._series: dict[tuple, list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *labelvalues) -> None:
+        slot = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labelvalues)
+            if series is None:
+                series = self._series[labelvalues] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][slot] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self) -> list[str]:
+        with self._lock:
+            series = sorted((k, (list(c), s, n)) for k, (c, s, n) in self._series.items())
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        names = self.labelnames + ("le",)
+        for key, (counts, total, n) in series:
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), counts):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{_labels(names, key + (bound,))} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, key)} {total:.6g}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, key)} {n}")
+        return lines
+
+
+stage_seconds = Histogram(f"{PREFIX}_stage_seconds",
+                          "Time spent in one pipeline stage", ("stage",))
+queue_wait_seconds = Histogram(f"{PREFIX}_queue_wait_seconds",
+                               "Time a worker pool task waited for a worker", ("stage",))
+request_seconds = Histogram(f"{PREFIX}_http_request_seconds",
+                            "HTTP request latency", ("path",))
+requests_total = Counter(f"{PREFIX}_http_requests_total",
+                         "HTTP requests served", ("path", "status"))
+
+_REGISTRY = [stage_seconds, queue_wait_seconds, request_seconds, requests_total]
+
+
+def record(stage: str, seconds: float) -> None:
+    """Record one stage duration (see module docstring for where it goes)."""
+    spans = getattr(_local, "spans", None)
+    if spans is not None:
+        spans.append((stage, seconds))
+        return
+    stage_seconds.observe(seconds, stage)
+    timings = request_timings.get()
+    if timings is not None:
+        timings.append((stage, seconds))
+
+
+class _Span:
+    __slots__ = ("stage", "t0")
+
+    def __init__(self, stage: str):
+        self.stage = stage
+
+    def __enter__(self):
+        self.t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        record(self.stage, time.perf_counter() - self.t0)
+        return False
+
+
+class _NoSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NO_SPAN = _NoSpan()
+
+
+def span(stage: str):
+    """Context manager timing one pipeline stage; a no-op if disabled."""
+    return _Span(stage) if ENABLED else _NO_SPAN
+
+
+def collected_call(fn: Callable, args: tuple) -> tuple:
+    """
+    Run fn(*args) collecting the spans it records on this thread.
+    Returns (result, [(stage, seconds), ...]); used by WorkerPool.
+    """
+    if not ENABLED:
+        return fn(*args), []
+    outer = getattr(_local, "spans", None)
+    _local.spans = spans = []
+    try:
+        return fn(*args), spans
+    finally:
+        _local.spans = outer
+
+
+def server_timing(timings: list, total_s: float) -> str:
+    """Server-Timing header value; repeated stages are summed."""
+    merged: dict[str, float] = {}
+    for stage, seconds in timings:
+        merged[stage] = merged.get(stage, 0.0) + seconds
+    merged["total"] = total_s
+    return ", ".join(f"{stage};dur={1e3 * s:.2f}" for stage, s in merged.items())
+
+
+def gauge(name: str, help: str, values, labelname: Optional[str] = None,
+          kind: str = "gauge") -> list[str]:
+    """
+    Exposition lines for a value read at scrape time: a single number, or
+    a {label value: number} dict when labelname is given.
+    """
+    name = f"{PREFIX}_{name}"
+    lines = [f"# HELP {name} {help}", f"# TYPE {name} {kind}"]
+    if labelname is None:
+        lines.append(f"{name} {values:g}")
+    else:
+        lines += [f'{name}{{{labelname}="{k}"}} {v:g}' for k, v in values.items()]
+    return lines
+
+
+def render(extra: tuple = ()) -> str:
+    """Prometheus text format for the registry plus extra gauge() lines."""
+    lines = [line for metric in _REGISTRY for line in metric.render()]
+    for block in extra:
+        lines += block
+    return "\n".join(lines) + "\n"
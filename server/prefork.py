@@ -0,0 +1,146 @@
+"""
+Pre-fork launcher: N uvicorn worker processes sharing one listening socket.
+
+The master loads the read-only serving state once (FAISS index and map,
+colour matcher palette and LUT, voxel store; mostly mmap'd files) and
+only then forks the workers, which share those pages with it instead of
+each loading their own copy. Helper processes such as the CLIP inference
+process (inference.EncoderProcess) are started first, so they load in
+parallel with the state.
+
+The master serves no requests. It re-forks a worker that exits, calls
+each helper's check() so a crashed helper is restarted, and on SIGTERM /
+SIGINT stops the workers and then the helpers. On SIGHUP it runs the
+reload callback, so workers forked later inherit fresh state, and forwards
+SIGHUP to every worker; the app reloads its own copy on that signal (see
+main.startup).
+
+POSIX only (os.fork).
+"""
+
+import os
+import signal
+import socket
+import time
+from typing import Callable, Optional, Sequence
+
+import uvicorn
+
+# Seconds a worker gets to finish its requests after SIGTERM
+STOP_TIMEOUT_S = 30.0
+
+
+def _serve(config: uvicorn.Config, sock: socket.socket) -> None:
+    # Runs in the forked worker; uvicorn installs its own signal handlers,
+    # and SIGHUP is ignored until the app installs one
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        signal.signal(sig, signal.SIG_DFL)
+    signal.signal(signal.SIGHUP, signal.SIG_IGN)
+    uvicorn.Server(config).run(sockets=[sock])
+
+
+def _fork(config: uvicorn.Config, sock: socket.socket) -> int:
+    pid = os.fork()
+    if pid == 0:
+        code = 0
+        try:
+            _serve(config, sock)
+        except BaseException as e:
+            print(f"[prefork] Worker {os.getpid()} failed: {e!r}")
+            code = 1
+        finally:
+            # Never fall back into the master's loop
+            os._exit(code)
+    return pid
+
+
+def _reload(reload: Optional[Callable[[], None]], pids: Sequence[int]) -> None:
+    if reload is not None:
+        try:
+            reload()
+        except Exception as e:
+            # Workers still get the signal; each reports its own outcome
+            print(f"[prefork] Master reload failed: {e!r}")
+    print(f"[prefork] Forwarding SIGHUP to workers {list(pids)}")
+    for pid in pids:
+        try:
+            os.kill(pid, signal.SIGHUP)
+        except ProcessLookupError:
+            pass
+
+
+def _stop_workers(pids: Sequence[int]) -> None:
+    for pid in pids:
+        try:
+            os.kill(pid, signal.SIGTERM)
+        except ProcessLookupError:
+            pass
+    deadline = time.monotonic() + STOP_TIMEOUT_S
+    remaining = set(pids)
+    while remaining and time.monotonic() < deadline:
+        for pid in list(remaining):
+            if os.waitpid(pid, os.WNOHANG)[0]:
+                remaining.discard(pid)
+        time.sleep(0.1)
+    for pid in remaining:
+        os.kill(pid, signal.SIGKILL)
+        os.waitpid(pid, 0)
+
+
+def signal_master() -> None:
+    """From a worker: ask the master to reload and signal every worker (SIGHUP)."""
+    os.kill(os.getppid(), signal.SIGHUP)
+
+
+def run(app, preload: Callable[[], None], workers: int, host: str, port: int,
+        helpers: Sequence = (), reload: Optional[Callable[[], None]] = None) -> None:
+    """
+    Serve app on host:port from `workers` forked processes.
+
+    preload  loads the shared state in the master, before forking
+    helpers  objects with start() / check() / stop(), run beside the workers
+    reload   refreshes the master's state on SIGHUP, before it is forwarded
+    """
+    stopping = False
+    reloading = False
+
+    def request_stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+
+    def request_reload(signum, frame):
+        nonlocal reloading
+        reloading = True
+
+    signal.signal(signal.SIGTERM, request_stop)
+    signal.signal(signal.SIGINT, request_stop)
+    signal.signal(signal.SIGHUP, request_reload)
+
+    for helper in helpers:
+        helper.start()
+    try:
+        preload()
+        config = uvicorn.Config(app, host=host, port=port)
+        sock = config.bind_socket()
+        pids = [_fork(config, sock) for _ in range(workers)]
+        print(f"[prefork] Master {os.getpid()} serving on {host}:{port} "
+              f"with {workers} workers: {pids}")
+
+        while not stopping:
+            for i, pid in enumerate(pids):
+                done, status = os.waitpid(pid, os.WNOHANG)
+                if done:
+                    print(f"[prefork] Worker {pid} exited ({status}), forking a new one")
+                    pids[i] = _fork(config, sock)
+            if reloading:
+                reloading = False
+                _reload(reload, pids)
+            for helper in helpers:
+                helper.check()
+            time.sleep(0.5)
+
+        print("[prefork] Stopping workers")
+        _stop_workers(pids)
+    finally:
+        for helper in helpers:
+            helper.stop()
@@ -0,0 +1,250 @@
+"""
+Encodings for the /generate block list.
+
+json      (default) {"blocks": [{"x", "y", "z", "b"}, ...], ...}
+columnar  JSON with a palette and flat x/y/z/p arrays:
+          {"palette": [...], "x": [...], "y": [...], "z": [...], "p": [...], ...}
+binary    application/octet-stream:
+              b"VXB1"
+              uint32 LE  header length
+              header     UTF-8 JSON: width, height, length, schematic_path,
+                         palette, count, coord_dtype, index_dtype
+              x, y, z    count values each, coord_dtype ("u1" or "<u2")
+              p          count values, index_dtype ("u1" or "<u2")
+msgpack   application/msgpack (needs msgpack installed): the binary header
+          fields as a map, with x/y/z/p as raw bytes in the same dtypes
+
+Every format keeps the bottom-to-top (y-sorted) build order. The compact
+formats are gzip/zstd compressed when the client's Accept-Encoding allows.
+
+/generate/stream sends the same build as a sequence of JSON messages, one
+per line (application/x-ndjson) or as server-sent events
+(text/event-stream, "event: <type>" + "data: <json>"):
+
+  {"type": "meta", width, height, length, schematic_path, palette, count}
+  {"type": "layer", "y": y, "x": [...], "z": [...], "p": [...]}   bottom-up,
+                                                  non-empty layers only
+  {"type": "end", "count": count}
+
+p indexes the meta palette, which holds only the blocks that are placed.
+"""
+
+import gzip
+import json
+import struct
+import sys
+from pathlib import Path
+from typing import Iterator, Optional
+
+import numpy as np
+
+_SCHEMGEN_DIR = Path(__file__).parent / "schemgen"
+if str(_SCHEMGEN_DIR) not in sys.path:
+    sys.path.insert(0, str(_SCHEMGEN_DIR))
+
+from sparse import SparseVolume  # noqa: E402 (needs sys.path patch above)
+
+try:
+    import msgpack
+except ImportError:  # optional
+    msgpack = None
+
+try:
+    import zstandard
+except ImportError:  # optional
+    zstandard = None
+
+FORMATS = ("json", "columnar", "binary", "msgpack")
+BINARY_MAGIC = b"VXB1"
+
+_MEDIA_TYPES = {
+    "json": "application/json",
+    "columnar": "application/json",
+    "binary": "application/octet-stream",
+    "msgpack": "application/msgpack",
+}
+_ACCEPT_FORMATS = {
+    "application/json": "json",
+    "*/*": "json",
+    "application/x-voxel-columnar+json": "columnar",
+    "application/octet-stream": "binary",
+    "application/msgpack": "msgpack",
+    "application/x-msgpack": "msgpack",
+}
+# Request headers that select the body, for the Vary response header
+VARY = "Accept, Accept-Encoding"
+STREAM_MEDIA_TYPES = {
+    "ndjson": "application/x-ndjson",
+    "sse": "text/event-stream",
+}
+GZIP_LEVEL = 6
+ZSTD_LEVEL = 3
+
+
+def media_type(fmt: str) -> str:
+    return _MEDIA_TYPES[fmt]
+
+
+def solid_mask(palette: list) -> np.ndarray:
+    """Boolean lookup over palette ids: True for blocks that get placed."""
+    return np.array(["air" not in state for state in palette], dtype=bool)
+
+
+def _q_values(header: Optional[str]) -> dict:
+    """
+    Accept-style header -> {lowercased token: q}, in header order. q=0
+    means "not acceptable"; a malformed q counts as 0.
+    """
+    values = {}
+    for part in (header or "").split(","):
+        token, *params = [p.strip() for p in part.split(";")]
+        q = 1.0
+        for param in params:
+            name, _, value = param.partition("=")
+            if name.strip().lower() == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        if token:
+            values.setdefault(token.lower(), q)
+    return values
+
+
+def negotiate_format(query_format: Optional[str], accept: Optional[str]) -> str:
+    """
+    Pick a response format from the ?format= parameter, falling back to the
+    Accept header, falling back to plain JSON.
+    """
+    if query_format:
+        if query_format not in FORMATS:
+            raise ValueError(f"unknown format {query_format!r}, expected one of {FORMATS}")
+        fmt = query_format
+    else:
+        # Highest q wins, then a named type over */*, then header order
+        accepted = [(q, token != "*/*", _ACCEPT_FORMATS[token])
+                    for token, q in _q_values(accept).items()
+                    if token in _ACCEPT_FORMATS and q > 0]
+        fmt = max(accepted, key=lambda item: item[:2])[2] if accepted else "json"
+    if fmt == "msgpack" and msgpack is None:
+        raise ValueError("msgpack format requested but msgpack is not installed")
+    return fmt
+
+
+def solid_voxels(voxels: SparseVolume, palette: list) -> SparseVolume:
+    """The cells of voxels whose block gets placed, still bottom to top."""
+    solid = solid_mask(palette)
+    keep = solid[voxels.ids]
+    return voxels if keep.all() else voxels.select(keep)
+
+
+def block_columns(voxels: SparseVolume, palette: list):
+    """
+    Solid blocks of a sparse palette id volume as columns.
+
+    Returns (used_palette, xs, ys, zs, ps) where ps indexes used_palette.
+    """
+    voxels = solid_voxels(voxels, palette)
+    used, ps = np.unique(voxels.ids, return_inverse=True)
+    return [palette[i] for i in used.tolist()], voxels.xs, voxels.ys, voxels.zs, ps.reshape(-1)
+
+
+def _columns_header(meta: dict, used_palette: list, count: int) -> tuple[dict, str, str]:
+    coord_dtype = "u1" if max(meta["width"], meta["height"], meta["length"]) <= 256 else "<u2"
+    index_dtype = "u1" if len(used_palette) <= 256 else "<u2"
+    header = dict(meta, palette=used_palette, count=count,
+                  coord_dtype=coord_dtype, index_dtype=index_dtype)
+    return header, coord_dtype, index_dtype
+
+
+def encode(fmt: str, meta: dict, voxels: SparseVolume, palette: list) -> bytes:
+    """
+    Encode the response body for a compact format.
+
+    meta  width, height, length and schematic_path, copied into the output
+    """
+    used_palette, xs, ys, zs, ps = block_columns(voxels, palette)
+
+    if fmt == "columnar":
+        body = dict(meta, palette=used_palette,
+                    x=xs.tolist(), y=ys.tolist(), z=zs.tolist(), p=ps.tolist())
+        return json.dumps(body, separators=(",", ":")).encode()
+
+    header, coord_dtype, index_dtype = _columns_header(meta, used_palette, len(xs))
+    columns = [a.astype(coord_dtype).tobytes() for a in (xs, ys, zs)]
+    columns.append(ps.astype(index_dtype).tobytes())
+
+    if fmt == "msgpack":
+        header.update(zip("xyzp", columns))
+        return msgpack.packb(header, use_bin_type=True)
+
+    header_bytes = json.dumps(header, separators=(",", ":")).encode()
+    return b"".join([BINARY_MAGIC, struct.pack("<I", len(header_bytes)), header_bytes, *columns])
+
+
+def negotiate_stream_framing(accept: Optional[str]) -> str:
+    """SSE if the client asks for text/event-stream, else NDJSON."""
+    return "sse" if _q_values(accept).get("text/event-stream", 0.0) > 0 else "ndjson"
+
+
+def _frame(message: dict, framing: str) -> bytes:
+    data = json.dumps(message, separators=(",", ":"))
+    if framing == "sse":
+        return f"event: {message['type']}\ndata: {data}\n\n".encode()
+    return (data + "\n").encode()
+
+
+def iter_layers(meta: dict, voxels: SparseVolume, palette: list,
+                framing: str = "ndjson") -> Iterator[bytes]:
+    """
+    Stream a sparse palette id volume as framed messages (see the module
+    docstring): metadata and palette first, then one message per non-empty
+    y-layer, bottom-up. Each layer is encoded only when the consumer asks
+    for it, so at most one layer's output is held.
+    """
+    voxels = solid_voxels(voxels, palette)
+    used = np.unique(voxels.ids)
+    # palette id -> position in the streamed palette
+    remap = np.zeros(len(palette), dtype=np.intp)
+    remap[used] = np.arange(len(used))
+
+    yield _frame(dict(meta, type="meta", palette=[palette[i] for i in used.tolist()],
+                      count=voxels.count), framing)
+    for y, cells in voxels.layers():
+        yield _frame({"type": "layer", "y": y, "x": voxels.xs[cells].tolist(),
+                      "z": voxels.zs[cells].tolist(),
+                      "p": remap[voxels.ids[cells]].tolist()}, framing)
+    yield _frame({"type": "end", "count": voxels.count}, framing)
+
+
+def decode_binary(body: bytes) -> dict:
+    """Inverse of the binary encoding, for clients and tests."""
+    if body[:4] != BINARY_MAGIC:
+        raise ValueError("not a VXB1 body")
+    (header_len,) = struct.unpack_from("<I", body, 4)
+    header = json.loads(body[8:8 + header_len])
+    offset = 8 + header_len
+    count = header["count"]
+    for name in "xyzp":
+        dtype = np.dtype(header["index_dtype"] if name == "p" else header["coord_dtype"])
+        header[name] = np.frombuffer(body, dtype=dtype, count=count, offset=offset)
+        offset += count * dtype.itemsize
+    return header
+
+
+def compress(body: bytes, accept_encoding: Optional[str]) -> tuple[bytes, Optional[str]]:
+    """
+    Compress body with the codec the client gives the highest q, zstd on a
+    tie; codecs with q=0, explicit or through "*;q=0", are never used.
+    """
+    accepted = _q_values(accept_encoding)
+    codecs = [c for c in ("zstd", "gzip") if c != "zstd" or zstandard is not None]
+    q = {c: accepted.get(c, accepted.get("*", 0.0)) for c in codecs}
+    codecs = [c for c in codecs if q[c] > 0]
+    if not codecs:
+        return body, None
+    # max() keeps the first of equal q values, i.e. zstd
+    codec = max(codecs, key=q.get)
+    if codec == "zstd":
+        return zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(body), "zstd"
+    return gzip.compress(body, compresslevel=GZIP_LEVEL), "gzip"
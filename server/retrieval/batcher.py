@@ -0,0 +1,118 @@
+"""
+Micro-batching front end for retrieve_batch().
+
+Concurrent callers submit single prompts; a background thread gathers them
+for up to `window_s` (or until `max_batch` are waiting) and runs one CLIP
+encode + FAISS search for the whole batch, then fans results back out.
+"""
+
+import queue
+import threading
+import time
+from concurrent.futures import Future, InvalidStateError
+from typing import Callable, Optional
+
+from .retrieve import retrieve_batch
+
+_STOP = object()
+
+
+class RetrievalBatcher:
+    def __init__(
+        self,
+        batch_fn: Callable[[list], list] = retrieve_batch,
+        max_batch: int = 32,
+        window_s: float = 0.005,
+    ):
+        self.batch_fn = batch_fn
+        self.max_batch = max_batch
+        self.window_s = window_s
+
+        self.batches = 0
+        self.items = 0
+        self.max_seen = 0
+
+        self._queue: "queue.Queue" = queue.Queue()
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+
+    def submit(self, prompt: str) -> Future:
+        """Queue prompt; the future resolves to its dataset index."""
+        with self._lock:
+            # Restart the thread if it ever died, so callers never wait forever
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(
+                    target=self._run, name="retrieval-batcher", daemon=True)
+                self._thread.start()
+        future: Future = Future()
+        self._queue.put((prompt, future))
+        return future
+
+    def retrieve(self, prompt: str) -> int:
+        """Blocking convenience wrapper around submit()."""
+        return self.submit(prompt).result()
+
+    def close(self) -> None:
+        self._queue.put(_STOP)
+
+    def stats(self) -> dict:
+        return {
+            "batches": self.batches,
+            "items": self.items,
+            "avg_batch": self.items / self.batches if self.batches else 0.0,
+            "max_batch_seen": self.max_seen,
+            "queued": self._queue.qsize(),
+        }
+
+    def _collect(self, first) -> tuple[list, bool]:
+        batch = [first]
+        deadline = time.monotonic() + self.window_s
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            try:
+                # Take whatever is already queued even once the window is over
+                item = self._queue.get(timeout=remaining) if remaining > 0 \
+                    else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is _STOP:
+                return batch, True
+            batch.append(item)
+        return batch, False
+
+    def _run(self) -> None:
+        stop = False
+        while not stop:
+            first = self._queue.get()
+            if first is _STOP:
+                return
+            batch, stop = self._collect(first)
+
+            # Callers may have given up (e.g. a disconnected /generate client
+            # cancels its wrapped future); don't spend a batch slot on them
+            batch = [(p, f) for p, f in batch if f.set_running_or_notify_cancel()]
+            if not batch:
+                continue
+
+            self.batches += 1
+            self.items += len(batch)
+            self.max_seen = max(self.max_seen, len(batch))
+            try:
+                results = self.batch_fn([p for p, _ in batch])
+            except Exception as e:
+                for _, f in batch:
+                    _resolve(f, exception=e)
+                continue
+            for (_, f), result in zip(batch, results):
+                _resolve(f, result=result)
+
+
+def _resolve(future: Future, result=None, exception: Optional[BaseException] = None) -> None:
+    """Set one future's outcome; a future that is already done is left alone."""
+    try:
+        if exception is not None:
+            future.set_exception(exception)
+        else:
+            future.set_result(result)
+    except InvalidStateError:
+        pass
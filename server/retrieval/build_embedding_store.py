@@ -0,0 +1,179 @@
+#!/usr/bin/env python3
+"""
+Build the CLIP embedding store (embedding_store.py) that build_index.py reads.
+Run once as a standalone script before building the index:
+    python server/retrieval/build_embedding_store.py --captions captions.txt
+    python server/retrieval/build_embedding_store.py --from-pt   # convert clip_cache.pt
+
+--captions is one caption per line in blockgen-3d train-split order (plain
+text, or JSON lines with a "prompt" field). Captions are CLIP-encoded in
+--batch-size batches on --threads CPU threads, with the next batch tokenised
+while the current one encodes, and appended to flat files. --resume
+continues from the last batch written.
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+from pathlib import Path
+
+import numpy as np
+import torch
+
+sys.path.insert(0, str(Path(__file__).parent))
+
+from embedding_store import (  # noqa: E402 (needs sys.path patch above)
+    DTYPES,
+    EMBEDDINGS_FILE,
+    META_FILE,
+    PROMPTS_FILE,
+    STORE_DIR,
+    read_meta,
+)
+
+CACHE_PATH = Path(__file__).parent.parent / "clip_cache.pt"
+FLUSH_EVERY = 16  # batches
+
+
+def _write_meta(store_dir: Path, count: int, dim: int, dtype: str) -> None:
+    tmp = store_dir / (META_FILE + ".tmp")
+    with open(tmp, "w") as f:
+        json.dump({"count": count, "dim": dim, "dtype": dtype}, f)
+    tmp.replace(store_dir / META_FILE)
+
+
+def _read_captions(path: Path):
+    with open(path) as f:
+        for line in f:
+            line = line.rstrip("\n")
+            yield json.loads(line)["prompt"] if line.startswith("{") else line
+
+
+def _batches(items, size: int):
+    items = iter(items)
+    while batch := list(islice(items, size)):
+        yield batch
+
+
+class _Writer:
+    """Appends embedding rows and captions, committing meta every FLUSH_EVERY batches."""
+
+    def __init__(self, store_dir: Path, dim: int, dtype: str, start: int):
+        self.store_dir, self.dim, self.dtype, self.count = store_dir, dim, dtype, start
+        self.batches = 0
+        store_dir.mkdir(parents=True, exist_ok=True)
+        mode = "r+b" if start else "wb"
+        self.emb_f = open(store_dir / EMBEDDINGS_FILE, mode)
+        self.prompts_f = open(store_dir / PROMPTS_FILE, mode)
+
+        # Drop anything past the last committed row (partial writes)
+        self.emb_f.truncate(start * dim * np.dtype(dtype).itemsize)
+        self.emb_f.seek(0, 2)
+        offset = 0
+        for _ in range(start):
+            offset += len(self.prompts_f.readline())
+        self.prompts_f.truncate(offset)
+        self.prompts_f.seek(offset)
+
+    def write(self, prompts: list[str], embeddings: np.ndarray) -> None:
+        self.emb_f.write(np.ascontiguousarray(embeddings, dtype=self.dtype).tobytes())
+        self.prompts_f.write("".join(json.dumps(p) + "\n" for p in prompts).encode())
+        self.count += len(prompts)
+        self.batches += 1
+        if self.batches % FLUSH_EVERY == 0:
+            self.commit()
+
+    def commit(self) -> None:
+        self.emb_f.flush()
+        self.prompts_f.flush()
+        _write_meta(self.store_dir, self.count, self.dim, self.dtype)
+
+    def close(self) -> None:
+        self.commit()
+        self.emb_f.close()
+        self.prompts_f.close()
+
+
+def encode_captions(captions_path: Path, store_dir: Path = STORE_DIR, dtype: str = "float16",
+                    batch_size: int = 1024, threads: int = 0, resume: bool = False):
+    import clip
+
+    start = 0
+    if resume and (store_dir / META_FILE).exists():
+        meta = read_meta(store_dir)
+        start, dtype = meta["count"], meta["dtype"]
+    if threads:
+        torch.set_num_threads(threads)
+    device = "cuda" if torch.cuda.is_available() else "cpu"
+    model, _ = clip.load("ViT-B/32", device=device)
+    model.eval()
+    dim = model.text_projection.shape[1]
+
+    def tokenize(batch):
+        return batch, clip.tokenize(batch, truncate=True) if batch else None
+
+    print(f"Encoding {captions_path} from caption {start} "
+          f"(batch {batch_size}, {torch.get_num_threads()} threads, {device}) ...")
+    writer = _Writer(store_dir, dim, dtype, start)
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(1, thread_name_prefix="tokenize") as pool, torch.no_grad():
+        batches = _batches(islice(_read_captions(captions_path), start, None), batch_size)
+        pending = pool.submit(tokenize, next(batches, []))
+        while True:
+            prompts, tokens = pending.result()
+            if not prompts:
+                break
+            # Tokenise the next batch while this one encodes
+            pending = pool.submit(tokenize, next(batches, []))
+            embedding = model.encode_text(tokens.to(device)).float()
+            embedding = embedding / embedding.norm(dim=-1, keepdim=True)
+            writer.write(prompts, embedding.cpu().numpy())
+            encoded = writer.count - start
+            print(f"  {writer.count} captions ({encoded / (time.perf_counter() - t0):.1f}/s)")
+    writer.close()
+    _report(store_dir, writer.count - start, time.perf_counter() - t0)
+
+
+def convert_pt(cache_path: Path = CACHE_PATH, store_dir: Path = STORE_DIR,
+               dtype: str = "float16", batch_size: int = 8192):
+    """Copy an existing clip_cache.pt into the store without re-encoding."""
+    print(f"Loading {cache_path} ...")
+    t0 = time.perf_counter()
+    cache: dict = torch.load(cache_path, map_location="cpu", weights_only=True)
+    dim = next(iter(cache.values())).shape[-1]
+    writer = _Writer(store_dir, dim, dtype, 0)
+    for prompts in _batches(cache, batch_size):
+        writer.write(prompts, torch.stack([cache[p] for p in prompts]).float().numpy())
+    writer.close()
+    _report(store_dir, writer.count, time.perf_counter() - t0)
+
+
+def _report(store_dir: Path, added: int, secs: float) -> None:
+    meta = read_meta(store_dir)
+    size_mb = meta["count"] * meta["dim"] * np.dtype(meta["dtype"]).itemsize / 1e6
+    print(f"\nDone. {added} captions in {secs:.1f} s; {meta['count']} total "
+          f"({meta['dim']}-d {meta['dtype']}, {size_mb:.0f} MB) → {store_dir}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build the CLIP embedding store.")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--captions", type=Path, help="captions file to encode")
+    source.add_argument("--from-pt", type=Path, nargs="?", const=CACHE_PATH,
+                        help="convert a clip_cache.pt instead of encoding")
+    parser.add_argument("--dtype", choices=DTYPES, default="float16")
+    parser.add_argument("--batch-size", type=int, default=1024)
+    parser.add_argument("--threads", type=int, default=os.cpu_count(),
+                        help="torch CPU threads for encoding")
+    parser.add_argument("--resume", action="store_true",
+                        help="continue an interrupted --captions build")
+    args = parser.parse_args()
+    if args.captions:
+        encode_captions(args.captions, dtype=args.dtype, batch_size=args.batch_size,
+                        threads=args.threads, resume=args.resume)
+    else:
+        convert_pt(args.from_pt, dtype=args.dtype)
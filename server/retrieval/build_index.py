@@ -1,52 +1,394 @@
 #!/usr/bin/env python3
 """
-Build FAISS index from clip_cache.pt.
+Build FAISS index from the embedding store (build_embedding_store.py), or
+from clip_cache.pt if the store has not been built.
 Run once as a standalone script before starting the server:
     python server/retrieval/build_index.py
+
+Store embeddings are memory-mapped and added to the index --chunk-rows at a
+time, so peak memory is the training sample plus one chunk.
+
+Defaults to an exact IndexFlatIP. For larger caption sets pick an
+approximate and/or compressed index, e.g.
+    python server/retrieval/build_index.py --type ivf-flat --nlist 1024 --nprobe 16
+    python server/retrieval/build_index.py --type ivf-pq --pq-m 64 --report
+    python server/retrieval/build_index.py --type hnsw --storage fp16 --ef-search 64
+
+--report prints recall@k and query latency against the exact flat baseline,
+swept over nprobe / efSearch.
+The chosen search parameters are saved to index_meta.json, which
+retrieve.load_index() applies on startup.
+
+To add captions without a rebuild, append them to the existing index:
+    python server/retrieval/build_index.py --append new_prompts.jsonl
+where each line is {"prompt": ..., "dataset_idx": ...}. Only the new
+prompts are CLIP-encoded; a (dataset_idx, prompt) pair that is already
+indexed is skipped, so extra captions for an indexed build are added.
+A running server picks the result up via POST /admin/reload-index (the
+server needs ADMIN_TOKEN set for that endpoint).
+Appended rows are also kept in appended_prompts.jsonl /
+appended_embeddings.npy beside the index, since the embedding store does
+not hold them; a full rebuild adds them back after the store.
 """
 
+import argparse
 import json
+import os
 import sys
+import time
 from pathlib import Path
 
 import faiss
 import numpy as np
 import torch
 
+sys.path.insert(0, str(Path(__file__).parent))
+
+import embedding_store  # noqa: E402 (needs sys.path patch above)
+
 CACHE_PATH = Path(__file__).parent.parent / "clip_cache.pt"
 INDEX_PATH = Path(__file__).parent / "faiss.index"
-MAP_PATH = Path(__file__).parent / "index_map.json"
+MAP_PATH = Path(__file__).parent / "index_map.npy"
+# Written by builds before index_map.npy existed
+LEGACY_MAP_PATH = Path(__file__).parent / "index_map.json"
+META_PATH = Path(__file__).parent / "index_meta.json"
+# Rows added by --append: {"prompt", "dataset_idx"} lines and their embeddings
+APPENDED_PROMPTS_PATH = Path(__file__).parent / "appended_prompts.jsonl"
+APPENDED_EMBEDDINGS_PATH = Path(__file__).parent / "appended_embeddings.npy"
+
+INDEX_TYPES = ("flat", "ivf-flat", "ivf-pq", "hnsw")
+# Vector storage for flat / ivf-flat / hnsw (ivf-pq is always PQ-coded)
+STORAGE_CODES = {"fp32": "Flat", "fp16": "SQfp16", "sq8": "SQ8"}
+
+
+# Rows converted to float32 and added to the index at a time
+CHUNK_ROWS = 65_536
 
 
-def build():
+def load_embeddings() -> np.ndarray:
+    """
+    [N, D] embeddings, row = blockgen-3d dataset index. Memory-mapped from
+    the embedding store when built, else read fully from clip_cache.pt.
+    """
+    if embedding_store.is_available():
+        print(f"Opening embedding store {embedding_store.STORE_DIR} ...")
+        return embedding_store.open_embeddings()
+
     print(f"Loading clip_cache.pt from {CACHE_PATH} ...")
     cache: dict = torch.load(CACHE_PATH, map_location="cpu", weights_only=True)
 
     # Ordered iteration (Python 3.7+ dicts preserve insertion order).
     # Position in the dict = position in the blockgen-3d train split.
     prompts = list(cache.keys())
-    embeddings = np.stack([cache[p].float().numpy() for p in prompts]).astype("float32")
+    return np.stack([cache[p].float().numpy() for p in prompts]).astype("float32")
+
+
+def _sample_rows(embeddings: np.ndarray, size: int, rng) -> np.ndarray:
+    """float32 copy of `size` random rows, read in file order."""
+    rows = np.sort(rng.choice(len(embeddings), min(size, len(embeddings)), replace=False))
+    return next(embedding_store.iter_chunks(embeddings[rows], len(rows)))
+
+
+def _save_atomic(path: Path, write) -> None:
+    """write(tmp_path), then rename over path so readers never see a partial file."""
+    tmp = path.with_name(path.name + ".tmp")
+    write(tmp)
+    os.replace(tmp, path)
+
+
+def load_new_prompts(path: Path) -> tuple[list[str], np.ndarray]:
+    """Read {"prompt", "dataset_idx"} lines, keeping the first of each pair."""
+    prompts, dataset_idxs, seen = [], [], set()
+    with open(path) as f:
+        for line in f:
+            if not line.strip():
+                continue
+            row = json.loads(line)
+            pair = (int(row["dataset_idx"]), row["prompt"])
+            if pair in seen:
+                continue
+            seen.add(pair)
+            dataset_idxs.append(pair[0])
+            prompts.append(pair[1])
+    return prompts, np.asarray(dataset_idxs, dtype=np.int64)
+
+
+def load_index_map() -> np.ndarray:
+    """index_map.npy, or index_map.json from an older build."""
+    if MAP_PATH.exists():
+        return np.load(MAP_PATH)
+    with open(LEGACY_MAP_PATH) as f:
+        return np.asarray(json.load(f), dtype=np.int64)
+
+
+def load_appended() -> tuple[list[tuple[int, str]], np.ndarray]:
+    """
+    (dataset_idx, prompt) rows added by --append and their float32 [M, D]
+    embeddings; ([], None) if nothing was appended.
+    """
+    if not APPENDED_PROMPTS_PATH.exists():
+        return [], None
+    with open(APPENDED_PROMPTS_PATH) as f:
+        rows = [(int(r["dataset_idx"]), r["prompt"]) for r in map(json.loads, f)]
+    embeddings = np.load(APPENDED_EMBEDDINGS_PATH)
+    # The embeddings are written first, so extra rows are from a failed append
+    return rows[:len(embeddings)], embeddings[:len(rows)]
+
+
+def save_appended(rows: list[tuple[int, str]], embeddings: np.ndarray) -> None:
+    def write_embeddings(tmp):
+        with open(tmp, "wb") as f:
+            np.save(f, embeddings)
+
+    def write_prompts(tmp):
+        with open(tmp, "w") as f:
+            for idx, prompt in rows:
+                f.write(json.dumps({"prompt": prompt, "dataset_idx": idx}) + "\n")
+
+    _save_atomic(APPENDED_EMBEDDINGS_PATH, write_embeddings)
+    _save_atomic(APPENDED_PROMPTS_PATH, write_prompts)
+
+
+def _store_pairs(dataset_idxs: np.ndarray) -> set:
+    """(dataset_idx, caption) of the embedding store rows among dataset_idxs."""
+    if not embedding_store.is_available():
+        return set()
+    captions = embedding_store.read_prompts()
+    return {(i, captions[i]) for i in set(dataset_idxs.tolist()) if 0 <= i < len(captions)}
+
+
+def encode_prompts(prompts: list[str], batch_size: int = 256) -> np.ndarray:
+    """CLIP-encode prompts the same way retrieve.py does; L2-normalised float32."""
+    import clip
+
+    device = "cuda" if torch.cuda.is_available() else "cpu"
+    model, _ = clip.load("ViT-B/32", device=device)
+    model.eval()
+
+    chunks = []
+    with torch.no_grad():
+        for start in range(0, len(prompts), batch_size):
+            tokens = clip.tokenize(prompts[start:start + batch_size], truncate=True).to(device)
+            embedding = model.encode_text(tokens).float()
+            embedding = embedding / embedding.norm(dim=-1, keepdim=True)
+            chunks.append(embedding.cpu().numpy().astype("float32"))
+            print(f"  encoded {min(start + batch_size, len(prompts))}/{len(prompts)}")
+    return np.concatenate(chunks)
+
+
+def factory_key(index_type: str, storage: str, nlist: int, pq_m: int, hnsw_m: int) -> str:
+    """faiss.index_factory description for the requested index."""
+    code = STORAGE_CODES[storage]
+    if index_type == "flat":
+        return code
+    if index_type == "ivf-flat":
+        return f"IVF{nlist},{code}"
+    if index_type == "ivf-pq":
+        return f"IVF{nlist},PQ{pq_m}"
+    if index_type == "hnsw":
+        return f"HNSW{hnsw_m}" if storage == "fp32" else f"HNSW{hnsw_m},{code}"
+    raise ValueError(f"unknown index type {index_type!r}")
+
+
+def search_params(index_type: str, nprobe: int, ef_search: int) -> dict:
+    """faiss.ParameterSpace parameters to apply whenever the index is loaded."""
+    if index_type.startswith("ivf"):
+        return {"nprobe": nprobe}
+    if index_type == "hnsw":
+        return {"efSearch": ef_search}
+    return {}
+
+
+def apply_search_params(index: faiss.Index, params: dict) -> None:
+    space = faiss.ParameterSpace()
+    for name, value in params.items():
+        space.set_index_parameter(index, name, value)
+
+
+def add_chunked(index: faiss.Index, embeddings: np.ndarray, chunk_rows: int = CHUNK_ROWS) -> None:
+    for chunk in embedding_store.iter_chunks(embeddings, chunk_rows):
+        index.add(chunk)
+        if len(embeddings) > chunk_rows:
+            print(f"  added {index.ntotal}/{len(embeddings)}")
+
+
+def make_index(embeddings: np.ndarray, key: str, train_size: int, seed: int = 0,
+               chunk_rows: int = CHUNK_ROWS) -> faiss.Index:
+    dim = embeddings.shape[1]
+    # Embeddings are already L2-normalised, so inner product == cosine similarity.
+    index = faiss.index_factory(dim, key, faiss.METRIC_INNER_PRODUCT)
+
+    if not index.is_trained:
+        sample = _sample_rows(embeddings, train_size, np.random.default_rng(seed))
+        print(f"  training {key} on {len(sample)} vectors ...")
+        t0 = time.perf_counter()
+        index.train(sample)
+        print(f"  trained in {time.perf_counter() - t0:.1f} s")
+        del sample
+
+    add_chunked(index, embeddings, chunk_rows)
+    return index
+
+
+# Values swept by the --report recall/latency table
+SWEEP = {"nprobe": [1, 4, 16, 64, 256], "efSearch": [16, 32, 64, 128, 256]}
+
+
+def recall_report(index: faiss.Index, embeddings: np.ndarray, params: dict,
+                  k: int = 10, n_queries: int = 1000, seed: int = 0) -> None:
+    """
+    recall@1 / recall@k and per-query latency of `index` against an exact
+    flat search, swept over its search parameter. Queries are noisy copies
+    of random stored captions, so they fall near stored vectors rather than
+    exactly on them.
+    """
+    rng = np.random.default_rng(seed)
+    queries = _sample_rows(embeddings, n_queries, rng)
+    queries += rng.standard_normal(queries.shape).astype("float32") * queries.std()
+    queries /= np.linalg.norm(queries, axis=1, keepdims=True)
+
+    flat = faiss.IndexFlatIP(embeddings.shape[1])
+    add_chunked(flat, embeddings)
+
+    def timed_search(idx):
+        t0 = time.perf_counter()
+        _, I = idx.search(queries, k)
+        return I, (time.perf_counter() - t0) / n_queries
+
+    truth, flat_s = timed_search(flat)
+    print(f"\nRecall vs flat baseline ({n_queries} queries, "
+          f"flat {flat_s * 1e3:.3f} ms/query)")
+
+    name = next(iter(params), None)
+    for value in SWEEP.get(name, [None]):
+        if name is not None:
+            apply_search_params(index, {name: value})
+        found, ann_s = timed_search(index)
+        recall_1 = np.mean(found[:, 0] == truth[:, 0])
+        recall_k = np.mean([len(set(f) & set(t)) / k for f, t in zip(found, truth)])
+        label = f"{name}={value}" if name is not None else "exact"
+        print(f"  {label:<14} recall@1 {recall_1:.3f}   recall@{k} {recall_k:.3f}   "
+              f"{ann_s * 1e3:.3f} ms/query  (x{flat_s / ann_s:.1f})")
+
+    # Leave the index configured as it will be saved
+    apply_search_params(index, params)
+
+
+def build(index_type: str = "flat", storage: str = "fp32", nlist: int = 1024,
+          pq_m: int = 64, hnsw_m: int = 32, train_size: int = 100_000,
+          nprobe: int = 16, ef_search: int = 64, report: bool = False,
+          chunk_rows: int = CHUNK_ROWS):
+    embeddings = load_embeddings()
 
     n, dim = embeddings.shape
     print(f"  {n} vectors, dim={dim}")
 
-    # Embeddings are already L2-normalised, so IndexFlatIP == cosine similarity.
-    index = faiss.IndexFlatIP(dim)
-    index.add(embeddings)
+    key = factory_key(index_type, storage, nlist, pq_m, hnsw_m)
+    params = search_params(index_type, nprobe, ef_search)
+    index = make_index(embeddings, key, train_size, chunk_rows=chunk_rows)
+    index_map = np.arange(n, dtype=np.int64)
 
-    INDEX_PATH.parent.mkdir(parents=True, exist_ok=True)
-    faiss.write_index(index, str(INDEX_PATH))
-    print(f"Saved index  → {INDEX_PATH}")
+    appended, appended_embeddings = load_appended()
+    if appended:
+        print(f"  adding {len(appended)} appended vectors from {APPENDED_PROMPTS_PATH.name}")
+        add_chunked(index, appended_embeddings, chunk_rows)
+        index_map = np.concatenate([index_map, [idx for idx, _ in appended]])
+    apply_search_params(index, params)
+
+    if report:
+        recall_report(index, embeddings, params)
 
+    INDEX_PATH.parent.mkdir(parents=True, exist_ok=True)
     # index_map[faiss_position] = blockgen-3d dataset index (same as faiss position
-    # because the cache is ordered to match the train split).
-    index_map = list(range(n))
-    with open(MAP_PATH, "w") as f:
-        json.dump(index_map, f)
+    # because the cache is ordered to match the train split, then the appended
+    # rows). Stored as .npy so retrieve.py can memory-map it.
+    save_index(index, index_map)
+    print(f"Saved index  → {INDEX_PATH}  ({key})")
     print(f"Saved index_map → {MAP_PATH}")
 
+    with open(META_PATH, "w") as f:
+        json.dump({"type": index_type, "factory": key, "search_params": params}, f)
+    print(f"Saved index_meta → {META_PATH}")
+
     print(f"\nDone. {index.ntotal} vectors indexed.")
 
 
+def save_index(index: faiss.Index, index_map: np.ndarray) -> None:
+    """
+    Replace faiss.index and index_map.npy, each atomically. The map goes
+    first: a reader that sees the new map with the old index only has
+    extra, unused rows.
+    """
+    def write_map(tmp):
+        with open(tmp, "wb") as f:
+            np.save(f, index_map)
+
+    _save_atomic(MAP_PATH, write_map)
+    _save_atomic(INDEX_PATH, lambda tmp: faiss.write_index(index, str(tmp)))
+
+
+def append(prompts_path: Path, batch_size: int = 256) -> None:
+    """
+    Encode only the prompts in prompts_path and add them to the existing
+    index, skipping (dataset_idx, prompt) pairs it already holds.
+    """
+    prompts, dataset_idxs = load_new_prompts(prompts_path)
+
+    print(f"Loading {INDEX_PATH} ...")
+    index = faiss.read_index(str(INDEX_PATH))
+    index_map = load_index_map()[:index.ntotal]
+    appended, appended_embeddings = load_appended()
+
+    indexed = set(appended) | _store_pairs(dataset_idxs)
+    new = np.array([pair not in indexed for pair in zip(dataset_idxs.tolist(), prompts)],
+                   dtype=bool)
+    print(f"  {len(prompts)} prompts, {int(new.sum())} not yet indexed")
+    for idx, prompt, keep in zip(dataset_idxs.tolist(), prompts, new):
+        if not keep:
+            print(f"  skipped, already indexed: {idx} {prompt!r}")
+    if not new.any():
+        return
+    prompts = [p for p, keep in zip(prompts, new) if keep]
+    dataset_idxs = dataset_idxs[new]
+
+    t0 = time.perf_counter()
+    embeddings = encode_prompts(prompts, batch_size)
+    print(f"  encoded in {time.perf_counter() - t0:.1f} s")
+
+    # Trained indexes (IVF / PQ / SQ) keep their trained quantizers, so new
+    # vectors are just added; the IVF coarse centroids are not retrained.
+    index.add(embeddings)
+    # The embedding store does not hold these rows, so build() takes them
+    # from here; saved first, so the index never has rows a rebuild would drop
+    rows = appended + list(zip(dataset_idxs.tolist(), prompts))
+    save_appended(rows, embeddings if appended_embeddings is None
+                  else np.concatenate([appended_embeddings, embeddings]))
+    save_index(index, np.concatenate([index_map, dataset_idxs]))
+    print(f"\nDone. {len(prompts)} vectors appended, {index.ntotal} indexed.")
+
+
 if __name__ == "__main__":
-    build()
+    parser = argparse.ArgumentParser(description="Build the FAISS retrieval index.")
+    parser.add_argument("--type", choices=INDEX_TYPES, default="flat")
+    parser.add_argument("--storage", choices=tuple(STORAGE_CODES), default="fp32",
+                        help="vector storage for flat / ivf-flat / hnsw")
+    parser.add_argument("--nlist", type=int, default=1024, help="IVF cells")
+    parser.add_argument("--pq-m", type=int, default=64, help="PQ sub-quantizers")
+    parser.add_argument("--hnsw-m", type=int, default=32, help="HNSW neighbours per node")
+    parser.add_argument("--train-size", type=int, default=100_000,
+                        help="vectors sampled for training IVF / PQ / SQ")
+    parser.add_argument("--nprobe", type=int, default=16, help="IVF cells searched")
+    parser.add_argument("--ef-search", type=int, default=64, help="HNSW search depth")
+    parser.add_argument("--report", action="store_true",
+                        help="print recall@k and latency against a flat index")
+    parser.add_argument("--chunk-rows", type=int, default=CHUNK_ROWS,
+                        help="embeddings added to the index at a time")
+    parser.add_argument("--append", type=Path, metavar="JSONL",
+                        help="add these {prompt, dataset_idx} lines to the existing index")
+    parser.add_argument("--batch-size", type=int, default=256, help="CLIP batch for --append")
+    args = parser.parse_args()
+    if args.append:
+        append(args.append, args.batch_size)
+    else:
+        build(args.type, args.storage, args.nlist, args.pq_m, args.hnsw_m,
+              args.train_size, args.nprobe, args.ef_search, args.report, args.chunk_rows)
@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+"""
+Pack the blockgen-3d train split into the local voxel store (voxel_store.py).
+Run once as a standalone script before starting the server:
+    python server/retrieval/build_voxel_store.py [--limit N] [--resume]
+
+Streams the dataset once, in order, appending uint8 colours and bit-packed
+occupancy to flat files. --resume continues from the last sample written.
+"""
+
+import argparse
+import json
+import sys
+from pathlib import Path
+
+import numpy as np
+from datasets import load_dataset
+
+sys.path.insert(0, str(Path(__file__).parent))
+
+from voxel_store import (  # noqa: E402 (needs sys.path patch above)
+    COLORS_FILE,
+    META_FILE,
+    OCCUPANCY_FILE,
+    STORE_DIR,
+    pack_occupancy,
+    read_meta,
+)
+
+GRID = 32
+FLUSH_EVERY = 1000
+
+
+def _write_meta(store_dir: Path, count: int) -> None:
+    tmp = store_dir / (META_FILE + ".tmp")
+    with open(tmp, "w") as f:
+        json.dump({"count": count, "grid": GRID}, f)
+    tmp.replace(store_dir / META_FILE)
+
+
+def build(store_dir: Path = STORE_DIR, limit=None, resume=False):
+    store_dir.mkdir(parents=True, exist_ok=True)
+    start = read_meta(store_dir)["count"] if resume and (store_dir / META_FILE).exists() else 0
+    mode = "r+b" if start else "wb"
+
+    print(f"Streaming PeterAM4/blockgen-3d train split from sample {start} ...")
+    dataset = load_dataset("PeterAM4/blockgen-3d", split="train", streaming=True)
+    if start:
+        dataset = dataset.skip(start)
+    if limit is not None:
+        dataset = dataset.take(max(limit - start, 0))
+
+    color_bytes = 3 * GRID ** 3
+    occ_bytes = GRID ** 3 // 8
+    count = start
+    with open(store_dir / COLORS_FILE, mode) as colors_f, \
+            open(store_dir / OCCUPANCY_FILE, mode) as occ_f:
+        # Drop anything past the last committed sample (partial writes)
+        colors_f.truncate(start * color_bytes)
+        occ_f.truncate(start * occ_bytes)
+        colors_f.seek(0, 2)
+        occ_f.seek(0, 2)
+
+        for sample in dataset:
+            colors = np.asarray(sample["voxels_colors"], dtype=np.float32)   # [3,32,32,32]
+            occ = np.asarray(sample["voxels_occupancy"], dtype=np.float32)   # [1,32,32,32]
+
+            colors_u8 = np.rint(np.clip(colors, 0.0, 1.0) * 255).astype(np.uint8)
+            colors_f.write(colors_u8.tobytes())
+            occ_f.write(pack_occupancy(occ).tobytes())
+            count += 1
+
+            if count % FLUSH_EVERY == 0:
+                colors_f.flush()
+                occ_f.flush()
+                _write_meta(store_dir, count)
+                print(f"  {count} samples")
+
+    _write_meta(store_dir, count)
+    size_mb = count * (color_bytes + occ_bytes) / 1e6
+    print(f"\nDone. {count} samples ({size_mb:.0f} MB) → {store_dir}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build the local voxel store.")
+    parser.add_argument("--limit", type=int, default=None,
+                        help="stop after this many samples")
+    parser.add_argument("--resume", action="store_true",
+                        help="continue an interrupted build")
+    args = parser.parse_args()
+    build(limit=args.limit, resume=args.resume)
@@ -0,0 +1,60 @@
+"""
+Memory-mapped store of CLIP caption embeddings, replacing clip_cache.pt.
+
+Built offline by build_embedding_store.py. Embeddings are one contiguous
+float16 or float32 [N, D] matrix (row = blockgen-3d dataset index) with the
+captions alongside as a JSON-lines string table, so build_index.py can read
+the matrix in chunks instead of unpickling a dict of tensors.
+"""
+
+import json
+from pathlib import Path
+from typing import Iterator
+
+import numpy as np
+
+STORE_DIR = Path(__file__).parent / "embedding_store"
+EMBEDDINGS_FILE = "embeddings.bin"
+PROMPTS_FILE = "prompts.jsonl"
+META_FILE = "meta.json"
+
+DTYPES = ("float16", "float32")
+
+
+def is_available(store_dir: Path = STORE_DIR) -> bool:
+    return (store_dir / META_FILE).exists()
+
+
+def read_meta(store_dir: Path = STORE_DIR) -> dict:
+    with open(store_dir / META_FILE) as f:
+        return json.load(f)
+
+
+def open_embeddings(store_dir: Path = STORE_DIR) -> np.memmap:
+    """The [count, dim] embedding matrix, memory-mapped read-only."""
+    meta = read_meta(store_dir)
+    return np.memmap(store_dir / EMBEDDINGS_FILE, dtype=meta["dtype"], mode="r",
+                     shape=(meta["count"], meta["dim"]))
+
+
+def read_prompts(store_dir: Path = STORE_DIR) -> list[str]:
+    """Captions in row order."""
+    count = read_meta(store_dir)["count"]
+    prompts = []
+    with open(store_dir / PROMPTS_FILE) as f:
+        for line in f:
+            if len(prompts) == count:
+                break
+            prompts.append(json.loads(line))
+    return prompts
+
+
+def iter_chunks(embeddings: np.ndarray, chunk_rows: int) -> Iterator[np.ndarray]:
+    """
+    float32 copies of chunk_rows rows at a time, re-normalised (float16
+    storage loses a little of the unit norm).
+    """
+    for start in range(0, len(embeddings), chunk_rows):
+        chunk = np.array(embeddings[start:start + chunk_rows], dtype=np.float32)
+        chunk /= np.linalg.norm(chunk, axis=1, keepdims=True)
+        yield chunk
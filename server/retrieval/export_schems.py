@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+"""
+Bulk-export dataset samples as .schem files, offline from the voxel store.
+    python server/retrieval/export_schems.py --indices 0-9999 --out exports/
+    python server/retrieval/export_schems.py --index-file popular.txt --workers 8
+
+--indices takes comma-separated indices and inclusive ranges ("0-99,250");
+--index-file one index per line. Indices are exported in ascending order,
+--chunk-size consecutive samples per task, over a pool of --workers
+processes that each load the colour matcher and voxel store once. A worker
+converts its whole chunk before writing the chunk's files.
+
+Files go to <out>/<idx // 1000>/<idx>.schem. Each finished item is appended
+to <out>/manifest.jsonl with its timings, so an interrupted export picks up
+where it stopped; the run's throughput is written to <out>/summary.json.
+--dither picks the colour matching mode (see schemgen/dither.py).
+Needs the voxel store (build_voxel_store.py); the dataset is never streamed.
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+# Fail instead of reaching for the Hub if anything tries to
+os.environ.setdefault("HF_DATASETS_OFFLINE", "1")
+
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from retrieval import voxel_store  # noqa: E402 (needs sys.path patch above)
+from retrieval.voxel_to_schem import (  # noqa: E402
+    DITHER_MODES,
+    load_converter,
+    save_schem,
+    voxel_to_build,
+)
+
+MANIFEST_FILE = "manifest.jsonl"
+SUMMARY_FILE = "summary.json"
+
+
+def parse_indices(spec: str) -> list[int]:
+    """ "0-99,250" -> sorted unique indices; ranges are inclusive."""
+    indices = set()
+    for part in spec.split(","):
+        part = part.strip()
+        if not part:
+            continue
+        first, _, last = part.partition("-")
+        indices.update(range(int(first), int(last or first) + 1))
+    return sorted(indices)
+
+
+def read_index_file(path: Path) -> list[int]:
+    with open(path) as f:
+        return sorted({int(line) for line in f if line.strip()})
+
+
+def schem_path(out_dir: Path, dataset_idx: int) -> Path:
+    return out_dir / f"{dataset_idx // 1000:04d}" / f"{dataset_idx}.schem"
+
+
+def read_manifest(out_dir: Path) -> set[int]:
+    """Dataset indices already exported."""
+    done = set()
+    path = out_dir / MANIFEST_FILE
+    if path.exists():
+        with open(path) as f:
+            for line in f:
+                try:
+                    row = json.loads(line)
+                except json.JSONDecodeError:
+                    continue  # line cut short by an interrupted run
+                if "error" not in row:
+                    done.add(row["dataset_idx"])
+    return done
+
+
+def _export_chunk(indices: list[int], out_dir: Path, dither: str = "none") -> list[dict]:
+    """Runs in a worker: convert every sample in the chunk, then write them."""
+    rows, builds = [], []
+    for idx in indices:
+        t0 = time.perf_counter()
+        try:
+            build = voxel_to_build(idx, dither)
+        except (IndexError, ValueError) as e:
+            rows.append({"dataset_idx": idx, "error": str(e)})
+            continue
+        builds.append((idx, build, time.perf_counter() - t0))
+
+    for idx, build, convert_s in builds:
+        path = schem_path(out_dir, idx)
+        t0 = time.perf_counter()
+        save_schem(build, str(path))
+        rows.append({
+            "dataset_idx": idx,
+            "path": str(path.relative_to(out_dir)),
+            "blocks": build.voxels.count,
+            "convert_ms": round(convert_s * 1e3, 3),
+            "write_ms": round((time.perf_counter() - t0) * 1e3, 3),
+            "worker": os.getpid(),
+        })
+    return rows
+
+
+def export(indices: list[int], out_dir: Path, workers: int = os.cpu_count(),
+           chunk_size: int = 64, dither: str = "none") -> dict:
+    if not voxel_store.is_available():
+        raise SystemExit("voxel store not built; run build_voxel_store.py first")
+
+    out_dir.mkdir(parents=True, exist_ok=True)
+    done = read_manifest(out_dir)
+    todo = [i for i in indices if i not in done]
+    print(f"[export] {len(indices)} indices, {len(indices) - len(todo)} already exported, "
+          f"{len(todo)} to go on {workers} workers")
+
+    chunks = [todo[i:i + chunk_size] for i in range(0, len(todo), chunk_size)]
+    exported = failed = 0
+    convert_s = write_s = 0.0
+    t0 = time.perf_counter()
+    with ProcessPoolExecutor(workers, initializer=load_converter) as pool, \
+            open(out_dir / MANIFEST_FILE, "a") as manifest:
+        for rows in pool.map(_export_chunk, chunks, [out_dir] * len(chunks),
+                             [dither] * len(chunks)):
+            manifest.write("".join(json.dumps(row) + "\n" for row in rows))
+            manifest.flush()
+            for row in rows:
+                if "error" in row:
+                    failed += 1
+                    print(f"[export] {row['dataset_idx']}: {row['error']}")
+                else:
+                    exported += 1
+                    convert_s += row["convert_ms"] / 1e3
+                    write_s += row["write_ms"] / 1e3
+            elapsed = time.perf_counter() - t0
+            print(f"[export] {exported + failed}/{len(todo)} "
+                  f"({exported / elapsed:.1f} schems/s)")
+
+    elapsed = time.perf_counter() - t0
+    n = exported or 1
+    summary = {
+        "requested": len(indices),
+        "skipped": len(indices) - len(todo),
+        "exported": exported,
+        "failed": failed,
+        "workers": workers,
+        "dither": dither,
+        "elapsed_s": round(elapsed, 3),
+        "schems_per_s": round(exported / elapsed, 3) if elapsed else 0.0,
+        "avg_convert_ms": round(1e3 * convert_s / n, 3),
+        "avg_write_ms": round(1e3 * write_s / n, 3),
+    }
+    with open(out_dir / SUMMARY_FILE, "w") as f:
+        json.dump(summary, f, indent=2)
+    print(f"\nDone. {exported} exported, {failed} failed in {elapsed:.1f} s "
+          f"({summary['schems_per_s']} schems/s) → {out_dir}")
+    return summary
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Bulk-export samples as .schem files.")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--indices", type=parse_indices, help='e.g. "0-999,1500"')
+    source.add_argument("--index-file", type=Path, help="one dataset index per line")
+    parser.add_argument("--out", type=Path, default=Path("exports"))
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--chunk-size", type=int, default=64,
+                        help="consecutive samples per worker task")
+    parser.add_argument("--dither", choices=DITHER_MODES, default="none")
+    args = parser.parse_args()
+    indices = args.indices if args.indices is not None else read_index_file(args.index_file)
+    export(indices, args.out, args.workers, args.chunk_size, args.dither)
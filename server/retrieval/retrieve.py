@@ -2,59 +2,355 @@
 FAISS nearest-neighbour retrieval over clip_cache embeddings.
 
 Call load_index() once at server startup, then retrieve(prompt) per request.
+With an EncoderClient (inference.py) prompts are CLIP-encoded by a separate
+inference process, and torch and CLIP are not even imported here: the
+prefork master must not load torch before it forks its workers.
 """
 
 import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import Optional
+from typing import TYPE_CHECKING, Optional
 
-import clip
 import faiss
 import numpy as np
-import torch
+
+import metrics  # server/metrics.py; retrieval is always imported from server/
+
+if TYPE_CHECKING:
+    from cache import SemanticCache
+    from inference import EncoderClient
 
 _INDEX_PATH = Path(__file__).parent / "faiss.index"
-_MAP_PATH = Path(__file__).parent / "index_map.json"
+_MAP_PATH = Path(__file__).parent / "index_map.npy"
+_LEGACY_MAP_PATH = Path(__file__).parent / "index_map.json"
+_META_PATH = Path(__file__).parent / "index_meta.json"
+
+# Search parameters for approximate indexes built without index_meta.json
+_DEFAULT_NPROBE = 16
+_DEFAULT_EF_SEARCH = 64
 
 _index: Optional[faiss.Index] = None
-_index_map: Optional[list] = None
+_index_map: Optional[np.ndarray] = None
 _clip_model = None
 _clip_device: Optional[str] = None
+_encoder: Optional["EncoderClient"] = None
+# Modification times of the index files the current pair was read from
+_loaded_stamp: tuple = ()
+_load_timings: dict = {}
+
+# _index and _index_map are swapped together by reload_index(); readers take
+# both under _swap_lock so they never pair an index with another's map
+_swap_lock = threading.Lock()
+_reload_lock = threading.Lock()
+
+# Map the index file instead of reading it onto the heap, so every worker
+# process shares the same page-cache copy. IO_FLAG_MMAP_IFC covers flat
+# codes (Flat / SQ / HNSW storage), IO_FLAG_MMAP the IVF inverted lists.
+_MMAP_FLAGS = (faiss.IO_FLAG_MMAP | getattr(faiss, "IO_FLAG_MMAP_IFC", 0)
+               | faiss.IO_FLAG_READ_ONLY)
+
+
+def _index_kind(index: faiss.Index) -> str:
+    """Detect the index family: "ivf", "hnsw" or "flat"."""
+    try:
+        faiss.extract_index_ivf(index)
+        return "ivf"
+    except RuntimeError:
+        pass
+    if hasattr(faiss.downcast_index(index), "hnsw"):
+        return "hnsw"
+    return "flat"
+
+
+def _configure_index(index: faiss.Index) -> str:
+    """Apply the search parameters saved by build_index.py (or defaults)."""
+    kind = _index_kind(index)
+    if _META_PATH.exists():
+        with open(_META_PATH) as f:
+            params = json.load(f).get("search_params", {})
+    elif kind == "ivf":
+        params = {"nprobe": _DEFAULT_NPROBE}
+    elif kind == "hnsw":
+        params = {"efSearch": _DEFAULT_EF_SEARCH}
+    else:
+        params = {}
+
+    space = faiss.ParameterSpace()
+    for name, value in params.items():
+        space.set_index_parameter(index, name, value)
+    return ", ".join([kind] + [f"{k}={v}" for k, v in params.items()])
+
+
+def _read_index(path: Path) -> tuple[faiss.Index, bool]:
+    """Read the index memory-mapped if faiss supports it for this type."""
+    try:
+        return faiss.read_index(str(path), _MMAP_FLAGS), True
+    except RuntimeError:
+        pass
+    try:
+        # e.g. IVF with in-memory inverted lists: those stay on the heap
+        return faiss.read_index(str(path), _MMAP_FLAGS & ~faiss.IO_FLAG_MMAP), False
+    except RuntimeError:
+        return faiss.read_index(str(path)), False
+
+
+def _read_index_map() -> np.ndarray:
+    if _MAP_PATH.exists():
+        return np.load(_MAP_PATH, mmap_mode="r")
+    # Indexes built before index_map.npy existed
+    with open(_LEGACY_MAP_PATH) as f:
+        return np.asarray(json.load(f), dtype=np.int64)
+
+
+def _index_stamp() -> tuple:
+    map_path = _MAP_PATH if _MAP_PATH.exists() else _LEGACY_MAP_PATH
+    return tuple(path.stat().st_mtime_ns if path.exists() else 0
+                 for path in (_INDEX_PATH, map_path))
+
 
+def _timed(name: str, fn, *args):
+    t0 = time.perf_counter()
+    result = fn(*args)
+    _load_timings[name] = time.perf_counter() - t0
+    return result
 
-def load_index() -> None:
-    """Load FAISS index, index map, and CLIP model. Call once at startup."""
-    global _index, _index_map, _clip_model, _clip_device
 
-    _index = faiss.read_index(str(_INDEX_PATH))
-    with open(_MAP_PATH) as f:
-        _index_map = json.load(f)
+def _load_clip() -> tuple:
+    import clip
+    import torch
 
-    _clip_device = "cuda" if torch.cuda.is_available() else "cpu"
-    _clip_model, _ = clip.load("ViT-B/32", device=_clip_device)
-    _clip_model.eval()
+    device = "cuda" if torch.cuda.is_available() else "cpu"
+    model, _ = clip.load("ViT-B/32", device=device)
+    model.eval()
+    return model, device
 
+
+def load_clip() -> None:
+    """Load only the CLIP model, e.g. in the inference process."""
+    global _clip_model, _clip_device
+    _clip_model, _clip_device = _timed("clip", _load_clip)
+
+
+def load_index(encoder: Optional["EncoderClient"] = None) -> None:
+    """
+    Load FAISS index, index map, and CLIP model. Call once at startup.
+
+    CLIP loads on a second thread while the index and map are opened.
+    encoder  client for a CLIP inference process (inference.py); CLIP is
+             then not loaded in this process
+    """
+    global _index, _index_map, _encoder, _loaded_stamp
+
+    t0 = time.perf_counter()
+    _loaded_stamp = _index_stamp()
+    with ThreadPoolExecutor(1, thread_name_prefix="clip-load") as pool:
+        clip_future = pool.submit(load_clip) if encoder is None else None
+
+        index, mmapped = _timed("index", _read_index, _INDEX_PATH)
+        index_desc = _timed("configure", _configure_index, index)
+        index_map = _timed("index_map", _read_index_map)
+        with _swap_lock:
+            _index, _index_map = index, index_map
+
+        if clip_future is not None:
+            clip_future.result()
+    _encoder = encoder
+    _load_timings["total"] = time.perf_counter() - t0
+
+    clip_desc = f"CLIP on {_clip_device}" if encoder is None else f"CLIP via {encoder.address}"
     print(f"[retrieval] Loaded FAISS index with {_index.ntotal} vectors "
-          f"(CLIP on {_clip_device})")
+          f"({index_desc}{', mmap' if mmapped else ''}, {clip_desc})")
+    print("[retrieval] Startup " + ", ".join(
+        f"{name} {secs:.2f} s" for name, secs in _load_timings.items()))
+
+
+def reload_index() -> dict:
+    """
+    Re-open faiss.index and index_map.npy, e.g. after build_index.py --append,
+    and swap them in. Searches already running finish on the old pair.
+    """
+    global _index, _index_map, _loaded_stamp
+
+    with _reload_lock:
+        t0 = time.perf_counter()
+        # Taken before reading, so a write racing the reload counts as a change
+        stamp = _index_stamp()
+        index, mmapped = _read_index(_INDEX_PATH)
+        index_desc = _configure_index(index)
+        index_map = _read_index_map()
+        if len(index_map) < index.ntotal:
+            raise RuntimeError(
+                f"index_map has {len(index_map)} rows for {index.ntotal} vectors")
+        with _swap_lock:
+            previous_size = _index.ntotal if _index is not None else 0
+            _index, _index_map = index, index_map
+        _loaded_stamp = stamp
+        elapsed = time.perf_counter() - t0
+
+    print(f"[retrieval] Reloaded FAISS index: {previous_size} -> {index.ntotal} vectors "
+          f"({index_desc}{', mmap' if mmapped else ''}) in {elapsed:.2f} s")
+    return {"previous_size": previous_size, "index_size": index.ntotal, "reload_s": elapsed}
+
+
+def index_changed() -> bool:
+    """True if faiss.index or the index map changed on disk since they were read."""
+    return _index_stamp() != _loaded_stamp
+
+
+def _current() -> tuple:
+    """The (index, index_map) pair, read together."""
+    with _swap_lock:
+        index, index_map = _index, _index_map
+    assert index is not None, "Call load_index() before retrieve()"
+    return index, index_map
+
+
+def load_timings() -> dict:
+    """Seconds spent in each load_index() phase ("total" is wall clock)."""
+    return dict(_load_timings)
 
 
 def index_size() -> int:
     return _index.ntotal if _index is not None else 0
 
 
-def retrieve(prompt: str, k: int = 1) -> int:
+def encode_prompts(prompts: list[str], batch_size: int = 256) -> np.ndarray:
     """
-    CLIP-encode prompt, query FAISS, return blockgen-3d dataset index
-    of the nearest neighbour.
+    CLIP-encode prompts, batch_size at a time; returns L2-normalised
+    float32 [N, D].
+    """
+    if _encoder is not None:
+        with metrics.span("clip_encode"):
+            return _encoder.encode(prompts)
+    import clip
+    import torch
+
+    chunks = []
+    with torch.no_grad(), metrics.span("clip_encode"):
+        for start in range(0, len(prompts), batch_size):
+            tokens = clip.tokenize(prompts[start:start + batch_size], truncate=True).to(_clip_device)
+            embedding = _clip_model.encode_text(tokens).float()
+            embedding = embedding / embedding.norm(dim=-1, keepdim=True)
+            chunks.append(embedding.cpu().numpy().astype("float32"))
+    return np.concatenate(chunks)
+
+
+class NoMatch(LookupError):
+    """Raised by retrieve() when FAISS returns no neighbour for the prompt."""
+
+
+def _nearest(ids: np.ndarray, index_map: np.ndarray) -> Optional[int]:
+    # FAISS pads with -1 when it finds fewer than k, e.g. an IVF search whose
+    # probed lists are empty; -1 must not index the map (its last row)
+    found = ids[ids >= 0]
+    return int(index_map[found[0]]) if len(found) else None
+
+
+def retrieve_batch(prompts: list[str], k: int = 1,
+                   cache: Optional["SemanticCache"] = None) -> list[Optional[int]]:
+    """
+    retrieve() for many prompts at once: one encode_text call and one
+    FAISS search for the whole batch. A prompt with no neighbour gets None.
+
+    cache  optional SemanticCache: prompts whose embedding is close enough
+           to a recent one reuse its dataset index, and only the rest are
+           searched
     """
-    assert _index is not None, "Call load_index() before retrieve()"
+    index, index_map = _current()
+    vecs = encode_prompts(prompts)
+    if cache is None:
+        with metrics.span("faiss_search"):
+            _, I = index.search(vecs, k)
+        return [_nearest(row, index_map) for row in I]
 
-    with torch.no_grad():
-        tokens = clip.tokenize([prompt], truncate=True).to(_clip_device)
-        embedding = _clip_model.encode_text(tokens).float()
-        embedding = embedding / embedding.norm(dim=-1, keepdim=True)
-        vec = embedding.cpu().numpy().astype("float32")
+    results = cache.get_batch(vecs)
+    misses = [i for i, result in enumerate(results) if result is None]
+    if misses:
+        with metrics.span("faiss_search"):
+            _, I = index.search(vecs[misses], k)
+        for i, row in zip(misses, I):
+            results[i] = _nearest(row, index_map)
+            if results[i] is not None:
+                cache.put(vecs[i], results[i])
+    return results
 
-    _, I = _index.search(vec, k)
-    faiss_pos = int(I[0][0])
-    return _index_map[faiss_pos]
+
+def _mmr(cand_vecs: np.ndarray, cand_scores: np.ndarray, k: int, diversity: float) -> list[int]:
+    """
+    Maximal marginal relevance: greedily pick candidates that score well
+    against the query but are unlike those already picked. Returns positions
+    into the candidate arrays.
+    """
+    sims = cand_vecs @ cand_vecs.T
+    redundancy = np.zeros(len(cand_scores), dtype=np.float32)
+    available = np.ones(len(cand_scores), dtype=bool)
+    selected: list[int] = []
+    for _ in range(min(k, len(cand_scores))):
+        mmr = (1.0 - diversity) * cand_scores - diversity * redundancy
+        mmr[~available] = -np.inf
+        best = int(np.argmax(mmr))
+        selected.append(best)
+        available[best] = False
+        redundancy = np.maximum(redundancy, sims[best])
+    return selected
+
+
+def retrieve_topk_batch(
+    prompts: list[str],
+    k: int = 5,
+    diversity: float = 0.0,
+    min_score: Optional[float] = None,
+    fetch_k: Optional[int] = None,
+) -> list[list[tuple[int, float]]]:
+    """
+    Top-k (dataset_idx, cosine score) pairs per prompt, best first, from one
+    CLIP pass and one FAISS search over all prompts.
+
+    diversity  0 = plain nearest neighbours; up to 1 trades relevance for
+               variety by MMR re-ranking of the fetch_k (default 4k) nearest
+    min_score  drop results scoring below this
+    """
+    index, index_map = _current()
+    vecs = encode_prompts(prompts)
+    rerank = diversity > 0 and k > 1
+    search_k = max(fetch_k or 4 * k, k) if rerank else k
+    with metrics.span("faiss_search"):
+        D, I = index.search(vecs, search_k)
+
+    results = []
+    for scores, ids in zip(D, I):
+        valid = ids >= 0
+        scores, ids = scores[valid], ids[valid]
+        if rerank and len(ids) > 1:
+            try:
+                cand_vecs = index.reconstruct_batch(ids)
+            except RuntimeError:
+                # No reconstruction for this index type, keep score order
+                cand_vecs = None
+            if cand_vecs is not None:
+                order = _mmr(cand_vecs, scores, k, diversity)
+                scores, ids = scores[order], ids[order]
+        hits = [(int(index_map[i]), float(s)) for i, s in zip(ids[:k], scores[:k])
+                if min_score is None or s >= min_score]
+        results.append(hits)
+    return results
+
+
+def retrieve_topk(prompt: str, k: int = 5, diversity: float = 0.0,
+                  min_score: Optional[float] = None) -> list[tuple[int, float]]:
+    """Single-prompt retrieve_topk_batch()."""
+    return retrieve_topk_batch([prompt], k, diversity, min_score)[0]
+
+
+def retrieve(prompt: str, k: int = 1, cache: Optional["SemanticCache"] = None) -> int:
+    """
+    CLIP-encode prompt, query FAISS, return blockgen-3d dataset index
+    of the nearest neighbour. Raises NoMatch if there is none.
+    """
+    dataset_idx = retrieve_batch([prompt], k, cache)[0]
+    if dataset_idx is None:
+        raise NoMatch(f"no neighbour in the index for {prompt!r}")
+    return dataset_idx
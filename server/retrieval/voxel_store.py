@@ -0,0 +1,75 @@
+"""
+Random-access, memory-mapped store of blockgen-3d voxel samples.
+
+Built offline by build_voxel_store.py. Colours are stored as uint8
+[N, 3, G, G, G] and occupancy bit-packed as uint8 [N, G*G*G/8], so a sample
+is a pair of array views into the page cache — no network, no decoding and
+no dependence on dataset_idx for latency.
+"""
+
+import json
+from pathlib import Path
+from typing import Optional
+
+import numpy as np
+
+STORE_DIR = Path(__file__).parent / "voxel_store"
+COLORS_FILE = "colors.u8"
+OCCUPANCY_FILE = "occupancy.bits"
+META_FILE = "meta.json"
+
+_colors: Optional[np.memmap] = None
+_occupancy: Optional[np.memmap] = None
+_grid: int = 0
+
+
+def is_available(store_dir: Path = STORE_DIR) -> bool:
+    return (store_dir / META_FILE).exists()
+
+
+def read_meta(store_dir: Path = STORE_DIR) -> dict:
+    with open(store_dir / META_FILE) as f:
+        return json.load(f)
+
+
+def open_store(store_dir: Path = STORE_DIR) -> None:
+    """Memory-map the store. Called lazily by get_sample()."""
+    global _colors, _occupancy, _grid
+
+    meta = read_meta(store_dir)
+    n, grid = meta["count"], meta["grid"]
+    _colors = np.memmap(store_dir / COLORS_FILE, dtype=np.uint8, mode="r",
+                        shape=(n, 3, grid, grid, grid))
+    _occupancy = np.memmap(store_dir / OCCUPANCY_FILE, dtype=np.uint8, mode="r",
+                           shape=(n, grid ** 3 // 8))
+    _grid = grid
+    print(f"[voxel_store] Opened {n} samples ({grid}^3) from {store_dir}")
+
+
+def store_size() -> int:
+    return len(_colors) if _colors is not None else 0
+
+
+def get_sample(dataset_idx: int) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Return (colors, packed_occupancy) for dataset_idx as zero-copy views.
+
+    colors            uint8 [3, G, G, G], 0-255
+    packed_occupancy  uint8 [G*G*G/8], see unpack_occupancy()
+    """
+    if _colors is None:
+        open_store()
+    if not 0 <= dataset_idx < len(_colors):
+        raise IndexError(f"dataset_idx out of range: {dataset_idx}")
+    return _colors[dataset_idx], _occupancy[dataset_idx]
+
+
+def pack_occupancy(occ: np.ndarray) -> np.ndarray:
+    """float/bool occupancy [1, G, G, G] or [G, G, G] -> packed uint8 bits."""
+    return np.packbits(np.asarray(occ).reshape(-1) > 0.5)
+
+
+def unpack_occupancy(packed: np.ndarray, grid: Optional[int] = None) -> np.ndarray:
+    """packed uint8 bits -> bool [G, G, G]."""
+    grid = grid or _grid
+    return np.unpackbits(packed, count=grid ** 3).view(bool).reshape(grid, grid, grid)
@@ -1,13 +1,14 @@
 """
 Convert a blockgen-3d dataset sample to a Minecraft .schem file.
 
-The blockgen-3d dataset is loaded lazily on first use.
+Samples are read from the local voxel store (voxel_store.py) when it has
+been built; otherwise the blockgen-3d dataset is streamed lazily on first use.
 """
 
 import sys
 from pathlib import Path
+from typing import NamedTuple
 
-import mcschematic
 import numpy as np
 from datasets import load_dataset
 
@@ -16,7 +17,14 @@ _SCHEMGEN_DIR = Path(__file__).parent.parent / "schemgen"
 if str(_SCHEMGEN_DIR) not in sys.path:
     sys.path.insert(0, str(_SCHEMGEN_DIR))
 
-from col2block import col2block  # noqa: E402 (needs sys.path patch above)
+import col2block  # noqa: E402 (needs sys.path patch above)
+from dither import DITHER_MODES, dither_index  # noqa: E402
+from sparse import SparseVolume  # noqa: E402
+from sponge import write_schem  # noqa: E402
+
+import metrics  # noqa: E402 (server/metrics.py)
+
+from . import voxel_store
 
 # ---------------------------------------------------------------------------
 # Dataset – loaded lazily on first conversion request
@@ -45,70 +53,179 @@ def _get_sample(dataset_idx: int):
         raise IndexError(f"dataset_idx out of range: {dataset_idx}") from exc
 
 
+def _load_voxels(dataset_idx: int) -> tuple[np.ndarray, np.ndarray, int]:
+    """
+    Occupied voxels of the sample at dataset_idx as (coords int [N, 3] x, y, z;
+    rgb float32 [N, 3] in 0-1;  grid size G). From the local voxel store only
+    the occupied colours are read; otherwise the dataset is streamed and the
+    dense sample gathered.
+    """
+    if dataset_idx < 0:
+        raise ValueError("dataset_idx must be non-negative")
+
+    if voxel_store.is_available():
+        colors_u8, packed = voxel_store.get_sample(dataset_idx)
+        grid = colors_u8.shape[1]
+        flat = np.flatnonzero(voxel_store.unpack_occupancy(packed, grid))
+        coords = np.stack(np.unravel_index(flat, (grid, grid, grid)), axis=1)
+        rgb = colors_u8.reshape(3, -1)[:, flat].T.astype(np.float32)
+        return coords, rgb / 255.0, grid
+
+    sample = _get_sample(dataset_idx)
+    colors = np.array(sample["voxels_colors"], dtype=np.float32)    # [3,32,32,32]
+    occ = np.array(sample["voxels_occupancy"], dtype=np.float32)    # [1,32,32,32]
+    return (*_gather(colors, occ[0] > 0.5), occ.shape[-1])
+
+
 # ---------------------------------------------------------------------------
 # Helpers
 # ---------------------------------------------------------------------------
 
-def _center_voxels(
-    colors: np.ndarray, occ: np.ndarray
-) -> tuple[np.ndarray, np.ndarray]:
+def _gather(colors: np.ndarray, occupied: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
     """
-    Shift the occupied mass to the grid centre (16, 16, 16) using np.roll,
-    matching the centring logic used during training.
+    Coordinates and colours of the occupied voxels of a dense sample.
 
-    colors : float32 [3, 32, 32, 32]
-    occ    : float32 [1, 32, 32, 32]
+    colors    [3, G, G, G], uint8 0-255 or float 0-1
+    occupied  bool [G, G, G]
+    Returns (coords int [N, 3] as x, y, z;  rgb float32 [N, 3] in 0-1).
     """
-    occupied = occ[0] > 0.5
-    coords = np.argwhere(occupied)
-    if len(coords) == 0:
-        return colors, occ
+    coords = np.argwhere(occupied)                                  # [N,3] x,y,z
+    rgb = colors[:, coords[:, 0], coords[:, 1], coords[:, 2]].T.astype(np.float32)
+    if colors.dtype == np.uint8:
+        rgb /= 255.0
+    return coords, rgb
 
-    centroid = coords.mean(axis=0).astype(int)  # (cx, cy, cz)
-    grid_center = np.array([16, 16, 16])
-    shift = grid_center - centroid
 
-    for ax, s in enumerate(shift):
-        colors = np.roll(colors, int(s), axis=ax + 1)
-        occ = np.roll(occ, int(s), axis=ax + 1)
+def _centered_voxels(
+    coords: np.ndarray, rgb: np.ndarray, grid: int
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Shift voxel coordinates so their mass sits at the grid centre
+    (16, 16, 16 for the 32^3 samples), matching the centring used during
+    training. Only the coordinates move; rgb is returned as is.
+
+    The shift is clamped so the bounding box stays inside the grid: voxels
+    never wrap around an edge (np.roll did) and none are dropped.
+    """
+    if len(coords) == 0:
+        return coords, rgb
 
-    return colors, occ
+    centroid = coords.mean(axis=0).astype(int)
+    shift = np.clip(grid // 2 - centroid,
+                    -coords.min(axis=0), grid - 1 - coords.max(axis=0))
+    return coords + shift, rgb
 
 
 # ---------------------------------------------------------------------------
 # Public API
 # ---------------------------------------------------------------------------
 
-def voxel_to_schem(dataset_idx: int, out_path: str) -> None:
+def load_converter() -> None:
+    """
+    Load the conversion state (colour matcher, voxel store) up front, e.g.
+    once per worker process rather than on its first request.
+    """
+    col2block.load()
+    if voxel_store.is_available():
+        voxel_store.open_store()
+
+
+class VoxelBuild(NamedTuple):
+    """
+    In-memory result of converting one sample, cropped to its bounding box.
+
+    palette  block state strings, palette[0] == "minecraft:air"
+    voxels   SparseVolume of the placed blocks (ids index palette), in
+             Sponge BlockData order (index = x + z * width + y * width * length)
+    offset   (x, y, z) of the bounding box corner in the sample grid
+    """
+    width: int
+    height: int
+    length: int
+    palette: list
+    voxels: SparseVolume
+    offset: tuple
+
+    def to_arrays(self) -> dict:
+        """Plain numpy arrays (no object dtypes), e.g. for np.savez."""
+        v = self.voxels
+        return {"shape": np.array([self.width, self.height, self.length]),
+                "offset": np.array(self.offset), "palette": np.array(self.palette),
+                "xs": v.xs, "ys": v.ys, "zs": v.zs, "ids": v.ids}
+
+    @classmethod
+    def from_arrays(cls, arrays) -> "VoxelBuild":
+        """Inverse of to_arrays."""
+        width, height, length = arrays["shape"].tolist()
+        voxels = SparseVolume(width, height, length, arrays["xs"], arrays["ys"],
+                              arrays["zs"], arrays["ids"])
+        return cls(width, height, length, arrays["palette"].tolist(), voxels,
+                   tuple(arrays["offset"].tolist()))
+
+
+def voxel_to_build(dataset_idx: int, dither: str = "none") -> VoxelBuild:
+    """
+    Load the sample at dataset_idx, centre its voxel mass and convert each
+    occupied voxel to a Minecraft block via the batched col2block matcher.
+    dither is one of DITHER_MODES (see schemgen/dither.py).
+    """
+    with metrics.span("load_sample"):
+        voxels = _load_voxels(dataset_idx)
+    with metrics.span("centre"):
+        coords, rgb = _centered_voxels(*voxels)
+    return voxels_to_build(coords, rgb, dither=dither)
+
+
+def voxels_to_build(coords: np.ndarray, rgb: np.ndarray, dither: str = "none") -> VoxelBuild:
+    """
+    Match voxel colours to blocks and lay them out as a VoxelBuild.
+
+    coords  int [N, 3] x, y, z grid positions
+    rgb     float [N, 3] colours in 0-1
+    dither  "none" for plain nearest colour, or "ordered" / "diffusion"
+    """
+    if dither not in DITHER_MODES:
+        raise ValueError(f"unknown dither mode {dither!r}, expected one of {DITHER_MODES}")
+    if len(coords) == 0:
+        return VoxelBuild(0, 0, 0, ["minecraft:air"], SparseVolume.empty(), (0, 0, 0))
+
+    # Match every occupied voxel's colour in one batch (or one batch per
+    # diagonal plane when diffusing error).
+    with metrics.span("match_blocks"):
+        ids = dither_index(coords, rgb, dither)
+
+    # Compact to the block names actually used; 0 is reserved for air.
+    used_ids, inverse = np.unique(ids, return_inverse=True)
+    names, name_inverse = np.unique(col2block.block_names[used_ids], return_inverse=True)
+    palette = ["minecraft:air"] + [f"minecraft:{name}" for name in names]
+    block_ids = (name_inverse[inverse] + 1).astype(np.uint16)
+
+    mins = coords.min(axis=0)
+    width, height, length = (coords.max(axis=0) - mins + 1).tolist()
+    rel = coords - mins
+    voxels = SparseVolume.from_coords(width, height, length,
+                                      rel[:, 0], rel[:, 1], rel[:, 2], block_ids)
+
+    return VoxelBuild(width, height, length, palette, voxels, tuple(mins.tolist()))
+
+
+def save_schem(build: VoxelBuild, out_path: str) -> None:
     """
-    Load the sample at dataset_idx, centre its voxel mass, convert each
-    occupied voxel to a Minecraft block via the existing col2block KDTree
-    matcher, and write a .schem file to out_path.
+    Write a VoxelBuild to a .schem file at out_path.
 
     out_path  full path including .schem extension,
               e.g. "/tmp/gen_abc123/generated.schem"
     """
-    sample = _get_sample(dataset_idx)
+    with metrics.span("schem_save"):
+        out = Path(out_path)
+        out.parent.mkdir(parents=True, exist_ok=True)
+        # The WorldEdit offset keeps the build at its grid position
+        write_schem(out, build.palette, build.voxels.to_dense(), build.offset)
 
-    colors = np.array(sample["voxels_colors"], dtype=np.float32)    # [3,32,32,32]
-    occ = np.array(sample["voxels_occupancy"], dtype=np.float32)    # [1,32,32,32]
 
-    colors, occ = _center_voxels(colors, occ)
-
-    schem = mcschematic.MCSchematic()
-    occupied_mask = occ[0] > 0.5
-
-    for x in range(32):
-        for y in range(32):
-            for z in range(32):
-                if occupied_mask[x, y, z]:
-                    r = float(colors[0, x, y, z])
-                    g = float(colors[1, x, y, z])
-                    b = float(colors[2, x, y, z])
-                    block_name = col2block([r, g, b, 1.0])
-                    schem.setBlock((x, y, z), f"minecraft:{block_name}")
-
-    out = Path(out_path)
-    out.parent.mkdir(parents=True, exist_ok=True)
-    # mcschematic.save(directory, name, version) appends .schem automatically.
-    schem.save(str(out.parent), out.stem, mcschematic.Version.JE_1_21_5)
+def voxel_to_schem(dataset_idx: int, out_path: str) -> None:
+    """
+    Convert the sample at dataset_idx (see voxel_to_build) and write a
+    .schem file to out_path.
+    """
+    save_schem(voxel_to_build(dataset_idx), out_path)
@@ -1,36 +1,67 @@
-import colour
-import numpy as np
-import pickle
+import os
+import threading
 from pathlib import Path
 from typing import Any
 
+import numpy as np
+
+try:
+    from .oklab import srgb_to_oklab
+except ImportError:
+    # Fallback for when running as script
+    from oklab import srgb_to_oklab
+
 root_dir = Path(__file__).parent
 
-# Pickle file paths
-kdtree_path = root_dir / "kdtree.pkl"
-colors_path = root_dir / "colors.pkl"
-col2tex_map_path = root_dir / "col2tex_map.pkl"
+# Matcher artifacts written by preprocess.py, plain .npy (no pickle)
+palette_colors_path = root_dir / "palette_colors.npy"
+palette_names_path = root_dir / "palette_names.npy"
+lut_path = root_dir / "lut.npy"
 
-# Global variables for the loaded data
-tree: Any = None
+# Loaded lazily on first use (or by load()), so importing this module is cheap.
+# colors[i] is the Oklab-Alpha average of palette entry i, block_names[i] its
+# texture/block name, so nearest-neighbour indices map straight to a name.
 colors: Any = None
-col2tex_map: Any = None
+block_names: Any = None
+# quantized sRGB cube -> palette index, see preprocess.build_lut
+lut: Any = None
+# KDTree over `colors` for the exact / translucent path, built on first use
+_tree: Any = None
+_load_lock = threading.Lock()
+
+# The LUT snaps colours to its grid, so it disagrees with the exact match for
+# a few percent of colours (see benchmarks/bench_col2block.py). Opt in with
+# COL2BLOCK_LUT=1 or per call with exact=False.
+USE_LUT = os.environ.get("COL2BLOCK_LUT", "0") == "1"
+
+
+def load(force_preprocess=False):
+    """Load the matcher arrays, running preprocessing if needed or forced"""
+    with _load_lock:
+        _load(force_preprocess)
 
 
-def load_pickle_data(force_preprocess=False):
-    """Load pickle data, running preprocessing if needed or forced"""
-    global tree, colors, col2tex_map
+def _ensure_loaded():
+    if block_names is None:
+        with _load_lock:
+            if block_names is None:
+                _load()
+
+
+def _load(force_preprocess=False):
+    global colors, block_names, lut, _tree
 
-    # Check if pickle files exist
     files_exist = (
-        kdtree_path.exists() and colors_path.exists() and col2tex_map_path.exists()
+        palette_colors_path.exists()
+        and palette_names_path.exists()
+        and lut_path.exists()
     )
 
     if force_preprocess or not files_exist:
         if force_preprocess:
-            print("Force preprocessing enabled, regenerating pickle files...")
+            print("Force preprocessing enabled, regenerating matcher files...")
         else:
-            print("Pickle files not found, running preprocessing...")
+            print("Matcher files not found, running preprocessing...")
 
         # Import and run preprocessing
         try:
@@ -40,30 +71,88 @@ def load_pickle_data(force_preprocess=False):
             import preprocess
         preprocess.preprocess()
 
-    # Load the pickle files
-    with open(kdtree_path, "rb") as f:
-        tree = pickle.load(f)
+    _tree = None
+    colors = np.load(palette_colors_path)
+    # Memory-mapped so the 256^3 variant doesn't cost startup time or RSS
+    lut = np.load(lut_path, mmap_mode="r")
+    # Assigned last: _ensure_loaded() treats it as the "loaded" flag
+    block_names = np.load(palette_names_path)
 
-    with open(colors_path, "rb") as f:
-        colors = pickle.load(f)
 
-    with open(col2tex_map_path, "rb") as f:
-        col2tex_map = pickle.load(f)
+def get_tree():
+    """KDTree over the palette colours, built on first use"""
+    global _tree
+    _ensure_loaded()
+    if _tree is None:
+        from sklearn.neighbors import KDTree
 
-
-# Load data on module import
-load_pickle_data()
+        _tree = KDTree(colors)
+    return _tree
 
 
 def col2block(color) -> str:
     """
     takes a normalised RGBA color and returns the closest matching block name
     """
-    oklab_value = colour.convert(np.array(color[:3]), "sRGB", "Oklab")
+    oklab_value = srgb_to_oklab(np.array(color[:3]))
     oklab_value = np.array(
         [oklab_value[0], oklab_value[1], oklab_value[2], color[3]], dtype=np.float32
     )
 
-    dist, ind = tree.query([oklab_value])
+    dist, ind = get_tree().query([oklab_value])
+
+    return block_names[ind[0, 0]]
+
+
+def _to_query(colors_rgba) -> np.ndarray:
+    """
+    converts an (N, 4) array of normalised RGBA colors into the (N, 4)
+    Oklab-Alpha points the KDTree was built on, in one vectorized pass
+    """
+    colors_rgba = np.asarray(colors_rgba, dtype=np.float64).reshape(-1, 4)
+    query = np.empty(colors_rgba.shape, dtype=np.float32)
+    if len(colors_rgba):
+        query[:, :3] = srgb_to_oklab(colors_rgba[:, :3])
+    query[:, 3] = colors_rgba[:, 3]
+    return query
+
+
+def _lut_lookup(colors_rgb) -> np.ndarray:
+    """
+    quantizes an (N, 3) array of normalised sRGB colors onto the LUT grid
+    and returns the precomputed palette ids
+    """
+    size = lut.shape[0]
+    cells = np.clip((colors_rgb * size).astype(np.intp), 0, size - 1)
+    return np.asarray(lut[cells[:, 0], cells[:, 1], cells[:, 2]], dtype=np.intp)
+
+
+def col2index(colors_rgba, exact=None) -> np.ndarray:
+    """
+    takes an (N, 4) array of normalised RGBA colors and returns an (N,) int
+    array of palette ids, i.e. indices into `block_names`
+
+    exact=False sends fully opaque input through the lookup table, anything
+    else goes to the KDTree. exact=None (default) is exact unless USE_LUT
+    """
+    _ensure_loaded()
+    if exact is None:
+        exact = not USE_LUT
+    colors_rgba = np.asarray(colors_rgba, dtype=np.float32).reshape(-1, 4)
+    if not exact and lut is not None and np.all(colors_rgba[:, 3] == 1.0):
+        return _lut_lookup(colors_rgba[:, :3])
+
+    query = _to_query(colors_rgba)
+    if len(query) == 0:
+        return np.empty(0, dtype=np.intp)
+    _, ind = get_tree().query(query)
+    return ind[:, 0]
 
-    return col2tex_map[tuple(*colors[ind][0])]
+
+def col2blocks(colors_rgba, exact=None) -> np.ndarray:
+    """
+    batch version of col2block: takes an (N, 4) array of normalised RGBA
+    colors and returns an (N,) array of the closest matching block names
+    """
+    ids = col2index(colors_rgba, exact)
+    return block_names[ids]
@@ -0,0 +1,170 @@
+"""
+Optional dithering for the voxel -> block colour match.
+
+Plain nearest-colour matching flattens smooth gradients into bands of one
+block. Both modes here trade that banding for a mix of neighbouring blocks:
+
+  ordered    a 4x4x4 Bayer threshold added to each voxel's colour before the
+             lookup; one vectorized pass, no state between voxels
+  diffusion  Floyd-Steinberg style error diffusion in 3D. Each voxel's
+             quantization error is pushed to its forward neighbours
+             (+x, +y, +z and the three forward edge diagonals), so all voxels
+             on one diagonal plane x + y + z = s are independent and are
+             matched together; a 32^3 grid takes 94 vectorized passes
+
+Colours and errors are in sRGB 0-1, the space the col2block lookup table is
+indexed by; both modes always match through that table, while "none"
+follows col2block's default (exact unless COL2BLOCK_LUT=1). Latency budget
+(see benchmarks/bench_dither.py), on top of the nearest-colour match
+through the table, for a fully occupied grid on one core:
+
+  32^3   ordered < 5 ms    diffusion < 50 ms
+  64^3   ordered < 40 ms   diffusion < 400 ms
+
+Real samples occupy a fraction of the grid and are proportionally faster.
+"""
+
+from typing import Any
+
+import numpy as np
+
+try:
+    from . import col2block
+    from .oklab import oklab_to_srgb
+except ImportError:
+    # Fallback for when running as script
+    import col2block
+    from oklab import oklab_to_srgb
+
+DITHER_MODES = ("none", "ordered", "diffusion")
+
+# Peak-to-peak amplitude of the ordered threshold in sRGB units, a few
+# times the typical distance between neighbouring palette colours
+ORDERED_STRENGTH = 0.12
+
+# 2x2x2 base pattern: consecutive thresholds sit on opposite corners
+_BAYER_BASE = np.array([
+    [[0, 3], [6, 5]],
+    [[4, 7], [2, 1]],
+])
+
+# Forward neighbour offsets (dx, dy, dz) and their share of the error
+_DIFFUSION_KERNEL = (
+    ((1, 0, 0), 2 / 9), ((0, 1, 0), 2 / 9), ((0, 0, 1), 2 / 9),
+    ((1, 1, 0), 1 / 9), ((1, 0, 1), 1 / 9), ((0, 1, 1), 1 / 9),
+)
+
+# sRGB colour of each palette entry, derived from col2block.colors on first use
+_palette_rgb: Any = None
+
+
+def bayer_matrix(levels=2) -> np.ndarray:
+    """(2^levels)^3 Bayer threshold matrix holding each of 0 .. 8^levels - 1 once"""
+    matrix = np.zeros((1, 1, 1), dtype=np.intp)
+    for _ in range(levels):
+        n = matrix.shape[0]
+        matrix = 8 * np.tile(matrix, (2, 2, 2)) + np.repeat(
+            np.repeat(np.repeat(_BAYER_BASE, n, axis=0), n, axis=1), n, axis=2)
+    return matrix
+
+
+_BAYER = bayer_matrix()
+# Centred thresholds in -0.5 .. 0.5
+_THRESHOLDS = ((_BAYER + 0.5) / _BAYER.size - 0.5).astype(np.float32)
+
+
+def palette_rgb() -> np.ndarray:
+    """(P, 3) sRGB 0-1 colours of the palette entries, clipped to the gamut"""
+    global _palette_rgb
+    col2block._ensure_loaded()
+    if _palette_rgb is None:
+        _palette_rgb = np.clip(oklab_to_srgb(col2block.colors[:, :3]), 0, 1).astype(np.float32)
+    return _palette_rgb
+
+
+def _match(rgb, exact=None) -> np.ndarray:
+    rgba = np.ones((len(rgb), 4), dtype=np.float32)
+    rgba[:, :3] = rgb
+    return col2block.col2index(rgba, exact=exact)
+
+
+def ordered(coords, rgb, strength=ORDERED_STRENGTH) -> np.ndarray:
+    """
+    Palette ids for voxels at coords (int [N, 3] x, y, z) with colours
+    rgb (float [N, 3] 0-1), after adding the tiled Bayer threshold
+    """
+    size = _THRESHOLDS.shape[0]
+    cells = np.asarray(coords) % size
+    offset = _THRESHOLDS[cells[:, 0], cells[:, 1], cells[:, 2]]
+    # Dithering is opt-in and already perturbs colours by more than a LUT
+    # cell, so it always takes the fast path
+    return _match(np.clip(rgb + strength * offset[:, None], 0, 1), exact=False)
+
+
+def diffusion(coords, rgb) -> np.ndarray:
+    """
+    Palette ids for voxels at coords (int [N, 3] x, y, z) with colours
+    rgb (float [N, 3] 0-1), diffusing each voxel's error to its forward
+    neighbours. Error sent to empty cells is dropped.
+    """
+    coords = np.asarray(coords)
+    ids = np.empty(len(coords), dtype=np.intp)
+    if len(coords) == 0:
+        return ids
+
+    # Work in plane order (x + y + z), so each plane is a contiguous slice
+    rel = (coords - coords.min(axis=0)).astype(np.int64)
+    plane = rel.sum(axis=1)
+    order = np.argsort(plane, kind="stable")
+    rel, rgb = rel[order], np.asarray(rgb, dtype=np.float32)[order]
+    bounds = np.searchsorted(plane[order], np.arange(plane.max() + 2)).tolist()
+
+    # Neighbours are looked up among the occupied voxels by linear index, so
+    # the error buffer is [N + 1, 3] rather than the size of the bounding
+    # box; error for empty cells goes to the spare last row and is dropped
+    dims = rel.max(axis=0) + 2
+    linear = (rel[:, 0] * dims[1] + rel[:, 1]) * dims[2] + rel[:, 2]
+    by_linear = np.argsort(linear)
+    sorted_linear = linear[by_linear]
+    neighbours = []
+    for (dx, dy, dz), weight in _DIFFUSION_KERNEL:
+        # Sorted needles, so searchsorted walks the haystack once
+        target = sorted_linear + (dx * dims[1] + dy) * dims[2] + dz
+        pos = np.minimum(np.searchsorted(sorted_linear, target), len(linear) - 1)
+        nbr = np.empty(len(linear), dtype=np.intp)
+        nbr[by_linear] = np.where(sorted_linear[pos] == target, by_linear[pos], len(linear))
+        neighbours.append((nbr, np.float32(weight)))
+
+    error = np.zeros((len(coords) + 1, 3), dtype=np.float32)
+    palette = palette_rgb()
+    plane_ids = np.empty(len(coords), dtype=np.intp)
+
+    for start, stop in zip(bounds, bounds[1:]):
+        if start == stop:
+            continue
+        target = np.clip(rgb[start:stop] + error[start:stop], 0, 1)
+        # Fast path, as in ordered(); the LUT's error is diffused onward too
+        match = _match(target, exact=False)
+        plane_ids[start:stop] = match
+        residual = target - palette[match]
+        # Within a plane each voxel has its own neighbour per offset, so the
+        # fancy-indexed += only ever combines writes to the spare row
+        for nbr, weight in neighbours:
+            error[nbr[start:stop]] += weight * residual
+
+    ids[order] = plane_ids
+    return ids
+
+
+def dither_index(coords, rgb, mode="none") -> np.ndarray:
+    """
+    Palette ids (indices into col2block.block_names) for opaque voxels,
+    matched with one of DITHER_MODES
+    """
+    if mode == "ordered":
+        return ordered(coords, rgb)
+    if mode == "diffusion":
+        return diffusion(coords, rgb)
+    if mode == "none":
+        return _match(rgb)
+    raise ValueError(f"unknown dither mode {mode!r}, expected one of {DITHER_MODES}")
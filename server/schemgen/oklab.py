@@ -0,0 +1,58 @@
+"""
+Vectorized sRGB <-> Oklab conversion in plain NumPy.
+
+Same result as colour.convert(rgb, "sRGB", "Oklab") (which goes through
+CIE XYZ), without its per-call conversion-graph overhead. Inputs are
+(..., 3) arrays of floats in 0-1 (sRGB) or Oklab L, a, b.
+"""
+
+import numpy as np
+
+# CIE XYZ (D65) <-> Oklab matrices from the Oklab definition, and sRGB's
+# linear RGB <-> XYZ matrices, as used by colour-science
+_XYZ_TO_LMS = np.array([
+    [0.8189330101, 0.3618667424, -0.1288597137],
+    [0.0329845436, 0.9293118715, 0.0361456387],
+    [0.0482003018, 0.2643662691, 0.6338517070],
+])
+_LMS_TO_LAB = np.array([
+    [0.2104542553, 0.7936177850, -0.0040720468],
+    [1.9779984951, -2.4285922050, 0.4505937099],
+    [0.0259040371, 0.7827717662, -0.8086757660],
+])
+_RGB_TO_XYZ = np.array([
+    [0.4124, 0.3576, 0.1805],
+    [0.2126, 0.7152, 0.0722],
+    [0.0193, 0.1192, 0.9505],
+])
+# IEC 61966-2-1 rounds the inverse separately, so it is not exactly inv()
+_XYZ_TO_RGB = np.array([
+    [3.2406, -1.5372, -0.4986],
+    [-0.9689, 1.8758, 0.0415],
+    [0.0557, -0.2040, 1.0570],
+])
+
+_RGB_TO_LMS = _XYZ_TO_LMS @ _RGB_TO_XYZ
+_LMS_TO_RGB = _XYZ_TO_RGB @ np.linalg.inv(_XYZ_TO_LMS)
+_LAB_TO_LMS = np.linalg.inv(_LMS_TO_LAB)
+
+
+def _decode_srgb(v: np.ndarray) -> np.ndarray:
+    return np.where(v <= 0.04045, v / 12.92, ((v + 0.055) / 1.055) ** 2.4)
+
+
+def _encode_srgb(v: np.ndarray) -> np.ndarray:
+    return np.where(v <= 0.0031308, v * 12.92,
+                    1.055 * np.abs(v) ** (1 / 2.4) * np.sign(v) - 0.055)
+
+
+def srgb_to_oklab(rgb) -> np.ndarray:
+    """(..., 3) sRGB in 0-1 -> (..., 3) Oklab, float64."""
+    linear = _decode_srgb(np.asarray(rgb, dtype=np.float64))
+    return np.cbrt(linear @ _RGB_TO_LMS.T) @ _LMS_TO_LAB.T
+
+
+def oklab_to_srgb(lab) -> np.ndarray:
+    """(..., 3) Oklab -> (..., 3) sRGB (not clipped), float64."""
+    lms = (np.asarray(lab, dtype=np.float64) @ _LAB_TO_LMS.T) ** 3
+    return _encode_srgb(lms @ _LMS_TO_RGB.T)
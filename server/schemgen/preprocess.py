@@ -1,21 +1,157 @@
-import colour
 import numpy as np
 from PIL import Image
 import os
 from sklearn.neighbors import KDTree
+import hashlib
 import json
 from pathlib import Path
-import pickle
+import time
 import zipfile
+from concurrent.futures import ProcessPoolExecutor
 from io import BytesIO
 
+try:
+    from .oklab import srgb_to_oklab
+except ImportError:
+    # Fallback for when running as script
+    from oklab import srgb_to_oklab
+
 # 1. Get the directory where THIS script is located
 root_dir = Path(__file__).parent
 
-def preprocess():
-    """Run preprocessing to generate pickle files from zip data"""
+# Bits per sRGB channel in the colour -> palette lookup table.
+# 6 bits gives a 64^3 cube (512 KiB), 8 bits the full 256^3 cube (32 MiB).
+LUT_BITS = 6
+
+# Per-texture average colours keyed by PNG content hash, plus the key of the
+# palette the current lut.npy was built from, so reruns only redo what changed
+CACHE_PATH = root_dir / "texture_cache.json"
+# Bump when the averaging changes, to invalidate old cache entries
+CACHE_VERSION = 1
+
+
+def build_lut(tree, lut_bits=LUT_BITS, chunk_size=1 << 18):
+    """
+    Precompute the nearest palette index for the centre of every cell of a
+    quantized sRGB cube (opaque colors only), so col2block can replace the
+    KDTree query with a single array index.
+    """
+    size = 1 << lut_bits
+    lut = np.empty(size ** 3, dtype=np.uint16)
+    centres = (np.arange(size, dtype=np.float64) + 0.5) / size
+
+    # Walk the cube in flat C order, chunked to keep the Oklab buffers small
+    for start in range(0, size ** 3, chunk_size):
+        flat = np.arange(start, min(start + chunk_size, size ** 3))
+        rgb = np.stack(
+            [centres[flat // (size * size)], centres[(flat // size) % size], centres[flat % size]],
+            axis=1,
+        )
+        query = np.ones((len(flat), 4), dtype=np.float32)
+        query[:, :3] = srgb_to_oklab(rgb)
+        _, ind = tree.query(query)
+        lut[flat] = ind[:, 0]
+
+    return lut.reshape(size, size, size)
+
+
+def average_texture(png_bytes):
+    """
+    Average Oklab-Alpha colour [L, a, b, alpha] of one PNG texture.
+    Runs in the preprocessing worker processes.
+    """
+    with Image.open(BytesIO(png_bytes)) as img:
+        # Convert image to RGBA to ensure alpha channel is present
+        pixels = np.asarray(img.convert("RGBA"))
+
+    # All pixels to Oklab in one vectorized pass, alpha normalised to [0, 1]
+    oklab_pixels = srgb_to_oklab(pixels[:, :, :3].reshape(-1, 3) / 255.0)
+    alpha = pixels[:, :, 3].reshape(-1).astype(np.float32) / 255.0
+
+    return oklab_pixels.mean(axis=0).tolist() + [float(alpha.mean(dtype=np.float64))]
+
+
+def _safe_average(item):
+    name, png_bytes = item
+    try:
+        return average_texture(png_bytes), None
+    except Exception as e:
+        return None, f"Could not process {name}: {e}"
+
+
+def _read_cache():
+    try:
+        with open(CACHE_PATH) as f:
+            cache = json.load(f)
+        if cache.get("version") == CACHE_VERSION:
+            return cache
+    except (OSError, ValueError):
+        pass
+    return {"version": CACHE_VERSION, "textures": {}, "lut": None}
+
+
+def _write_cache(cache):
+    tmp = CACHE_PATH.with_suffix(".tmp")
+    with open(tmp, "w") as f:
+        json.dump(cache, f)
+    tmp.replace(CACHE_PATH)
+
+
+def average_textures(texture_zip_path, names, cache, workers=None):
+    """
+    Average colour of every texture in `names` (texture file stems), decoding
+    only PNGs whose content hash is not in the cache, across `workers`
+    processes. Returns {name: [L, a, b, alpha]} in zip order.
+    """
+    workers = workers or os.cpu_count() or 1
+    cached = cache["textures"]
+
+    keys, todo = {}, []
+    with zipfile.ZipFile(texture_zip_path, 'r') as zip_file:
+        for filename in zip_file.namelist():
+            name = os.path.splitext(os.path.basename(filename))[0]
+            if not filename.endswith(".png") or name not in names:
+                continue
+            data = zip_file.read(filename)
+            keys[name] = hashlib.sha1(data).hexdigest()
+            if keys[name] not in cached:
+                todo.append((name, data))
+
+    print(f"  {len(keys)} textures, {len(keys) - len(todo)} cached, "
+          f"{len(todo)} to decode on {workers} worker(s)")
+
+    t0 = time.perf_counter()
+    if todo:
+        step = max(len(todo) // 10, 1)
+        if workers > 1 and len(todo) > 1:
+            pool = ProcessPoolExecutor(workers)
+            results = pool.map(_safe_average, todo, chunksize=16)
+        else:
+            pool = None
+            results = map(_safe_average, todo)
+        try:
+            for done, ((name, _), (avg, error)) in enumerate(zip(todo, results), 1):
+                if error is not None:
+                    print(error)
+                    keys.pop(name)
+                else:
+                    cached[keys[name]] = avg
+                if done % step == 0 or done == len(todo):
+                    print(f"  decoded {done}/{len(todo)} ({time.perf_counter() - t0:.1f} s)")
+        finally:
+            if pool is not None:
+                pool.shutdown()
+
+    # Drop entries for textures that no longer exist
+    cache["textures"] = {key: cached[key] for key in keys.values()}
+    return {name: cached[key] for name, key in keys.items()}
+
+
+def preprocess(lut_bits=LUT_BITS, workers=None):
+    """Run preprocessing to generate the col2block matcher files from zip data"""
     print("Running preprocessing...")
-    
+    t_start = time.perf_counter()
+
     model_zip_path = root_dir / "model.zip"
     texture_zip_path = root_dir / "texture.zip"
 
@@ -30,113 +166,42 @@ def preprocess():
                         model_data[os.path.splitext(os.path.basename(filename))[0]] = json.load(f)
                 except Exception as e:
                     print(f"Error loading model file {filename}: {e}")
-
-    average_oklab_colors = {}
-    block_texture_colors = {}  # New dictionary to store both Oklab-Alpha and RGBA
-
-    # Load texture files from zip
-    with zipfile.ZipFile(texture_zip_path, 'r') as zip_file:
-        for filename in zip_file.namelist():
-            if filename.endswith(".png"):
-                try:
-                    # Read image data from zip into memory
-                    with zip_file.open(filename) as f:
-                        img_data = BytesIO(f.read())
-                    
-                    with Image.open(img_data) as img:
-                        # Convert image to RGBA to ensure alpha channel is present
-                        if img.mode != "RGBA":
-                            img = img.convert("RGBA")
-
-                        pixels = np.array(img)
-
-                        # Separate RGB and Alpha channels
-                        rgb_pixels = pixels[:, :, :3]
-                        alpha_channel = pixels[:, :, 3]
-
-                        # Normalize RGB to [0, 1] for Oklab conversion
-                        rgb_pixels_normalized = rgb_pixels / 255.0
-
-                        # Convert all RGB pixels to Oklab
-                        # Reshape for colour.convert, then reshape back
-                        oklab_pixels_reshaped = colour.convert(
-                            rgb_pixels_normalized.reshape(-1, 3), "sRGB", "Oklab"
-                        )
-                        oklab_pixels = oklab_pixels_reshaped.reshape(
-                            rgb_pixels_normalized.shape
-                        )  # Shape (height, width, 3)
-
-                        # Normalize alpha to [0, 1]
-                        alpha_normalized = (
-                            alpha_channel.astype(np.float32) / 255.0
-                        )  # Ensure float32 for consistency
-
-                        # Combine Oklab channels with alpha channel
-                        # Expand alpha_normalized to (height, width, 1) for concatenation
-                        oklab_alpha_combined = np.concatenate(
-                            (oklab_pixels, np.expand_dims(alpha_normalized, axis=2)), axis=2
-                        )
-
-                        # Calculate average Oklab-Alpha color for all pixels
-                        avg_oklab_alpha = oklab_alpha_combined.mean(axis=(0, 1))
-
-                        # Extract Oklab (L, a, b) and Alpha components
-                        oklab_l, oklab_a, oklab_b = avg_oklab_alpha[:3]
-                        alpha_component = avg_oklab_alpha[3]
-
-                        # Convert Oklab (L, a, b) to sRGB
-                        srgb_value = colour.convert(
-                            np.array([oklab_l, oklab_a, oklab_b]), "Oklab", "sRGB"
-                        )
-
-                        # Clip sRGB values to [0, 1] range
-                        srgb_value = np.clip(srgb_value, 0, 1)
-
-                        # Combine sRGB with alpha to form RGBA
-                        rgba_value = np.array(
-                            [srgb_value[0], srgb_value[1], srgb_value[2], alpha_component],
-                            dtype=np.float32,
-                        )
-
-                        # Store in dictionary (filename without extension)
-                        name_without_extension = os.path.splitext(os.path.basename(filename))[0]
-                        average_oklab_colors[name_without_extension] = avg_oklab_alpha.tolist()
-
-                        # Store both Oklab-Alpha and RGBA in block_texture_colors
-                        block_texture_colors[name_without_extension] = {
-                            "oklab_alpha": avg_oklab_alpha.tolist(),
-                            "rgba": rgba_value.tolist(),
-                        }
-
-                except Exception as e:
-                    print(f"Could not process {filename}: {e}")
+    print(f"  {len(model_data)} models ({time.perf_counter() - t_start:.1f} s)")
 
     def filter(k):
         model = model_data.get(k, None)
         return model != None and model.get("parent") == "minecraft:block/cube_all"
 
-    filtered_colors = {k: v for k, v in average_oklab_colors.items() if filter(k)}
-
-    col2tex_map = {}
-    for k, v in filtered_colors.items():
-        model = model_data.get(k, None)
-        col2tex_map[tuple(v)] = k
+    # Only full-cube blocks end up in the palette, so only their textures
+    # are decoded
+    wanted = {k for k in model_data if filter(k)}
+    cache = _read_cache()
+    t0 = time.perf_counter()
+    filtered_colors = average_textures(texture_zip_path, wanted, cache, workers)
+    print(f"  texture averages in {time.perf_counter() - t0:.1f} s")
 
+    # Palette as two parallel arrays: Oklab-Alpha colours and block names.
+    # Plain .npy, so col2block loads them without unpickling anything.
     colors = np.array(list(filtered_colors.values()))
-    tree = KDTree(colors)
+    names = np.array(list(filtered_colors.keys()))
 
-    # Save the tree, colors, and col2tex_map to pickle files
-    with open(root_dir / "kdtree.pkl", "wb") as f:
-        pickle.dump(tree, f)
+    # Dense lookup table, loaded memory-mapped by col2block. Only rebuilt
+    # when the palette (or its resolution) changed.
+    lut_key = {"bits": lut_bits, "palette": hashlib.sha1(colors.tobytes()).hexdigest()}
+    if cache.get("lut") == lut_key and (root_dir / "lut.npy").exists():
+        print("  lookup table unchanged")
+    else:
+        t0 = time.perf_counter()
+        np.save(root_dir / "lut.npy", build_lut(KDTree(colors), lut_bits))
+        print(f"  {1 << lut_bits}^3 lookup table in {time.perf_counter() - t0:.1f} s")
 
-    with open(root_dir / "colors.pkl", "wb") as f:
-        pickle.dump(colors, f)
+    np.save(root_dir / "palette_colors.npy", colors)
+    np.save(root_dir / "palette_names.npy", names)
+    cache["lut"] = lut_key
+    _write_cache(cache)
 
-    with open(root_dir / "col2tex_map.pkl", "wb") as f:
-        pickle.dump(col2tex_map, f)
-    
-    print("Preprocessing complete! Pickle files saved.")
+    print(f"Preprocessing complete! Matcher files saved ({time.perf_counter() - t_start:.1f} s).")
 
 
 if __name__ == "__main__":
-    preprocess()
\ No newline at end of file
+    preprocess()
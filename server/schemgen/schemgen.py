@@ -1,23 +1,44 @@
-from col2block import col2block
-import mcschematic
+import os
 
+from col2block import col2blocks
+import numpy as np
+from sponge import DATA_VERSION, write_schem
 
-def make_schem(arr,path, name,version=mcschematic.Version.JE_1_21_5):
+
+def make_schem(arr,path, name,version=DATA_VERSION, skip_transparent=False):
     """
     takes a (width, height, length, 4) array of normalised RGBA colors
-    and creates a .schem file at the given path with the given name
+    and creates a .schem file at the given path with the given name.
+    version is the Minecraft data version, an int or an mcschematic.Version
+    member (e.g. mcschematic.Version.JE_1_21_5, the default)
+
+    skip_transparent=True leaves fully transparent voxels (alpha 0) as air
+    instead of matching them, and crops the schematic to the rest, with
+    their corner as the WorldEdit offset
 
     Note: we're using the latest game version possible in the entire data pipeline
     don't expect earlier versions to work properly. if you want to use an earlier version,
     provide the resource files for that version and rerun preprocess
     (or go write some new filtering logic ig)
     """
-    schem = mcschematic.MCSchematic()
-    for x in range(arr.shape[0]):
-        for y in range(arr.shape[1]):
-            for z in range(arr.shape[2]):
-                color = arr[x, y, z]
-                block_name = col2block(color)
-                schem.setBlock((x, y, z), f"minecraft:{block_name}")
-    # feels like just pushing the responsibility somewhere else but it is what it is
-    schem.save(path,name,version)
+    # mcschematic.Version members carry the data version as their value
+    data_version = int(getattr(version, "value", version))
+    if skip_transparent:
+        coords = np.argwhere(arr[..., 3] > 0)
+    else:
+        coords = np.argwhere(np.ones(arr.shape[:3], dtype=bool))
+
+    # match the voxels in one batch; palette id 0 is air, the rest are the
+    # block names used
+    block_names = col2blocks(arr[coords[:, 0], coords[:, 1], coords[:, 2]])
+    names, ids = np.unique(block_names, return_inverse=True)
+    palette = ["minecraft:air"] + [f"minecraft:{name}" for name in names]
+
+    mins = coords.min(axis=0) if len(coords) else np.zeros(3, dtype=int)
+    extent = coords.max(axis=0) - mins + 1 if len(coords) else np.zeros(3, dtype=int)
+    rel = coords - mins
+    # Sponge volumes are [height, length, width]
+    volume = np.zeros((extent[1], extent[2], extent[0]), dtype=np.uint16)
+    volume[rel[:, 1], rel[:, 2], rel[:, 0]] = ids.reshape(-1) + 1
+    write_schem(os.path.join(path, f"{name}.schem"), palette, volume,
+                tuple(mins.tolist()), data_version=data_version)
@@ -0,0 +1,86 @@
+"""
+Sparse voxel volumes: only the occupied cells, as coordinate lists (COO).
+
+Builds are mostly air, so the conversion pipeline carries blocks as
+parallel x / y / z / palette id arrays instead of a dense volume; work and
+memory scale with the number of blocks rather than width * height * length.
+Cells are kept in Sponge BlockData order (y, then z, then x), so iterating
+them is already bottom-to-top and a layer is a contiguous slice.
+"""
+
+from typing import Iterator, NamedTuple
+
+import numpy as np
+
+# Coordinates and palette ids are stored compactly and widened on use
+COORD_DTYPE = np.int16
+ID_DTYPE = np.uint16
+
+
+class SparseVolume(NamedTuple):
+    """
+    width, height, length  extent of the volume
+    xs, ys, zs             int16 [N] cell coordinates, in BlockData order
+    ids                    uint16 [N] palette ids, never 0 (air)
+    """
+    width: int
+    height: int
+    length: int
+    xs: np.ndarray
+    ys: np.ndarray
+    zs: np.ndarray
+    ids: np.ndarray
+
+    @classmethod
+    def empty(cls, width=0, height=0, length=0) -> "SparseVolume":
+        none = np.zeros(0, dtype=COORD_DTYPE)
+        return cls(width, height, length, none, none, none, np.zeros(0, dtype=ID_DTYPE))
+
+    @classmethod
+    def from_coords(cls, width: int, height: int, length: int,
+                    xs, ys, zs, ids) -> "SparseVolume":
+        """Cells in any order (one per position); sorted into BlockData order."""
+        xs, ys, zs = (np.asarray(a, dtype=COORD_DTYPE) for a in (xs, ys, zs))
+        order = np.argsort(_linear(xs, ys, zs, width, length), kind="stable")
+        return cls(width, height, length, xs[order], ys[order], zs[order],
+                   np.asarray(ids, dtype=ID_DTYPE)[order])
+
+    @classmethod
+    def from_dense(cls, volume: np.ndarray) -> "SparseVolume":
+        """[height, length, width] palette id volume, 0 = air."""
+        height, length, width = volume.shape
+        # nonzero walks the [y, z, x] volume in C order, i.e. BlockData order
+        ys, zs, xs = np.nonzero(volume)
+        return cls(width, height, length, xs.astype(COORD_DTYPE), ys.astype(COORD_DTYPE),
+                   zs.astype(COORD_DTYPE), volume[ys, zs, xs].astype(ID_DTYPE))
+
+    @property
+    def count(self) -> int:
+        return len(self.ids)
+
+    def to_dense(self, dtype=ID_DTYPE) -> np.ndarray:
+        """[height, length, width] palette id volume, 0 = air."""
+        volume = np.zeros((self.height, self.length, self.width), dtype=dtype)
+        volume[self.ys, self.zs, self.xs] = self.ids
+        return volume
+
+    def linear_index(self) -> np.ndarray:
+        """BlockData index (x + z * width + y * width * length) of every cell."""
+        return _linear(self.xs, self.ys, self.zs, self.width, self.length)
+
+    def select(self, mask: np.ndarray) -> "SparseVolume":
+        """The cells where the boolean mask [N] is True, order kept."""
+        return self._replace(xs=self.xs[mask], ys=self.ys[mask], zs=self.zs[mask],
+                             ids=self.ids[mask])
+
+    def layers(self) -> Iterator[tuple[int, slice]]:
+        """(y, slice into the cell arrays) for every non-empty layer, bottom-up."""
+        ys = np.unique(self.ys)
+        bounds = np.searchsorted(self.ys, ys).tolist() + [self.count]
+        for y, start, stop in zip(ys.tolist(), bounds, bounds[1:]):
+            yield y, slice(start, stop)
+
+
+def _linear(xs, ys, zs, width: int, length: int) -> np.ndarray:
+    return (xs.astype(np.int64) + zs.astype(np.int64) * width
+            + ys.astype(np.int64) * (width * length))
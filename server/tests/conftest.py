@@ -0,0 +1,11 @@
+"""Run from the server directory: python -m pytest tests"""
+
+import sys
+from pathlib import Path
+
+SERVER_DIR = Path(__file__).parent.parent
+
+# Same import layout as main.py: server/ modules and schemgen/ top-level
+for path in (SERVER_DIR, SERVER_DIR / "schemgen"):
+    if str(path) not in sys.path:
+        sys.path.insert(0, str(path))
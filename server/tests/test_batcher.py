@@ -0,0 +1,99 @@
+import threading
+
+import pytest
+
+from retrieval.batcher import RetrievalBatcher
+
+TIMEOUT_S = 5
+
+
+class _Gate:
+    """batch_fn that blocks until released and records every batch."""
+
+    def __init__(self):
+        self.release = threading.Event()
+        self.started = threading.Event()
+        self.batches = []
+
+    def __call__(self, prompts):
+        self.batches.append(list(prompts))
+        self.started.set()
+        assert self.release.wait(TIMEOUT_S)
+        return [len(p) for p in prompts]
+
+
+def test_batches_concurrent_prompts():
+    gate = _Gate()
+    batcher = RetrievalBatcher(batch_fn=gate, max_batch=8, window_s=0.05)
+    gate.release.set()
+    futures = [batcher.submit("x" * i) for i in range(1, 5)]
+    assert [f.result(TIMEOUT_S) for f in futures] == [1, 2, 3, 4]
+    batcher.close()
+
+
+def test_cancelled_future_is_skipped_and_thread_survives():
+    gate = _Gate()
+    batcher = RetrievalBatcher(batch_fn=gate, max_batch=8, window_s=0.0)
+
+    # Hold the thread inside a batch while more prompts queue up behind it
+    first = batcher.submit("a")
+    assert gate.started.wait(TIMEOUT_S)
+    kept = batcher.submit("bb")
+    cancelled = batcher.submit("ccc")
+    assert cancelled.cancel()
+
+    gate.release.set()
+    assert first.result(TIMEOUT_S) == 1
+    assert kept.result(TIMEOUT_S) == 2
+    assert all("ccc" not in batch for batch in gate.batches)
+    assert batcher._thread.is_alive()
+    assert batcher.submit("dddd").result(TIMEOUT_S) == 4
+    batcher.close()
+
+
+def test_future_finished_elsewhere_does_not_kill_thread():
+    def batch_fn(prompts):
+        # Another party resolves a future while its batch is running
+        if not stolen.done():
+            stolen.set_result(-1)
+        return [0] * len(prompts)
+
+    batcher = RetrievalBatcher(batch_fn=batch_fn, max_batch=8, window_s=0.0)
+    stolen = batcher.submit("a")
+    assert stolen.result(TIMEOUT_S) == -1
+    assert batcher.submit("b").result(TIMEOUT_S) == 0
+    batcher.close()
+
+
+def test_exception_fans_out_to_every_future():
+    def batch_fn(prompts):
+        raise RuntimeError("encoder down")
+
+    batcher = RetrievalBatcher(batch_fn=batch_fn, max_batch=8, window_s=0.01)
+    futures = [batcher.submit(p) for p in "abc"]
+    for f in futures:
+        with pytest.raises(RuntimeError, match="encoder down"):
+            f.result(TIMEOUT_S)
+    batcher.close()
+
+
+# The first thread dies on purpose
+@pytest.mark.filterwarnings("ignore::pytest.PytestUnhandledThreadExceptionWarning")
+def test_submit_restarts_a_dead_thread():
+    class Fatal(BaseException):
+        pass
+
+    calls = []
+
+    def batch_fn(prompts):
+        calls.append(prompts)
+        if len(calls) == 1:
+            raise Fatal()
+        return [1] * len(prompts)
+
+    batcher = RetrievalBatcher(batch_fn=batch_fn, max_batch=8, window_s=0.0)
+    batcher.submit("a")
+    batcher._thread.join(TIMEOUT_S)
+    assert not batcher._thread.is_alive()
+    assert batcher.submit("b").result(TIMEOUT_S) == 1
+    batcher.close()
@@ -0,0 +1,66 @@
+import json
+
+import faiss
+import numpy as np
+import pytest
+
+from retrieval import build_index as B
+
+DIM = 8
+CAPTIONS = ["a", "b", "c", "d"]
+
+
+def _vec(text: str) -> np.ndarray:
+    rng = np.random.default_rng(sum(map(ord, text)) * 7919 + len(text))
+    vec = rng.standard_normal(DIM).astype(np.float32)
+    return vec / np.linalg.norm(vec)
+
+
+@pytest.fixture
+def index_dir(tmp_path, monkeypatch):
+    """A flat index of the store captions, with only a legacy index_map.json."""
+    for name in ("INDEX_PATH", "MAP_PATH", "LEGACY_MAP_PATH", "META_PATH",
+                 "APPENDED_PROMPTS_PATH", "APPENDED_EMBEDDINGS_PATH"):
+        monkeypatch.setattr(B, name, tmp_path / getattr(B, name).name)
+    store = np.stack([_vec(c) for c in CAPTIONS])
+    monkeypatch.setattr(B.embedding_store, "is_available", lambda: True)
+    monkeypatch.setattr(B.embedding_store, "read_prompts", lambda: list(CAPTIONS))
+    monkeypatch.setattr(B, "load_embeddings", lambda: store)
+    monkeypatch.setattr(B, "encode_prompts",
+                        lambda prompts, batch_size=256: np.stack([_vec(p) for p in prompts]))
+
+    index = faiss.IndexFlatIP(DIM)
+    index.add(store)
+    faiss.write_index(index, str(B.INDEX_PATH))
+    B.LEGACY_MAP_PATH.write_text(json.dumps(list(range(len(CAPTIONS)))))
+    return tmp_path
+
+
+def _append(tmp_path, rows) -> None:
+    path = tmp_path / "new.jsonl"
+    path.write_text("".join(json.dumps({"prompt": p, "dataset_idx": i}) + "\n" for i, p in rows))
+    B.append(path)
+
+
+def _nearest(text: str) -> int:
+    index = faiss.read_index(str(B.INDEX_PATH))
+    _, ids = index.search(_vec(text)[None], 1)
+    return int(np.load(B.MAP_PATH)[ids[0, 0]])
+
+
+def test_append_to_legacy_index_adds_new_pairs_only(index_dir):
+    _append(index_dir, [(1, "b"), (1, "another b"), (9, "new"), (9, "new")])
+    assert faiss.read_index(str(B.INDEX_PATH)).ntotal == 6
+    assert np.load(B.MAP_PATH).tolist() == [0, 1, 2, 3, 1, 9]
+    assert B.load_appended()[0] == [(1, "another b"), (9, "new")]
+    assert _nearest("another b") == 1 and _nearest("new") == 9
+
+    _append(index_dir, [(9, "new")])
+    assert faiss.read_index(str(B.INDEX_PATH)).ntotal == 6
+
+
+def test_build_keeps_appended_rows(index_dir):
+    _append(index_dir, [(9, "new")])
+    B.build()
+    assert np.load(B.MAP_PATH).tolist() == [0, 1, 2, 3, 9]
+    assert _nearest("new") == 9
@@ -0,0 +1,185 @@
+import os
+import pickle
+import time
+
+import numpy as np
+import pytest
+
+import cache as cache_module
+from cache import LRUCache, SemanticCache
+
+
+def _unit(*values) -> np.ndarray:
+    vec = np.array(values, dtype=np.float32)
+    return vec / np.linalg.norm(vec)
+
+
+def _disk_cache(max_entries, tmp_path, **kwargs) -> LRUCache:
+    return LRUCache(max_entries, disk_dir=str(tmp_path), to_arrays=lambda v: {"v": np.array(v)},
+                    from_arrays=lambda arrays: int(arrays["v"]), **kwargs)
+
+
+class _Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def test_lru_evicts_least_recently_used():
+    cache = LRUCache(2)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    assert cache.get("a") == 1  # b is now the least recent
+    cache.put("c", 3)
+    assert [cache.get(k) for k in "abc"] == [1, None, 3]
+    stats = cache.stats()
+    assert (stats["entries"], stats["evictions"]) == (2, 1)
+    assert (stats["hits"], stats["misses"]) == (3, 1)
+
+
+def test_lru_put_replaces_value():
+    cache = LRUCache(2)
+    cache.put("a", 1)
+    cache.put("a", 2)
+    assert cache.get("a") == 2 and cache.stats()["entries"] == 1
+
+
+def test_lru_entries_expire_after_ttl(monkeypatch):
+    clock = _Clock()
+    monkeypatch.setattr(cache_module.time, "monotonic", clock)
+    cache = LRUCache(4, ttl=10)
+    cache.put("a", 1)
+    clock.now += 9.9
+    assert cache.get("a") == 1
+    clock.now += 0.1
+    assert cache.get("a") is None
+    assert cache.stats()["entries"] == 0
+
+
+def test_lru_disk_tier_outlives_memory_eviction(tmp_path):
+    cache = _disk_cache(1, tmp_path, disk_entries=2)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    assert cache.get("a") == 1
+    assert cache.stats()["disk_hits"] == 1
+    cache.put("c", 3)
+    # Only the two most recent entries stay on disk
+    assert len(list(tmp_path.glob("*.npz"))) == 2
+
+    reopened = _disk_cache(1, tmp_path)
+    assert (reopened.get("b"), reopened.get("c"), reopened.get("a")) == (2, 3, None)
+
+
+def test_lru_disk_entries_expire_after_ttl(tmp_path):
+    cache = _disk_cache(1, tmp_path, ttl=60)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    old = time.time() - 61
+    for path in tmp_path.glob("*.npz"):
+        os.utime(path, (old, old))
+    assert cache.get("a") is None
+    assert cache.stats()["disk_entries"] == 1
+
+
+def test_lru_clear_removes_disk_entries(tmp_path):
+    cache = _disk_cache(2, tmp_path)
+    cache.put("a", 1)
+    cache.clear()
+    assert cache.get("a") is None
+    assert not list(tmp_path.glob("*.npz"))
+
+
+def test_lru_disk_tier_never_unpickles(tmp_path):
+    cache = _disk_cache(1, tmp_path)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    path = next(p for p in tmp_path.glob("*.npz") if p.stem == cache._disk_name("a"))
+    path.write_bytes(pickle.dumps({"v": 1}))
+    assert cache.get("a") is None
+    path.write_bytes(b"PK\x03\x04 truncated")
+    assert cache.get("a") is None
+
+
+def test_lru_disk_tier_needs_converters(tmp_path):
+    with pytest.raises(ValueError):
+        LRUCache(1, disk_dir=str(tmp_path))
+
+
+def test_semantic_hit_above_threshold_only():
+    cache = SemanticCache(4, threshold=0.95)
+    cache.put(_unit(1, 0, 0), "castle")
+    near, far = _unit(1, 0.1, 0), _unit(1, 1, 0)
+    assert cache.get_batch(np.stack([near, far])) == ["castle", None]
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"]) == (1, 1)
+
+
+def test_semantic_put_updates_matching_entry():
+    cache = SemanticCache(4, threshold=0.95)
+    cache.put(_unit(1, 0, 0), 1)
+    cache.put(_unit(1, 0.05, 0), 2)
+    assert cache.stats()["entries"] == 1
+    assert cache.get_batch(_unit(1, 0, 0)[None]) == [2]
+
+
+def test_semantic_evicts_least_recently_used():
+    cache = SemanticCache(2, threshold=0.99)
+    a, b, c = _unit(1, 0, 0), _unit(0, 1, 0), _unit(0, 0, 1)
+    cache.put(a, "a")
+    cache.put(b, "b")
+    cache.get_batch(a[None])  # a is now the most recent
+    cache.put(c, "c")
+    assert cache.get_batch(np.stack([a, b, c])) == ["a", None, "c"]
+    assert cache.stats()["evictions"] == 1
+
+
+def test_semantic_clear_keeps_counters():
+    cache = SemanticCache(2)
+    cache.put(_unit(1, 0), "a")
+    cache.get_batch(_unit(1, 0)[None])
+    cache.clear()
+    assert cache.get_batch(_unit(1, 0)[None]) == [None]
+    assert cache.stats()["entries"] == 0 and cache.stats()["hits"] == 1
+    cache.put(_unit(0, 1), "b")
+    assert cache.get_batch(_unit(0, 1)[None]) == ["b"]
+
+
+def test_generate_reads_results_from_disk_off_the_loop(monkeypatch, tmp_path):
+    from fastapi.testclient import TestClient
+
+    import main
+    from retrieval.voxel_to_schem import VoxelBuild
+    from sparse import SparseVolume
+
+    volume = np.zeros((2, 3, 4), dtype=np.uint16)
+    volume[0, 1, 2] = volume[1, 2, 3] = 1
+    build = VoxelBuild(4, 2, 3, ["minecraft:air", "minecraft:stone"],
+                       SparseVolume.from_dense(volume), (1, 2, 3))
+    converted = []
+
+    def convert(idx, dither):
+        converted.append(idx)
+        return build
+
+    # No memory tier, so every lookup goes to disk
+    disk_cache = LRUCache(0, disk_dir=str(tmp_path), to_arrays=main.result_cache.to_arrays,
+                          from_arrays=main.result_cache.from_arrays)
+    monkeypatch.setattr(main, "result_cache", disk_cache)
+    monkeypatch.setattr(main, "load_index", lambda: None)
+    monkeypatch.setattr(main, "load_converter", lambda: None)
+    monkeypatch.setattr(main, "PROCESS_WORKERS", 0)
+    monkeypatch.setattr(main, "BATCH_WINDOW_MS", 0)
+    monkeypatch.setattr(main, "retrieve", lambda prompt, k, cache: 5)
+    monkeypatch.setattr(main, "voxel_to_build", convert)
+    monkeypatch.setattr(main, "write_worldedit_schem", lambda build, name: None)
+    with TestClient(main.app) as client:
+        first = client.post("/generate", json={"prompt": "a disk cached build"})
+        second = client.post("/generate", json={"prompt": "a disk cached build"})
+        stages = main.worker_pool.stats()["stages"]
+    assert first.status_code == second.status_code == 200
+    assert first.json() == second.json()
+    assert converted == [5]
+    assert disk_cache.stats()["disk_hits"] == 1
+    assert stages["result_cache"]["count"] == 3
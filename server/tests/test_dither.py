@@ -0,0 +1,36 @@
+import numpy as np
+import pytest
+
+import col2block
+from retrieval.voxel_to_schem import voxels_to_build
+
+
+def _voxels(n=2000, seed=0) -> tuple[np.ndarray, np.ndarray]:
+    rng = np.random.default_rng(seed)
+    coords = np.unique(rng.integers(0, 16, (n, 3)), axis=0)
+    return coords, rng.random((len(coords), 3), dtype=np.float32)
+
+
+def _placed(build) -> dict:
+    """(x, y, z) -> block state of every voxel of a VoxelBuild."""
+    v = build.voxels
+    ox, oy, oz = build.offset
+    return {(x + ox, y + oy, z + oz): build.palette[i] for x, y, z, i in
+            zip(v.xs.tolist(), v.ys.tolist(), v.zs.tolist(), v.ids.tolist())}
+
+
+def test_no_dither_matches_exactly_by_default(monkeypatch):
+    monkeypatch.setattr(col2block, "USE_LUT", False)
+    coords, rgb = _voxels()
+    rgba = np.concatenate([rgb, np.ones((len(rgb), 1), dtype=np.float32)], axis=1)
+    ids = col2block.col2index(rgba, exact=True)
+    exact = col2block.block_names[ids]
+    expected = {tuple(c): f"minecraft:{name}" for c, name in zip(coords.tolist(), exact)}
+    assert _placed(voxels_to_build(coords, rgb, dither="none")) == expected
+
+
+@pytest.mark.parametrize("mode", ["ordered", "diffusion"])
+def test_dither_places_every_voxel(mode):
+    coords, rgb = _voxels()
+    placed = _placed(voxels_to_build(coords, rgb, dither=mode))
+    assert set(placed) == set(map(tuple, coords.tolist()))
@@ -0,0 +1,119 @@
+import gzip
+import json
+
+import numpy as np
+import pytest
+
+import response_format as rf
+from sparse import SparseVolume
+
+PALETTE = ["minecraft:air", "minecraft:stone", "minecraft:cave_air", "minecraft:oak_planks"]
+META = {"schematic_path": "generated.schem", "width": 4, "height": 3, "length": 5}
+BINARY = "application/octet-stream"
+COLUMNAR = "application/x-voxel-columnar+json"
+
+
+def _voxels() -> SparseVolume:
+    rng = np.random.default_rng(0)
+    return SparseVolume.from_dense(rng.integers(0, len(PALETTE), (3, 5, 4)).astype(np.uint16))
+
+
+def test_binary_round_trip():
+    voxels = _voxels()
+    decoded = rf.decode_binary(rf.encode("binary", META, voxels, PALETTE))
+    assert {k: decoded[k] for k in META} == META
+
+    solid = rf.solid_voxels(voxels, PALETTE)
+    assert decoded["count"] == solid.count
+    for name, column in zip("xyz", (solid.xs, solid.ys, solid.zs)):
+        assert np.array_equal(decoded[name], column)
+    blocks = np.array(decoded["palette"])[decoded["p"]]
+    assert blocks.tolist() == [PALETTE[i] for i in solid.ids.tolist()]
+
+
+def test_binary_rejects_other_bodies():
+    with pytest.raises(ValueError):
+        rf.decode_binary(b'{"blocks": []}')
+
+
+def test_columnar_matches_binary():
+    voxels = _voxels()
+    columnar = json.loads(rf.encode("columnar", META, voxels, PALETTE))
+    binary = rf.decode_binary(rf.encode("binary", META, voxels, PALETTE))
+    assert columnar["palette"] == binary["palette"]
+    for name in "xyzp":
+        assert columnar[name] == binary[name].tolist()
+
+
+@pytest.mark.parametrize("header, expected", [
+    (None, None),
+    ("gzip", "gzip"),
+    ("GZIP;q=0.5", "gzip"),
+    ("gzip;q=0", None),
+    ("gzip;q=0.0, identity", None),
+    ("*", "gzip"),
+    ("*;q=0", None),
+    ("*, gzip;q=0", None),
+    ("br, gzip;q=bad", None),
+])
+def test_compress_honours_q_values(monkeypatch, header, expected):
+    monkeypatch.setattr(rf, "zstandard", None)
+    body, encoding = rf.compress(b"x" * 1000, header)
+    assert encoding == expected
+    assert (gzip.decompress(body) if encoding else body) == b"x" * 1000
+
+
+def test_compress_prefers_zstd_unless_refused():
+    pytest.importorskip("zstandard")
+    assert rf.compress(b"x" * 1000, "zstd, gzip")[1] == "zstd"
+    assert rf.compress(b"x" * 1000, "zstd;q=0, gzip")[1] == "gzip"
+    assert rf.compress(b"x" * 1000, "zstd;q=0.5, gzip")[1] == "gzip"
+
+
+def test_negotiate_format_uses_q_values():
+    assert rf.negotiate_format(None, f"{BINARY}, {COLUMNAR}") == "binary"
+    assert rf.negotiate_format(None, f"{BINARY};q=0, {COLUMNAR}") == "columnar"
+    assert rf.negotiate_format(None, f"{BINARY};q=0.2, {COLUMNAR};q=0.8") == "columnar"
+    assert rf.negotiate_format(None, f"{BINARY};q=0") == "json"
+    assert rf.negotiate_format("columnar", BINARY) == "columnar"
+
+
+def test_stream_framing_uses_q_values():
+    assert rf.negotiate_stream_framing("text/event-stream") == "sse"
+    assert rf.negotiate_stream_framing("text/event-stream;q=0") == "ndjson"
+    assert rf.negotiate_stream_framing(None) == "ndjson"
+
+
+@pytest.mark.parametrize("accept, expected", [
+    (f"application/json, {BINARY};q=0.1", "json"),
+    ("application/json, application/msgpack;q=0.5", "json"),
+    (f"{BINARY}, */*", "binary"),
+    (f"*/*, {BINARY}", "binary"),
+    (f"*/*, {BINARY};q=0.5", "json"),
+    ("*/*", "json"),
+])
+def test_negotiate_format_ranks_json(accept, expected):
+    assert rf.negotiate_format(None, accept) == expected
+
+
+def test_generate_sets_vary(monkeypatch):
+    from fastapi.testclient import TestClient
+
+    import main
+    from retrieval.voxel_to_schem import VoxelBuild
+
+    build = VoxelBuild(4, 3, 5, PALETTE, _voxels(), (0, 0, 0))
+    monkeypatch.setattr(main, "load_index", lambda: None)
+    monkeypatch.setattr(main, "load_converter", lambda: None)
+    monkeypatch.setattr(main, "PROCESS_WORKERS", 0)
+    monkeypatch.setattr(main, "BATCH_WINDOW_MS", 0)
+    monkeypatch.setattr(main, "retrieve", lambda prompt, k, cache: 7)
+    monkeypatch.setattr(main, "voxel_to_build", lambda idx, dither: build)
+    monkeypatch.setattr(main, "write_worldedit_schem", lambda build, name: None)
+    with TestClient(main.app) as client:
+        response = client.post("/generate", json={"prompt": "a vary test"},
+                               headers={"Accept": BINARY, "Accept-Encoding": "gzip"})
+    assert response.status_code == 200
+    assert response.headers["Vary"] == "Accept, Accept-Encoding"
+    assert rf.decode_binary(response.content)["count"] == rf.solid_voxels(build.voxels,
+                                                                          PALETTE).count
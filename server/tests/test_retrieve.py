@@ -0,0 +1,86 @@
+import faiss
+import numpy as np
+import pytest
+
+from retrieval import retrieve as R
+
+
+@pytest.fixture
+def ivf(monkeypatch):
+    """IVF index whose only populated list is far from the query side."""
+    d = 8
+    rng = np.random.default_rng(0)
+    quantizer = faiss.IndexFlatIP(d)
+    index = faiss.IndexIVFFlat(quantizer, d, 2, faiss.METRIC_INNER_PRODUCT)
+    centroids = np.eye(d, dtype=np.float32)[[0, 1]]
+    index.train(np.repeat(centroids, 20, axis=0) + rng.normal(0, 0.01, (40, d)).astype(np.float32))
+    data = np.tile(centroids[0], (5, 1))
+    index.add(data)
+    index.nprobe = 1
+    monkeypatch.setattr(R, "_index", index)
+    monkeypatch.setattr(R, "_index_map", np.arange(5) + 100)
+    monkeypatch.setattr(R, "encode_prompts",
+                        lambda prompts: np.stack([centroids[p] for p in prompts]))
+    return index
+
+
+def test_retrieve_batch_maps_hits_and_misses(ivf):
+    # Prompt 0 probes the populated list, prompt 1 only the empty one
+    results = R.retrieve_batch([0, 1])
+    assert results[0] in range(100, 105)
+    assert results[1] is None
+
+
+def test_retrieve_raises_on_no_neighbour(ivf):
+    with pytest.raises(R.NoMatch):
+        R.retrieve(1)
+
+
+def test_semantic_cache_skips_no_neighbour(ivf):
+    from cache import SemanticCache
+
+    cache = SemanticCache(4)
+    assert R.retrieve_batch([1], cache=cache) == [None]
+    assert cache.stats()["entries"] == 0
+
+
+def test_generate_returns_404_without_a_neighbour(monkeypatch):
+    from fastapi.testclient import TestClient
+
+    import main
+
+    def no_match(prompt, k=1, cache=None):
+        raise R.NoMatch(prompt)
+
+    monkeypatch.setattr(main, "load_index", lambda: None)
+    monkeypatch.setattr(main, "load_converter", lambda: None)
+    monkeypatch.setattr(main, "PROCESS_WORKERS", 0)
+    monkeypatch.setattr(main, "BATCH_WINDOW_MS", 0)
+    monkeypatch.setattr(main, "retrieve", no_match)
+    with TestClient(main.app) as client:
+        response = client.post("/generate", json={"prompt": "an unmatched prompt"})
+    assert response.status_code == 404
+    assert main.prompt_cache.get("an unmatched prompt") is None
+
+
+@pytest.mark.parametrize("token, sent, status", [
+    (None, None, 404),
+    (None, "anything", 404),
+    ("secret", None, 403),
+    ("secret", "wrong", 403),
+    ("secret", "secret", 200),
+])
+def test_admin_reload_needs_the_token(monkeypatch, token, sent, status):
+    from fastapi.testclient import TestClient
+
+    import main
+
+    monkeypatch.setattr(main, "load_index", lambda: None)
+    monkeypatch.setattr(main, "load_converter", lambda: None)
+    monkeypatch.setattr(main, "PROCESS_WORKERS", 0)
+    monkeypatch.setattr(main, "ADMIN_TOKEN", token)
+    monkeypatch.setattr(main, "_reload_and_clear", lambda: {"reloaded": True})
+    headers = {"X-Admin-Token": sent} if sent is not None else {}
+    with TestClient(main.app) as client:
+        response = client.post("/admin/reload-index", headers=headers)
+    assert response.status_code == status
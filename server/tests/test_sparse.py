@@ -0,0 +1,62 @@
+import numpy as np
+
+from sparse import SparseVolume
+
+
+def _volume(shape=(4, 3, 5), seed=0) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    volume = rng.integers(1, 50, shape).astype(np.uint16)
+    volume[rng.random(shape) < 0.6] = 0
+    return volume
+
+
+def test_dense_round_trip():
+    volume = _volume()
+    sparse = SparseVolume.from_dense(volume)
+    assert (sparse.height, sparse.length, sparse.width) == volume.shape
+    assert sparse.count == np.count_nonzero(volume)
+    assert np.array_equal(sparse.to_dense(), volume)
+
+
+def test_cells_are_in_blockdata_order():
+    sparse = SparseVolume.from_dense(_volume())
+    index = sparse.linear_index()
+    assert np.all(np.diff(index) > 0)
+    assert np.array_equal(index, np.flatnonzero(sparse.to_dense()))
+
+
+def test_from_coords_sorts_into_blockdata_order():
+    expected = SparseVolume.from_dense(_volume())
+    shuffle = np.random.default_rng(1).permutation(expected.count)
+    sparse = SparseVolume.from_coords(
+        expected.width, expected.height, expected.length,
+        expected.xs[shuffle], expected.ys[shuffle], expected.zs[shuffle],
+        expected.ids[shuffle])
+    for name in ("xs", "ys", "zs", "ids"):
+        assert np.array_equal(getattr(sparse, name), getattr(expected, name))
+
+
+def test_layers_are_bottom_up_slices():
+    volume = _volume()
+    volume[1] = 0  # an empty layer is skipped
+    sparse = SparseVolume.from_dense(volume)
+    layers = list(sparse.layers())
+    assert [y for y, _ in layers] == [y for y in range(volume.shape[0]) if volume[y].any()]
+    for y, cells in layers:
+        assert np.all(sparse.ys[cells] == y)
+        assert len(sparse.ids[cells]) == np.count_nonzero(volume[y])
+    assert sum(cells.stop - cells.start for _, cells in layers) == sparse.count
+
+
+def test_select_keeps_order():
+    sparse = SparseVolume.from_dense(_volume())
+    keep = sparse.ids % 2 == 0
+    selected = sparse.select(keep)
+    assert np.array_equal(selected.ids, sparse.ids[keep])
+    assert np.all(np.diff(selected.linear_index()) > 0)
+
+
+def test_empty():
+    sparse = SparseVolume.empty(2, 3, 4)
+    assert sparse.count == 0 and list(sparse.layers()) == []
+    assert sparse.to_dense().shape == (3, 4, 2) and not sparse.to_dense().any()
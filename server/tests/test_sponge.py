@@ -0,0 +1,68 @@
+import io
+
+import nbtlib
+import numpy as np
+import pytest
+
+from sponge import decode_block_data, encode_block_data, read_schem, write_schem
+
+
+def _volume(palette_size: int, shape=(5, 6, 7)) -> tuple[list, np.ndarray]:
+    rng = np.random.default_rng(palette_size)
+    palette = ["minecraft:air"] + [f"minecraft:block_{i}" for i in range(palette_size - 1)]
+    return palette, rng.integers(0, palette_size, shape).astype(np.uint16)
+
+
+@pytest.mark.parametrize("palette_size", [2, 128, 129, 300, 20000])
+def test_block_data_round_trip(palette_size):
+    # 128 is the last single-byte varint palette; 20000 needs three bytes
+    _, volume = _volume(palette_size)
+    height, length, width = volume.shape
+    data = encode_block_data(volume, palette_size)
+    assert np.array_equal(decode_block_data(data, width, height, length, palette_size), volume)
+
+
+@pytest.mark.parametrize("version", [2, 3])
+@pytest.mark.parametrize("palette_size", [5, 300])
+def test_write_read_round_trip(tmp_path, version, palette_size):
+    palette, volume = _volume(palette_size)
+    path = tmp_path / "build.schem"
+    write_schem(path, palette, volume, offset=(3, -2, 7), version=version)
+    read_palette, read_volume, offset = read_schem(path)
+    assert np.array_equal(np.array(read_palette)[read_volume], np.array(palette)[volume])
+    assert offset == (3, -2, 7)
+
+
+def test_write_to_buffer_matches_file(tmp_path):
+    palette, volume = _volume(5)
+    buffer = io.BytesIO()
+    write_schem(buffer, palette, volume)
+    write_schem(tmp_path / "a.schem", palette, volume)
+    # gzip mtime is fixed, so identical builds give identical bytes
+    assert buffer.getvalue() == (tmp_path / "a.schem").read_bytes()
+    buffer.seek(0)
+    assert np.array_equal(read_schem(buffer)[1], volume)
+
+
+def test_v2_layout(tmp_path):
+    palette, volume = _volume(5)
+    write_schem(tmp_path / "a.schem", palette, volume, data_version=3953)
+    schem = nbtlib.load(tmp_path / "a.schem")
+    assert schem.root_name == "Schematic"
+    assert (int(schem["Version"]), int(schem["DataVersion"])) == (2, 3953)
+    assert (int(schem["Width"]), int(schem["Height"]), int(schem["Length"])) == (7, 5, 6)
+    assert int(schem["PaletteMax"]) == len(palette)
+
+
+def test_v3_layout(tmp_path):
+    palette, volume = _volume(5)
+    write_schem(tmp_path / "a.schem", palette, volume, version=3)
+    schem = nbtlib.load(tmp_path / "a.schem")["Schematic"]
+    assert int(schem["Version"]) == 3
+    assert set(schem["Blocks"]) == {"Palette", "Data", "BlockEntities"}
+
+
+def test_unknown_version_rejected(tmp_path):
+    palette, volume = _volume(5)
+    with pytest.raises(ValueError):
+        write_schem(tmp_path / "a.schem", palette, volume, version=4)
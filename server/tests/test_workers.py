@@ -0,0 +1,61 @@
+import asyncio
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+
+from workers import Saturated, WorkerPool
+
+
+def _square(x):
+    return x * x
+
+
+@pytest.fixture
+def pool():
+    pool = WorkerPool(thread_workers=2, process_workers=0, max_pending=1)
+    yield pool
+    pool.shutdown()
+
+
+def test_admit_rejects_beyond_max_pending(pool):
+    async def run():
+        async with pool.admit():
+            with pytest.raises(Saturated):
+                async with pool.admit():
+                    pass
+        # The slot is free again once the first request is done
+        async with pool.admit():
+            return await pool.run_thread("square", _square, 3)
+
+    assert asyncio.run(run()) == 9
+    stats = pool.stats()
+    assert stats["rejected"] == 1 and stats["pending"] == 0
+    assert stats["stages"]["square"]["count"] == 1
+
+
+def test_generate_returns_503_when_saturated(monkeypatch):
+    from fastapi.testclient import TestClient
+
+    import main
+
+    monkeypatch.setattr(main, "load_index", lambda: None)
+    monkeypatch.setattr(main, "load_converter", lambda: None)
+    monkeypatch.setattr(main, "PROCESS_WORKERS", 0)
+    monkeypatch.setattr(main, "MAX_PENDING", 0)
+    with TestClient(main.app) as client:
+        response = client.post("/generate", json={"prompt": "a castle"})
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == "1"
+    assert main.worker_pool.rejected == 1
+
+
+@pytest.mark.skipif(not hasattr(os, "fork"), reason="prefork needs os.fork")
+def test_prefork_refuses_clip_in_the_master():
+    env = dict(os.environ, WEB_WORKERS="2", CLIP_PROCESS="0")
+    proc = subprocess.run([sys.executable, "main.py"], cwd=Path(__file__).parent.parent,
+                          env=env, capture_output=True, text=True, timeout=120)
+    assert proc.returncode == 1
+    assert "CLIP_PROCESS=0" in proc.stderr
@@ -0,0 +1,141 @@
+"""
+Executor stage for the /generate pipeline.
+
+Blocking work is pushed off the asyncio event loop: GIL-releasing torch /
+faiss calls go to a thread pool, Python-heavy voxel conversion to a process
+pool. Admission is bounded, so once max_pending requests are in flight new
+ones are rejected (503) instead of queueing without limit.
+"""
+
+import asyncio
+import functools
+import multiprocessing
+import threading
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from typing import Callable, Optional
+
+import metrics
+
+
+# forkserver where available (POSIX), else spawn (Windows)
+_START_METHOD = ("forkserver" if "forkserver" in multiprocessing.get_all_start_methods()
+                 else "spawn")
+
+
+class Saturated(Exception):
+    """Raised by WorkerPool.admit() when max_pending requests are in flight."""
+
+
+def _timed(fn: Callable, args: tuple, submitted: float):
+    # Runs inside the worker; wall clock so it is comparable across processes.
+    # Spans recorded by fn travel back with the result.
+    started = time.time()
+    result, spans = metrics.collected_call(fn, args)
+    return result, started - submitted, time.time() - started, spans
+
+
+class StageStats:
+    """Queue wait and run time totals for one pipeline stage."""
+
+    def __init__(self):
+        self.count = 0
+        self.wait_s = 0.0
+        self.run_s = 0.0
+        self.max_wait_s = 0.0
+        self.max_run_s = 0.0
+
+    def add(self, wait_s: float, run_s: float) -> None:
+        self.count += 1
+        self.wait_s += wait_s
+        self.run_s += run_s
+        self.max_wait_s = max(self.max_wait_s, wait_s)
+        self.max_run_s = max(self.max_run_s, run_s)
+
+    def as_dict(self) -> dict:
+        n = self.count or 1
+        return {
+            "count": self.count,
+            "avg_wait_ms": 1e3 * self.wait_s / n,
+            "avg_run_ms": 1e3 * self.run_s / n,
+            "max_wait_ms": 1e3 * self.max_wait_s,
+            "max_run_ms": 1e3 * self.max_run_s,
+        }
+
+
+class WorkerPool:
+    """
+    thread_workers       threads for torch / faiss / encoding work
+    process_workers      processes for voxel conversion; 0 runs it on threads
+    max_pending          requests admitted at once before returning 503
+    process_initializer  run once per worker process, e.g. to load the matcher
+    """
+
+    def __init__(
+        self,
+        thread_workers: int,
+        process_workers: int,
+        max_pending: int,
+        process_initializer: Optional[Callable] = None,
+    ):
+        self.max_pending = max_pending
+        self.pending = 0
+        self.rejected = 0
+        self._threads = ThreadPoolExecutor(thread_workers, thread_name_prefix="generate")
+        # The pool starts after torch / faiss threads are running, and fork()
+        # with live threads can deadlock the child on their locks; forkserver
+        # children come from a clean single-threaded process instead
+        self._processes: Optional[Executor] = (
+            ProcessPoolExecutor(process_workers, initializer=process_initializer,
+                                mp_context=multiprocessing.get_context(_START_METHOD))
+            if process_workers > 0 else None
+        )
+        self._stats: dict[str, StageStats] = {}
+        self._lock = threading.Lock()
+
+    @asynccontextmanager
+    async def admit(self):
+        """Hold one of max_pending request slots, or raise Saturated."""
+        if self.pending >= self.max_pending:
+            self.rejected += 1
+            raise Saturated(f"{self.pending} requests already in flight")
+        self.pending += 1
+        try:
+            yield
+        finally:
+            self.pending -= 1
+
+    async def run_thread(self, stage: str, fn: Callable, *args):
+        return await self._run(self._threads, stage, fn, args)
+
+    async def run_process(self, stage: str, fn: Callable, *args):
+        return await self._run(self._processes or self._threads, stage, fn, args)
+
+    async def _run(self, executor: Executor, stage: str, fn: Callable, args: tuple):
+        loop = asyncio.get_running_loop()
+        call = functools.partial(_timed, fn, args, time.time())
+        result, wait_s, run_s, spans = await loop.run_in_executor(executor, call)
+        with self._lock:
+            self._stats.setdefault(stage, StageStats()).add(wait_s, run_s)
+        if metrics.ENABLED:
+            metrics.queue_wait_seconds.observe(wait_s, stage)
+            metrics.record(stage, run_s)
+            for name, seconds in spans:
+                metrics.record(name, seconds)
+        return result
+
+    def stats(self) -> dict:
+        with self._lock:
+            stages = {name: s.as_dict() for name, s in self._stats.items()}
+        return {
+            "pending": self.pending,
+            "max_pending": self.max_pending,
+            "rejected": self.rejected,
+            "stages": stages,
+        }
+
+    def shutdown(self) -> None:
+        self._threads.shutdown(wait=False, cancel_futures=True)
+        if self._processes is not None:
+            self._processes.shutdown(wait=False, cancel_futures=True)